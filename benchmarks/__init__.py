@@ -0,0 +1,8 @@
+"""
+Benchmarks for stapler.
+
+corpus generates synthetic PDF files, run times stapler modes on them
+end-to-end and writes the results as JSON for comparison between
+commits, and inputs compares the ways of reading input files. See
+README.rst for usage.
+"""
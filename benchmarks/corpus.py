@@ -0,0 +1,153 @@
+"""Generate synthetic PDF files for benchmarking."""
+
+import os
+import random
+import zlib
+
+from PyPDF2 import PdfFileWriter
+from PyPDF2.generic import (ArrayObject, DecodedStreamObject,
+                            DictionaryObject, EncodedStreamObject,
+                            NameObject, NumberObject, createStringObject)
+from PyPDF2.pdf import PageObject
+
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+
+
+def _font():
+    font = DictionaryObject()
+    font.update({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+        NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+    })
+    return font
+
+
+def _image(size, seed):
+    """A SIZExSIZE RGB image of noise, which compresses badly."""
+    rng = random.Random(seed)
+    image = EncodedStreamObject()
+    image._data = zlib.compress(bytes(rng.getrandbits(8)
+                                      for _ in range(size * size * 3)))
+    image.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(size),
+        NameObject("/Height"): NumberObject(size),
+        NameObject("/ColorSpace"): NameObject("/DeviceRGB"),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+        NameObject("/Filter"): NameObject("/FlateDecode"),
+    })
+    return image
+
+
+def _contents(text, lines, compress):
+    operations = ["q 144 0 0 144 72 576 cm /Im0 Do Q", "BT /F1 11 Tf 72 540 Td"]
+    for line in range(lines):
+        operations.append("({} - line {}) Tj 0 -14 Td".format(text, line))
+    operations.append("ET")
+    data = "\n".join(operations).encode("latin-1")
+
+    if not compress:
+        stream = DecodedStreamObject()
+        stream._data = data
+        return stream
+    stream = EncodedStreamObject()
+    stream._data = zlib.compress(data)
+    stream[NameObject("/Filter")] = NameObject("/FlateDecode")
+    return stream
+
+
+def _page_labels(pages, chapter_length):
+    """Roman numbered front matter, then chapters numbered "<n>-<page>"."""
+    nums = ArrayObject()
+    front = min(pages, 4)
+    nums.append(NumberObject(0))
+    nums.append(DictionaryObject({NameObject("/S"): NameObject("/r")}))
+    for chapter, first in enumerate(range(front, pages, chapter_length), 1):
+        nums.append(NumberObject(first))
+        nums.append(DictionaryObject({
+            NameObject("/S"): NameObject("/D"),
+            NameObject("/P"): createStringObject("{}-".format(chapter)),
+        }))
+    labels = DictionaryObject()
+    labels[NameObject("/Nums")] = nums
+    return labels
+
+
+def make_pdf(filename, pages, image_size=64, lines=40, labels=None,
+             password=None, compress=True, seed=0):
+    """
+    Write a synthetic PDF file with PAGES pages.
+
+    All pages share one font and one IMAGE_SIZE square image, and have
+    LINES lines of text each. LABELS is the chapter length for /PageLabels
+    (None for no labels), PASSWORD encrypts the file and COMPRESS selects
+    Flate compressed or plain content streams. Files made with the same
+    SEED contain the same image.
+    """
+    writer = PdfFileWriter()
+    resources = DictionaryObject()
+    resources.update({
+        NameObject("/Font"): DictionaryObject({
+            NameObject("/F1"): writer._addObject(_font())}),
+        NameObject("/XObject"): DictionaryObject({
+            NameObject("/Im0"): writer._addObject(_image(image_size, seed))}),
+    })
+    resources = writer._addObject(resources)
+
+    name = os.path.basename(filename)
+    for pageno in range(1, pages + 1):
+        page = PageObject.createBlankPage(writer, PAGE_WIDTH, PAGE_HEIGHT)
+        page[NameObject("/Resources")] = resources
+        page[NameObject("/Contents")] = writer._addObject(
+            _contents("{} page {}".format(name, pageno), lines, compress))
+        writer.addPage(page)
+
+    if labels:
+        writer._root_object[NameObject("/PageLabels")] = writer._addObject(
+            _page_labels(pages, labels))
+    if password is not None:
+        writer.encrypt(password)
+
+    with open(filename, "wb") as stream:
+        writer.write(stream)
+    return filename
+
+
+def make_corpus(directory, pages=2000, files=20, image_size=256):
+    """
+    Create the benchmark corpus in DIRECTORY, unless it is there already.
+
+    Returns a dictionary of the generated files:
+
+    * large: one PAGES page file with page labels
+    * uncompressed: the same with plain content streams
+    * encrypted: the same encrypted with the password "secret"
+    * overlay: a single page, e.g. for background
+    * statements: FILES files of PAGES / FILES pages each, every one with
+      its own copy of the same image
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    def generate(name, *args, **kwargs):
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            make_pdf(path, *args, **kwargs)
+        return path
+
+    chapter = max(1, pages // 50)
+    return {
+        "large": generate("large.pdf", pages, image_size, labels=chapter),
+        "uncompressed": generate("uncompressed.pdf", pages, image_size,
+                                 labels=chapter, compress=False),
+        "encrypted": generate("encrypted.pdf", pages, image_size,
+                              password="secret"),
+        "overlay": generate("overlay.pdf", 1, image_size, lines=1, seed=1),
+        "statements": [generate("statement{:03d}.pdf".format(i),
+                                max(1, pages // files), image_size)
+                       for i in range(files)],
+    }
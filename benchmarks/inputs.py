@@ -0,0 +1,80 @@
+"""
+Compare reading input files through mmap and through file objects.
+
+Usage: python -m benchmarks.inputs [options]
+
+Parses the large file of the benchmark corpus and resolves every object
+in it, once with the memory-mapped input stapler uses and once with a
+buffered file object as before, and prints the fastest time of each.
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import tempfile
+import time
+
+from PyPDF2 import PdfFileReader
+from PyPDF2.generic import IndirectObject
+
+from staplelib import iohelper
+
+from . import corpus as corpus_module
+
+
+def open_file(filename):
+    return open(filename, "rb")
+
+
+SOURCES = [
+    ("file", open_file),
+    ("mmap", iohelper._open_input),
+]
+
+
+def resolve_all(filename, open_input):
+    """Parse FILENAME and load each of its objects; return the seconds."""
+    start = time.time()
+    stream = open_input(filename)
+    try:
+        reader = PdfFileReader(stream)
+        for generation, offsets in reader.xref.items():
+            for idnum in offsets:
+                if idnum == 0:
+                    continue  # the head of the free list
+                reader.getObject(IndirectObject(idnum, generation, reader))
+    finally:
+        stream.close()
+    return time.time() - start
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--corpus", default=os.path.join(
+        tempfile.gettempdir(), "stapler-bench-corpus"),
+        help="directory for the generated input files")
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per input source, the fastest one counts")
+    options = parser.parse_args(arguments)
+
+    # only the large file is used, but share the corpus with run.py
+    corpus_dir = os.path.join(options.corpus, "{}p-{}f-{}px".format(
+        options.pages, options.files, options.image_size))
+    large = corpus_module.make_corpus(corpus_dir, options.pages,
+                                      options.files,
+                                      options.image_size)["large"]
+
+    results = {}
+    for name, open_input in SOURCES:
+        results[name] = min(resolve_all(large, open_input)
+                            for _ in range(options.repeat))
+        print("{:<6} {:>9.3f}s".format(name, results[name]))
+    print("mmap change: {:+.1f}%".format(
+        100.0 * (results["mmap"] / results["file"] - 1)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Run a stapler command line in this process and record its cost.
+
+Usage: python -m benchmarks.measure RESULT.json PASSWORDS-JSON ARGS...
+
+Writes the wall time (including imports) and the peak resident memory of
+the process to RESULT.json. PASSWORDS-JSON maps encrypted input files to
+their passwords, so no prompt is needed.
+"""
+
+import json
+import sys
+import time
+
+
+def main():
+    start = time.time()
+    result_path, passwords = sys.argv[1], json.loads(sys.argv[2])
+
+    from staplelib import main as stapler_main
+    if passwords:
+        from staplelib import iohelper
+        iohelper.PASSWORDS.update(passwords)
+    try:
+        stapler_main(sys.argv[3:])
+        status = 0
+    except SystemExit as e:
+        status = e.code or 0
+
+    seconds = time.time() - start
+    from staplelib import iohelper
+    with open(result_path, "w") as stream:
+        json.dump({"seconds": seconds, "peak_rss": iohelper.peak_memory(),
+                   "status": status}, stream)
+
+
+if __name__ == "__main__":
+    main()
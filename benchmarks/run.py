@@ -0,0 +1,159 @@
+"""
+Time stapler modes end-to-end on a synthetic corpus.
+
+Usage: python -m benchmarks.run [options]
+
+Each scenario runs in a fresh process, so interpreter startup and imports
+are included like for a real stapler call. Results are printed and can be
+written as JSON with --output; --compare shows the change against such a
+file, e.g. from the previous commit.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from . import corpus as corpus_module
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+def scenarios(corpus, pages):
+    """Return (name, stapler arguments, input passwords) per scenario."""
+    large = corpus["large"]
+    statements = corpus["statements"]
+    half = max(1, pages // 2)
+    return [
+        ("cat", ["cat"] + statements + ["out.pdf"], {}),
+        ("cat-streaming", ["--streaming", "cat"] + statements + ["out.pdf"],
+         {}),
+        ("cat-dedup", ["--dedup", "cat"] + statements + ["out.pdf"], {}),
+        ("cat-prefetch", ["--streaming", "--prefetch", "4", "cat"] +
+         statements + ["out.pdf"], {}),
+        ("sel", ["sel", "A=" + large, "A{}-end".format(half), "A1-3",
+                 "out.pdf"], {}),
+        ("del", ["del", large, "1-{}".format(half), "out.pdf"], {}),
+        ("compress", ["compress", corpus["uncompressed"], "out.pdf"], {}),
+        ("compress-jobs", ["--jobs", "4", "compress", corpus["uncompressed"],
+                           "out.pdf"], {}),
+        ("zip", ["zip", large, corpus["uncompressed"], "out.pdf"], {}),
+        ("background", ["background", "A=" + corpus["overlay"]] +
+         ["A1"] * pages + [large, "out.pdf"], {}),
+        ("split", ["split", large], {}),
+        ("split-jobs", ["--jobs", "4", "split", large], {}),
+        ("info", ["info"] + statements, {}),
+        ("info-jobs", ["--jobs", "4", "--format", "jsonl", "info"] +
+         statements, {}),
+        ("list-log", ["list-log", large], {}),
+        ("cat-decrypt", ["cat", corpus["encrypted"], "out.pdf"],
+         {corpus["encrypted"]: "secret"}),
+        ("cat-encrypt", ["-u", "secret", "cat", large, "out.pdf"], {}),
+    ]
+
+
+def measure(arguments, passwords):
+    """Run stapler once in a new process; return its measurements."""
+    workdir = tempfile.mkdtemp(prefix="stapler-bench-")
+    result_path = os.path.join(workdir, "result.json")
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    try:
+        subprocess.check_call(
+            [sys.executable, "-m", "benchmarks.measure", result_path,
+             json.dumps(passwords)] + arguments,
+            cwd=workdir, env=env, stdout=subprocess.DEVNULL)
+        with open(result_path) as stream:
+            return json.load(stream)
+    finally:
+        shutil.rmtree(workdir)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT,
+            stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    """Print the relative change of each scenario against PREVIOUS."""
+    print()
+    print("{:<16} {:>10} {:>10} {:>8}".format("scenario", "before",
+                                              "after", "change"))
+    for name, result in results["scenarios"].items():
+        before = previous["scenarios"].get(name)
+        if not before:
+            continue
+        print("{:<16} {:>9.3f}s {:>9.3f}s {:>+7.1f}%".format(
+            name, before["seconds"], result["seconds"],
+            100.0 * (result["seconds"] / before["seconds"] - 1)))
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--corpus", default=os.path.join(
+        tempfile.gettempdir(), "stapler-bench-corpus"),
+        help="directory for the generated input files")
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per scenario, the fastest one counts")
+    parser.add_argument("--only", action="append",
+                        help="run only the given scenario (repeatable)")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare", help="results of an earlier run")
+    options = parser.parse_args(arguments)
+
+    # corpora of different sizes must not be mixed up
+    corpus_dir = os.path.join(options.corpus, "{}p-{}f-{}px".format(
+        options.pages, options.files, options.image_size))
+    corpus = corpus_module.make_corpus(corpus_dir, options.pages,
+                                       options.files, options.image_size)
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": {"pages": options.pages, "files": options.files,
+                   "image_size": options.image_size},
+        "scenarios": {},
+    }
+    for name, arguments, passwords in scenarios(corpus, options.pages):
+        if options.only and name not in options.only:
+            continue
+        runs = [measure(arguments, passwords)
+                for _ in range(options.repeat)]
+        failed = [run for run in runs if run["status"]]
+        if failed:
+            print("{:<16} failed with status {}".format(
+                name, failed[0]["status"]))
+            continue
+        best = min(runs, key=lambda run: run["seconds"])
+        results["scenarios"][name] = {
+            "seconds": best["seconds"],
+            "all_seconds": [run["seconds"] for run in runs],
+            "peak_rss": max(run["peak_rss"] or 0 for run in runs),
+        }
+        print("{:<16} {:>9.3f}s {:>8.1f} MiB".format(
+            name, best["seconds"],
+            results["scenarios"][name]["peak_rss"] / 1048576.0))
+
+    if options.output:
+        with open(options.output, "w") as stream:
+            json.dump(results, stream, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as stream:
+            compare(results, json.load(stream))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Run many stapler jobs from a manifest in a single process."""
+
+from __future__ import print_function
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+from . import CommandError, iohelper
+import staplelib
+
+# modes that cannot be used as a job
+NESTED_MODES = ("batch", "serve", "client")
+
+# number of recently used inputs kept parsed from one job to the next
+WARM_READERS = 32
+
+
+def read_manifest(stream):
+    """
+    Parse a manifest, one job per line.
+
+    A job is a JSON list of command line arguments, or an object with such
+    a list as "args" and an optional "id" to report it under. Returns a
+    list of (id, arguments) tuples; the id defaults to the line number.
+    """
+    jobs = []
+    for lineno, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            raise CommandError("Invalid job on line {}: {}".format(lineno, e))
+        jobid = lineno
+        if isinstance(job, dict):
+            jobid = job.get("id", lineno)
+            job = job.get("args")
+        if (not isinstance(job, list) or
+                not all(isinstance(arg, str) for arg in job)):
+            raise CommandError("Job on line {} is not a list of "
+                               "arguments".format(lineno))
+        jobs.append((jobid, job))
+    return jobs
+
+
+def run_job(jobid, arguments, defaults):
+    """
+    Run a single job and return a result dictionary for it.
+
+    Options not given in the job are taken from DEFAULTS. Errors are
+    reported in the result rather than raised, so one failing job does not
+    stop the others. The standard input and output belong to the batch or
+    server, so jobs cannot use "-" for them. The WARM_READERS most recently
+    used inputs stay open for later jobs, see iohelper.read_pdf().
+    """
+    from . import stapler
+
+    result = {"id": jobid, "args": arguments}
+    output = io.StringIO()
+    start = time.time()
+    try:
+        with contextlib.redirect_stdout(output):
+            try:
+                (options, args) = stapler.parse_arguments(arguments, defaults)
+            except SystemExit:
+                raise CommandError("Invalid arguments")
+            if options.mode not in stapler.MODES or \
+                    options.mode in NESTED_MODES:
+                raise CommandError("Invalid mode: {}".format(options.mode))
+            if not os.path.exists(options.destdir):
+                raise CommandError("cannot find output directory named "
+                                   "{}".format(options.destdir))
+
+            staplelib.OPTIONS = options
+            iohelper.HANDLES.clear()
+            iohelper.STANDARD_STREAMS = False
+            stapler.load_mode(options.mode)(args)
+        result["status"] = "ok"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+    finally:
+        iohelper.discard_pdfs()
+        iohelper.STANDARD_STREAMS = True
+        # keep the likes of letterheads and background templates parsed
+        iohelper.close_pdfs(keep=WARM_READERS)
+        staplelib.OPTIONS = defaults
+
+    result["seconds"] = round(time.time() - start, 6)
+    if output.getvalue():
+        result["output"] = output.getvalue()
+    return result
+
+
+def _run_worker_job(job):
+    return run_job(*job)
+
+
+def batch(args):
+    """Run all jobs of a manifest file and print a status line per job."""
+    if len(args) != 1:
+        raise CommandError("Exactly one manifest file is required.")
+
+    manifest = args[0]
+    if manifest == '-':
+        jobs = read_manifest(sys.stdin)
+    else:
+        if not os.path.exists(manifest):
+            raise CommandError("{} does not exist".format(manifest))
+        with open(manifest) as stream:
+            jobs = read_manifest(stream)
+
+    defaults = staplelib.OPTIONS
+    workers = defaults.jobs
+    if workers < 1:
+        raise CommandError("The number of jobs must be at least 1.")
+    # the pool is for the jobs; within a job, run single-threaded unless the
+    # job asks for more itself
+    defaults.jobs = 1
+
+    jobs = [(jobid, arguments, defaults) for jobid, arguments in jobs]
+    if workers == 1:
+        results = (run_job(*job) for job in jobs)
+        executor = None
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(_run_worker_job, jobs)
+
+    failed = 0
+    try:
+        for result in results:
+            if result["status"] != "ok":
+                failed += 1
+            print(json.dumps(result))
+            sys.stdout.flush()
+    finally:
+        if executor:
+            executor.shutdown()
+
+    if failed:
+        raise CommandError("{} of {} job(s) failed.".format(failed,
+                                                           len(jobs)))
@@ -0,0 +1,177 @@
+"""Reuse outputs of earlier runs with the same inputs, see --cache."""
+
+from __future__ import print_function
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import staplelib
+from . import CommandError
+
+# changes whenever the same command line may produce a different output
+FORMAT = 1
+
+# options that change the content of an output
+OUTPUT_OPTIONS = ("ownerpw", "userpw", "streaming", "dedup", "recompress",
+                  "linearize", "object_streams", "prune")
+
+COUNTERS = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0,
+            "hashed": 0}
+
+
+def _directory(name):
+    path = os.path.join(staplelib.OPTIONS.cache, name)
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # created by another process meanwhile
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
+def _write_atomically(path, write):
+    """Create PATH with WRITE(file), so no one sees a partial file."""
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(handle, "wb") as stream:
+            write(stream)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def content_digest(filename):
+    """
+    Return the SHA-256 of a file's content.
+
+    Digests are remembered in the cache by path, size and mtime, so only
+    new or changed inputs are read in full. An input that was merely
+    touched still hashes to its old digest.
+    """
+    stat = os.stat(filename)
+    identity = "{}\0{}\0{}".format(os.path.realpath(filename), stat.st_size,
+                                   stat.st_mtime_ns)
+    memo = os.path.join(_directory("digests"), hashlib.sha256(
+        identity.encode("utf-8", "surrogateescape")).hexdigest())
+    try:
+        with open(memo) as stream:
+            return stream.read()
+    except EnvironmentError:
+        pass
+
+    digest = hashlib.sha256()
+    with open(filename, "rb") as stream:
+        for block in iter(lambda: stream.read(1 << 20), b""):
+            digest.update(block)
+    COUNTERS["hashed"] += 1
+    _write_atomically(memo, lambda stream: stream.write(
+        digest.hexdigest().encode("ascii")))
+    return digest.hexdigest()
+
+
+def key(mode, inputs):
+    """
+    Fingerprint an operation: the MODE, the content and selected ranges of
+    each of INPUTS from parse_ranges(), and the options affecting the
+    output.
+    """
+    operation = {
+        "format": FORMAT,
+        "mode": mode,
+        "inputs": [
+            [content_digest(input["name"]),
+             # ranges without the handle they were given with
+             [match.group(0)[len(match.group(1) or ""):]
+              for add, match in input.ranges]]
+            for input in inputs],
+        "options": dict((name, getattr(staplelib.OPTIONS, name))
+                        for name in OUTPUT_OPTIONS),
+    }
+    return hashlib.sha256(json.dumps(operation, sort_keys=True)
+                          .encode("utf-8")).hexdigest()
+
+
+def _entry(cache_key):
+    return os.path.join(_directory("outputs"), cache_key + ".pdf")
+
+
+def fetch(cache_key, filename):
+    """
+    Copy the cached output for CACHE_KEY to FILENAME; return False if
+    there is none.
+    """
+    entry = _entry(cache_key)
+    if not os.path.exists(entry):
+        COUNTERS["misses"] += 1
+        return False
+    if os.path.exists(filename) and not staplelib.OPTIONS.force:
+        raise CommandError("File already exists: {}".format(filename))
+    shutil.copyfile(entry, filename)
+    # entries are evicted least recently used first
+    os.utime(entry, None)
+    COUNTERS["hits"] += 1
+    return True
+
+
+def store(cache_key, filename):
+    """Add the output FILENAME to the cache, evicting old entries."""
+    entry = _entry(cache_key)
+
+    def copy(stream):
+        with open(filename, "rb") as output:
+            shutil.copyfileobj(output, stream)
+    _write_atomically(entry, copy)
+    COUNTERS["stored"] += 1
+    evict(staplelib.OPTIONS.cache_size)
+
+
+def entries():
+    """Return (mtime, size, path) of the cached outputs, oldest first."""
+    directory = _directory("outputs")
+    result = []
+    for name in os.listdir(directory):
+        if not name.endswith(".pdf"):
+            # still being written
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # evicted by another process
+            continue
+        result.append((stat.st_mtime, stat.st_size, path))
+    return sorted(result)
+
+
+def evict(limit):
+    """Remove the least recently used outputs until they fit in LIMIT."""
+    cached = entries()
+    total = sum(size for mtime, size, path in cached)
+    for mtime, size, path in cached:
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+        COUNTERS["evicted"] += 1
+
+
+def report(stream=None):
+    """Print and reset the counters of this run and the size of the cache."""
+    stream = stream or sys.stderr
+    cached = entries()
+    print("cache: {hits} hit(s), {misses} miss(es), {stored} stored, "
+          "{evicted} evicted, {hashed} input(s) hashed; ".format(**COUNTERS) +
+          "{} output(s), {:.1f} MiB in {}".format(
+              len(cached), sum(size for mtime, size, path in cached) /
+              1048576.0, staplelib.OPTIONS.cache), file=stream)
+    for counter in COUNTERS:
+        COUNTERS[counter] = 0
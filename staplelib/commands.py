@@ -1,22 +1,109 @@
 """Module containing the actual commands stapler understands."""
 from __future__ import print_function
+import itertools
 import math
 import os
+import zlib
 
 try:
     from PyPDF2 import PdfFileWriter, PdfFileReader
-except:
+    from PyPDF2.pdf import PageObject
+except ImportError:
     from pyPdf import PdfFileWriter, PdfFileReader
+    from pyPdf.pdf import PageObject
 
-from . import CommandError, iohelper
+from . import (CommandError, cache, incremental, iohelper, overlay,
+               pageset, prune, stats)
+# these used to be defined here
+from .pagelabels import int_to_page_alpha, int_to_roman
 import staplelib
 
-def _write_output(output, outputfilename):
-    if os.path.isabs(outputfilename):
-        iohelper.write_pdf(output, outputfilename)
-    else:
-        iohelper.write_pdf(output, os.path.normpath(staplelib.OPTIONS.destdir +
-                           os.sep + outputfilename))
+def _output_path(outputfilename):
+    if (os.path.isabs(outputfilename) or
+            outputfilename == iohelper.STDOUT):
+        return outputfilename
+    return os.path.normpath(staplelib.OPTIONS.destdir + os.sep +
+                            outputfilename)
+
+def _new_output(outputfilename):
+    """Create the writer to add the output pages to."""
+    # only StreamingPdfWriter can deduplicate, recompress and write object
+    # streams
+    opt = staplelib.OPTIONS
+    if (opt.streaming or opt.dedup or opt.recompress is not None or
+            opt.object_streams is not None):
+        return iohelper.create_pdf(_output_path(outputfilename))
+    return PdfFileWriter()
+
+def _cache_key(mode, filesandranges, outputfilename):
+    """Return the key of an operation in the --cache, or None without it."""
+    # the standard streams are not files that could be hashed or copied
+    if (not staplelib.OPTIONS.cache or outputfilename == iohelper.STDOUT or
+            any(input['name'] == iohelper.STDIN
+                for input in filesandranges)):
+        return None
+    return cache.key(mode, filesandranges)
+
+def _from_cache(cache_key, outputfilename):
+    """Copy a cached output to OUTPUTFILENAME, if there is one."""
+    if not cache_key or not cache.fetch(cache_key,
+                                        _output_path(outputfilename)):
+        return False
+    if staplelib.OPTIONS.verbose:
+        print("Output taken from the cache.")
+    return True
+
+def _write_output(output, outputfilename, cache_key=None):
+    iohelper.write_pdf(output, _output_path(outputfilename))
+    if cache_key:
+        cache.store(cache_key, _output_path(outputfilename))
+
+    if staplelib.OPTIONS.verbose and staplelib.OPTIONS.dedup:
+        print("Deduplicated {} stream(s), saving {} bytes.".format(
+            output.duplicates, output.bytes_saved))
+    if staplelib.OPTIONS.verbose and staplelib.OPTIONS.recompress is not None:
+        print("Recompressed {} stream(s), saving {} bytes.".format(
+            output.compressed, output.compression_saved))
+    if staplelib.OPTIONS.verbose and staplelib.OPTIONS.object_streams:
+        print("Packed {} object(s) into {} object stream(s).".format(
+            output.packed, output.object_streams))
+    if staplelib.OPTIONS.verbose and iohelper.PREFETCHER is not None:
+        prefetcher = iohelper.PREFETCHER
+        print("Prefetched {} input(s): {:.2f}s loading, {:.2f}s waited for "
+              "({:.0f}% overlapped)".format(
+                  prefetcher.loaded, prefetcher.busy, prefetcher.waited,
+                  100 * prefetcher.overlap()))
+    if staplelib.OPTIONS.verbose:
+        peak = iohelper.peak_memory()
+        if peak:
+            print("Peak memory usage: {:.1f} MiB".format(peak / 1048576.0))
+
+def _get_page(pdf, pageno, rotate):
+    """
+    Fetch a (1-based) page from a reader, rotated by the given angle.
+
+    Readers are shared, so the page is copied rather than modified in
+    place; the same page can then be used several times with different
+    rotations.
+    """
+    with stats.phase("pages"):
+        original = pdf.getPage(pageno-1)
+        page = PageObject(original.pdf, original.indirectRef)
+        page.update(original)
+        stats.count(pages=1)
+        return page.rotateClockwise(rotate)
+
+def _add_page(output, page):
+    """Add a page to an output from _new_output()."""
+    # streaming outputs serialize the page right away
+    with stats.phase("write"):
+        output.addPage(page)
+
+def _collected(results):
+    """Unpack worker results from stats.collect(), merging their stats."""
+    for result, phases in results:
+        stats.merge(phases)
+        yield result
 
 def select(args, inverse=False):
     """
@@ -33,32 +120,35 @@ def select(args, inverse=False):
     if not filesandranges or not outputfilename:
         raise CommandError("Both input and output filenames are required.")
 
-    output = PdfFileWriter()
+    if staplelib.OPTIONS.incremental and _update_in_place(
+            filesandranges, outputfilename, inverse):
+        return
+    cache_key = _cache_key("del" if inverse else "sel", filesandranges,
+                           outputfilename)
+    if _from_cache(cache_key, outputfilename):
+        return
+
+    pruner = None
+    if staplelib.OPTIONS.prune:
+        pruner = prune.Pruner(count=verbose)
+    output = _new_output(outputfilename)
     try:
         for input in filesandranges:
             pdf = input['pdf']
             if verbose:
                 print(input['name'])
 
-            # empty range means "include all pages"
-            if not inverse:
-                pagerange = input['pages'] or [
-                    (p, iohelper.ROTATION_NONE) for p in
-                    range(1, pdf.getNumPages() + 1)]
-            else:
-                excluded = [p for p, r in input['pages']]
-                pagerange = [(p, iohelper.ROTATION_NONE) for p in
-                             range(1, pdf.getNumPages() + 1) if
-                             p not in excluded]
-
-            for pageno, rotate in pagerange:
+            for pageno, rotate in _selected_pages(input, inverse):
                 if 1 <= pageno <= pdf.getNumPages():
                     if verbose:
                         print("Using page: {} (rotation: {} deg.)".format(
                             pageno, rotate))
 
-                    output.addPage(pdf.getPage(pageno-1)
-                                   .rotateClockwise(rotate))
+                    page = _get_page(pdf, pageno, rotate)
+                    if pruner is not None:
+                        with stats.phase("prune"):
+                            pruner.prune(page)
+                    _add_page(output, page)
                 else:
                     raise CommandError("Page {} not found in {}.".format(
                         pageno, input['name']))
@@ -66,7 +156,56 @@ def select(args, inverse=False):
     except Exception as e:
         raise CommandError(e)
 
-    _write_output(output, outputfilename)
+    if pruner is not None and verbose:
+        print("Pruned {} unused resource(s), leaving out {} object(s) "
+              "with {} bytes of stream data.".format(*pruner.report()))
+    _write_output(output, outputfilename, cache_key)
+
+
+def _selected_pages(input, inverse):
+    """
+    Return an iterable of the (page number, rotation) pairs sel/del use of
+    an input, generated as they are used.
+    """
+    everything = pageset.PageSet.all(input['pdf'].getNumPages())
+    # empty range means "include all pages"
+    if not inverse:
+        return input['pages'] or (
+            (p, iohelper.ROTATION_NONE) for p in everything)
+    # the difference of the interval sets takes time linear in the number
+    # of ranges, not quadratic in the number of pages
+    remaining = everything.difference(input['pages'].pages())
+    return ((p, iohelper.ROTATION_NONE) for p in remaining)
+
+
+def _update_in_place(filesandranges, outputfilename, inverse):
+    """
+    Apply sel/del to a file that is also the output by appending an
+    incremental update to it, see --incremental. Returns False if that is
+    not possible and the output needs to be written as usual.
+    """
+    opt = staplelib.OPTIONS
+    filename = _output_path(outputfilename)
+    if (len(filesandranges) != 1 or filename == iohelper.STDOUT or
+            opt.ownerpw or opt.userpw or
+            opt.linearize or opt.prune or opt.dedup or
+            opt.recompress is not None or opt.object_streams is not None or
+            not os.path.exists(filename) or
+            filesandranges[0]['name'] == iohelper.STDIN or
+            not os.path.samefile(filesandranges[0]['name'], filename)):
+        return False
+
+    pages = list(_selected_pages(filesandranges[0], inverse))
+    for pageno, rotate in pages:
+        if not 1 <= pageno <= filesandranges[0]['pdf'].getNumPages():
+            raise CommandError("Page {} not found in {}.".format(
+                pageno, filesandranges[0]['name']))
+    with stats.phase("write"):
+        updated = incremental.update_pages(
+            filename, filesandranges[0]['pdf'], pages)
+    if updated and opt.verbose:
+        print("Appended an incremental update to {}".format(filename))
+    return updated
 
 
 def delete(args):
@@ -74,13 +213,125 @@ def delete(args):
     return select(args, inverse=True)
 
 
+def compress(args):
+    """Concatenate files / select pages, compressing their streams."""
+    if staplelib.OPTIONS.recompress is None:
+        staplelib.OPTIONS.recompress = zlib.Z_BEST_COMPRESSION
+    return select(args)
+
+
+def _burst_pages(input, chunks, output_template, destdir):
+    """
+    Write the given chunks of (0-based) pages of a reader to one file each,
+    named after their first page, and return the (name, page count) of
+    each file. A chunk is split further when a file reaches --chunk-size.
+    """
+    size = staplelib.OPTIONS.chunk_size
+    outputs = []
+    for chunk in chunks:
+        output = None
+        for pageno in chunk:
+            if output is None:
+                outputname = output_template % (pageno + 1)
+                # pages are written right away, copying their streams as is;
+                # resources they share are written once per file
+                output = iohelper.create_pdf(destdir + os.sep + outputname)
+            with stats.phase("pages"):
+                output.addPage(input.getPage(pageno))
+                stats.count(pages=1)
+            if size and output.tell() >= size:
+                outputs.append(_finish_burst(output, outputname, destdir))
+                output = None
+        if output is not None:
+            outputs.append(_finish_burst(output, outputname, destdir))
+    return outputs
+
+
+def _finish_burst(output, outputname, destdir):
+    iohelper.write_pdf(output, destdir + os.sep + outputname)
+    return outputname, output.getNumPages()
+
+
+def _burst_chunks(input):
+    """
+    Return the ranges of (0-based) page numbers split writes to one file
+    each (before --chunk-size splits them further).
+    """
+    opt = staplelib.OPTIONS
+    numpages = input.getNumPages()
+    if opt.chunk_bookmarks:
+        starts = _bookmark_pages(input)
+    elif opt.chunk_pages:
+        starts = list(range(0, numpages, opt.chunk_pages))
+    elif opt.chunk_size:
+        starts = [0]
+    else:
+        starts = list(range(numpages))
+    if not starts or starts[0] != 0:
+        # pages before the first bookmark
+        starts.insert(0, 0)
+    bounds = starts + [numpages]
+    return [range(bounds[i], bounds[i + 1]) for i in range(len(starts))
+            if bounds[i] < bounds[i + 1]]
+
+
+def _bookmark_pages(input):
+    """Return the sorted (0-based) pages of an input's top-level bookmarks."""
+    pages = set()
+    for outline in input.getOutlines():
+        # nested lists hold the children of the preceding bookmark
+        if not isinstance(outline, list):
+            pageno = input.getDestinationPageNumber(outline)
+            if pageno >= 0:
+                pages.add(pageno)
+    return sorted(pages)
+
+
+def _burst_worker(options, passwords, filename, chunks, output_template):
+    """Process pool entry point: burst some chunks with a private reader."""
+    staplelib.OPTIONS = options
+    stats.ENABLED = bool(options.stats)
+    iohelper.PASSWORDS.update(passwords)
+    # readers inherited from the parent share its file offsets
+    iohelper.close_pdfs()
+    try:
+        input = iohelper.read_pdf(filename)
+        return _burst_pages(input, chunks, output_template, options.destdir)
+    finally:
+        iohelper.close_pdfs()
+
+
+def _report_burst(results, filecount, verbose):
+    pagecount = 0
+    try:
+        for outputs in results:
+            for outputname, pages in outputs:
+                if verbose:
+                    print(outputname)
+                pagecount += pages
+    except CommandError:
+        raise
+    except Exception as e:
+        raise CommandError(e)
+
+    if verbose:
+        print("\n{} page(s) in {} file(s) processed.".format(
+            pagecount, filecount))
+
+
 def split(args):
-    """Burst an input file into one file per page."""
-    files = args
+    """Burst an input file into one file per page or chunk of pages."""
+    files = iohelper.expand_arguments(args)
     verbose = staplelib.OPTIONS.verbose
+    jobs = staplelib.OPTIONS.jobs
 
     if not files:
         raise CommandError("No input files specified.")
+    if jobs < 1:
+        raise CommandError("The number of jobs must be at least 1.")
+    chunk_pages = staplelib.OPTIONS.chunk_pages
+    if chunk_pages is not None and chunk_pages < 1:
+        raise CommandError("The chunk size must be at least 1 page.")
 
     inputs = []
     try:
@@ -89,11 +340,12 @@ def split(args):
     except Exception as e:
         raise CommandError(e)
 
-    filecount = 0
-    pagecount = 0
-    for input in inputs:
+    # (filename, reader, chunks, output_template) per shard, in output order
+    shards = []
+    for filename, input in ((files[i], inputs[i])
+                            for i in range(len(files))):
         # zero-padded output file name
-        (base, ext) = os.path.splitext(os.path.basename(files[filecount]))
+        (base, ext) = os.path.splitext(os.path.basename(filename))
         output_template = ''.join([
             base,
             '_',
@@ -103,70 +355,156 @@ def split(args):
             ext
         ])
 
-        for pageno in range(input.getNumPages()):
-            output = PdfFileWriter()
-            output.addPage(input.getPage(pageno))
+        # a few shards per worker keeps the pool busy on uneven inputs
+        chunks = _burst_chunks(input)
+        shardsize = max(1, int(math.ceil(len(chunks) / float(jobs * 4))))
+        for first in range(0, len(chunks), shardsize):
+            shards.append((filename, input, chunks[first:first + shardsize],
+                           output_template))
+
+    if jobs == 1:
+        results = (_burst_pages(input, chunks, template,
+                                staplelib.OPTIONS.destdir)
+                   for filename, input, chunks, template in shards)
+        _report_burst(results, len(files), verbose)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(stats.collect, _burst_worker,
+                                   staplelib.OPTIONS, iohelper.PASSWORDS,
+                                   filename, chunks, template)
+                   for filename, input, chunks, template in shards]
+        # results are consumed in submission order, so verbose output is
+        # identical to a serial run regardless of which worker finishes first
+        _report_burst(_collected(f.result() for f in futures), len(files),
+                      verbose)
+
+
+def _document_summary(pdf):
+    """Return the page count and metadata items of a reader."""
+    info = pdf.documentInfo or {}
+    return {"pages": iohelper.page_count(pdf),
+            "metadata": [(name, value.getObject())
+                         for name, value in info.items()]}
+
+
+def _quick_summary(filename):
+    """
+    Summarize a file from its trailer only (see iohelper.read_trailer()).
 
-            outputname = output_template % (pageno + 1)
-            if verbose:
-                print(outputname)
-            iohelper.write_pdf(output, staplelib.OPTIONS.destdir +
-                               os.sep + outputname)
-            pagecount += 1
-        filecount += 1
+    Returns the file name and its summary, which is None if the file needs
+    a full reader.
+    """
+    pdf = iohelper.read_trailer(filename)
+    if pdf is None:
+        return filename, None
+    try:
+        return filename, _document_summary(pdf)
+    except Exception:
+        return filename, None
+    finally:
+        pdf.stream.close()
 
-    if verbose:
-        print("\n{} page(s) in {} file(s) processed.".format(
-            pagecount, filecount))
+
+def _metadata_value(value):
+    if isinstance(value, bytes):
+        return value.decode('latin-1')
+    return u"{}".format(value)
 
 
 def info(args):
     """Display Metadata content for all input files."""
-    files = args
+    import json
+    files = iohelper.expand_arguments(args)
+    jobs = staplelib.OPTIONS.jobs
 
     if not files:
         raise CommandError("No input files specified.")
+    if jobs < 1:
+        raise CommandError("The number of jobs must be at least 1.")
 
-    for f in files:
-        pdf = iohelper.read_pdf(f)
-        print("*** Metadata for {}".format(f))
-        print()
-        info = pdf.documentInfo
-        if info:
-            for name, value in info.items():
-                print(u"    {}:  {}".format(name, value))
-        else:
-            print("    (No metadata found.)")
-        print()
+    # the standard input can only be read by this process
+    if jobs == 1 or iohelper.STDIN in files:
+        summaries = map(_quick_summary, files)
+        executor = None
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        # results come back in the order of the input files
+        summaries = _collected(executor.map(
+            stats.collect, itertools.repeat(_quick_summary), files,
+            chunksize=max(1, len(files) // (jobs * 16))))
+
+    try:
+        for f, summary in summaries:
+            if summary is None:
+                summary = _document_summary(iohelper.read_pdf(f))
+
+            if staplelib.OPTIONS.format == 'jsonl':
+                print(json.dumps({
+                    "file": f,
+                    "pages": summary["pages"],
+                    "metadata": dict((name, _metadata_value(value)) for
+                                     name, value in summary["metadata"]),
+                }))
+                continue
+
+            print("*** Metadata for {}".format(f))
+            print()
+            if summary["metadata"]:
+                for name, value in summary["metadata"]:
+                    print(u"    {}:  {}".format(name, value))
+            else:
+                print("    (No metadata found.)")
+            print()
+    finally:
+        if executor:
+            executor.shutdown()
 
 def zip_pdf_pages(filesandranges, verbose):
-    # Make [[file1_p1, file1_p2], [file2_p1, file2_p2], ...].
+    # Make [file1_p1, file1_p2, ...], [file2_p1, file2_p2, ...], ...
+    # lazily, pages are only read as they are used.
     filestozip = []
     for input in filesandranges:
-        pdf = input['pdf']
         if verbose:
             print(input['name'])
 
-        # empty range means "include all pages"
-        pagerange = input['pages'] or [
-            (p, iohelper.ROTATION_NONE) for p in
-            range(1, pdf.getNumPages() + 1)]
+        filestozip.append(_zipped_pages(input, verbose))
 
-        pagestozip = []
-        for pageno, rotate in pagerange:
-            if 1 <= pageno <= pdf.getNumPages():
-                if verbose:
-                    print("Using page: {} (rotation: {} deg.)".format(
-                        pageno, rotate))
+    return filestozip
 
-                pagestozip.append(pdf.getPage(pageno-1)
-                               .rotateClockwise(rotate))
-            else:
-                raise CommandError("Page {} not found in {}.".format(
-                    pageno, input['name']))
-        filestozip.append(pagestozip)
 
-    return filestozip
+def _zipped_pages(input, verbose):
+    """Generate the selected pages of an input as zip_pdf_pages() uses them."""
+    pdf = input['pdf']
+    for pageno, rotate in _selected_pages(input, False):
+        if 1 <= pageno <= pdf.getNumPages():
+            if verbose:
+                print("Using page: {} (rotation: {} deg.)".format(
+                    pageno, rotate))
+
+            yield _get_page(pdf, pageno, rotate)
+        else:
+            raise CommandError("Page {} not found in {}.".format(
+                pageno, input['name']))
+
+
+def _interleaved(iterables):
+    """
+    Generate lists of the first items of ITERABLES, then of the second
+    ones, and so on, leaving out those that are exhausted.
+    """
+    iterators = [iter(iterable) for iterable in iterables]
+    while iterators:
+        row = []
+        for iterator in list(iterators):
+            try:
+                row.append(next(iterator))
+            except StopIteration:
+                iterators.remove(iterator)
+        if row:
+            yield row
 
 def background(args):
     """Combine 2 files with corresponding pages merged."""
@@ -177,21 +515,21 @@ def background(args):
 
     if not filesandranges or not outputfilename:
         raise CommandError("Both input and output filenames are required.")
+    cache_key = _cache_key("background", filesandranges, outputfilename)
+    if _from_cache(cache_key, outputfilename):
+        return
 
     try:
         filestozip = zip_pdf_pages(filesandranges, verbose)
 
-        output = PdfFileWriter()
-        for pageno in range(max(map(len, filestozip))):
-            page = None
-            for listno in range(len(filestozip)):
-                if pageno < len(filestozip[listno]):
-                    p = filestozip[listno][pageno]
-                    if not page:
-                        page = p
-                    else:
-                        page.mergePage(p)
-            output.addPage(page)
+        output = _new_output(outputfilename)
+        stamper = overlay.Stamper(output)
+        for pages in _interleaved(filestozip):
+            page = pages[0]
+            for p in pages[1:]:
+                with stats.phase("merge"):
+                    stamper.stamp(page, p)
+            _add_page(output, page)
 
     except Exception as e:
         import sys
@@ -199,7 +537,7 @@ def background(args):
         traceback.print_tb(sys.exc_info()[2])
         raise CommandError(e)
 
-    _write_output(output, outputfilename)
+    _write_output(output, outputfilename, cache_key)
 
 def zip(args):
     """Combine 2 files with interleaved pages."""
@@ -209,120 +547,31 @@ def zip(args):
 
     if not filesandranges or not outputfilename:
         raise CommandError('Both input and output filenames are required.')
+    cache_key = _cache_key("zip", filesandranges, outputfilename)
+    if _from_cache(cache_key, outputfilename):
+        return
 
     filestozip = zip_pdf_pages(filesandranges, verbose)
 
     # Interweave pages.
-    output = PdfFileWriter()
-    for pageno in range(max(map(len, filestozip))):
-        for listno in range(len(filestozip)):
-            if pageno < len(filestozip[listno]):
-                output.addPage(filestozip[listno][pageno])
-
-    _write_output(output, outputfilename)
-
-
-def int_to_page_alpha(pageno, base):
-    """return uppercase alphabetic page numbers for PAGENO starting at BASE (a or A).
-Adobe defines them as A to Z, then AA to ZZ, and so on.
-Yes, that is somewhat wacky."""
-    (div, mod) = divmod( pageno-1, 26)
-    c = chr(mod + ord(base))
-    return c * (div+1)
-
-# next text is from Paul M. Winkler
-# via https://www.oreilly.com/library/view/python-cookbook/0596001673/ch03s24.html
-def int_to_roman(input):
-    """ Convert an integer to a Roman numeral. """
-
-    if not isinstance(input, type(1)):
-        raise TypeError("expected integer, got %s" % type(input))
-    if not 0 < input < 4000:
-        raise ValueError("Argument must be between 1 and 3999")
-    ints = (1000, 900,  500, 400, 100,  90, 50,  40, 10,  9,   5,  4,   1)
-    nums = ('M',  'CM', 'D', 'CD','C', 'XC','L','XL','X','IX','V','IV','I')
-    result = []
-    for i in range(len(ints)):
-        count = int(input / ints[i])
-        result.append(nums[i] * count)
-        input -= ints[i] * count
-    return ''.join(result)
-
-
-
-#
-# pdf_page_enumeration is
-# inspired by  https://stackoverflow.com/questions/12360999/retrieve-page-numbers-from-document-with-pypdf
-# (thanks vjayky!)
-# and informed by https://www.w3.org/TR/WCAG20-TECHS/PDF17.html
-# (thanks, w3c!)
-# which recaps the PDF-1.7 specification
-# https://www.adobe.com/content/dam/acom/en/devnet/pdf/pdfs/PDF32000_2008.pdf
-#
+    output = _new_output(outputfilename)
+    for pages in _interleaved(filestozip):
+        for page in pages:
+            _add_page(output, page)
+
+    _write_output(output, outputfilename, cache_key)
+
+
 def pdf_page_enumeration(pdf):
     """Generate a list of pages, using /PageLabels (if it exists).  Returns a list of labels."""
-    
-    try:
-        pagelabels = pdf.trailer["/Root"]["/PageLabels"]
-    except:
-        # ("No /Root/PageLabels object"), so infer the list.
-        return range(1, pdf.getNumPages() + 1)
-    
-    # """Select the item that is most likely to contain the information you desire; e.g.
-    #        {'/Nums': [0, IndirectObject(42, 0)]}
-    #    here, we only have "/Num". """
-    
-    try:
-        pagelabels_nums = pdf.trailer["/Root"]["/PageLabels"]["/Nums"]
-    except:
-        raise CommandError("Malformed PDF, /Root/PageLabels but no .../Nums object")
-
-    #
-    # At this point we have either the object or the list.
-    # Make it a list.
-    #
-    if isinstance(pagelabels_nums, (list,)):
-        pagelabels_nums_list = pagelabels_nums
-    else:
-        pagelabels_nums_list = list(pagelabels_nums)
-
-    labels = []
-    style = None
-    # default
-    style = '/D'
-    prefix = ''
-    next_pageno = 1
-    for i in range(0, pdf.getNumPages()):
-        if len(pagelabels_nums_list) > 0 and i >= pagelabels_nums_list[0]:
-            pagelabels_nums_list.pop(0)  # discard index
-            pnle = pagelabels_nums_list.pop(0)
-            style = pnle.get('/S', '/D')
-            prefix = pnle.get('/P', '')
-            next_pageno = pnle.get('/St', 1)
-        pageno_str = ''
-        if style == '/D':
-            pageno_str = str(next_pageno)
-        elif style == '/A':
-            pageno_str = int_to_page_alpha(next_pageno, 'A')
-        elif style == '/a':
-            pageno_str = int_to_page_alpha(next_pageno, 'a')
-        elif style == '/R':
-            pageno_str = int_to_roman(next_pageno)
-        elif style == '/r':
-            pageno_str = int_to_roman(next_pageno).lower()
-        else:
-            raise CommandError("Malformded PDF: unkown page numbering style " + style)
-        labels.append(prefix + pageno_str)
-        next_pageno += 1
-
-    return labels
+    return list(iohelper.page_labels(pdf))
 
 
 def list_logical_pages(args):
     """List the logical names of each page."""
     verbose = staplelib.OPTIONS.verbose
 
-    files = args
+    files = iohelper.expand_arguments(args)
     if not files:
         raise CommandError("An input filename is required.")
 
@@ -331,9 +580,8 @@ def list_logical_pages(args):
             pdf = iohelper.read_pdf(input)
             if verbose:
                 print(input)
-            i = 0
-            for label in pdf_page_enumeration(pdf):
-                i += 1
+            # labels are generated range by range as they are printed
+            for i, label in enumerate(iohelper.page_labels(pdf), 1):
                 print("{}\t{}".format(label, str(i)))
 
     except Exception as e:
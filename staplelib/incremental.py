@@ -0,0 +1,107 @@
+"""Change PDF files by appending an incremental update, see --incremental."""
+
+try:
+    from PyPDF2.generic import (ArrayObject, DictionaryObject,
+                                IndirectObject, NameObject, NumberObject)
+except ImportError:
+    from pyPdf.generic import (ArrayObject, DictionaryObject,
+                               IndirectObject, NameObject, NumberObject)
+
+from . import iohelper
+
+
+def _same_object(a, b):
+    return (isinstance(a, IndirectObject) and isinstance(b, IndirectObject)
+            and (a.idnum, a.generation) == (b.idnum, b.generation))
+
+
+def update_pages(filename, pdf, pages):
+    """
+    Make the document FILENAME, read into PDF, consist of PAGES, a list of
+    (1-based page number, rotation) pairs, by appending an incremental
+    update to it.
+
+    Only the page tree root and the pages that move to it or are rotated
+    are written; everything else, such as the content of the pages, stays
+    where it is. Returns False without changing the file if it cannot be
+    updated this way: if it's encrypted, uses cross-reference streams, or
+    PAGES uses a page more than once.
+    """
+    pagenos = [pageno for pageno, rotate in pages]
+    if len(set(pagenos)) != len(pagenos):
+        return False
+    previous = iohelper.read_trailer(filename)
+    if previous is None:
+        return False
+    try:
+        tree_ref = pdf.trailer["/Root"].raw_get("/Pages")
+        if not isinstance(tree_ref, IndirectObject):
+            return False
+
+        objects = {}  # idnum -> (generation, new version of the object)
+        kids = ArrayObject()
+        for pageno, rotate in pages:
+            page = pdf.getPage(pageno - 1)
+            ref = page.indirectRef
+            # the page includes what it inherited from its page tree nodes
+            data = DictionaryObject(page)
+            if rotate:
+                current = data["/Rotate"] if "/Rotate" in data else 0
+                data[NameObject("/Rotate")] = NumberObject(
+                    (int(current) + rotate) % 360)
+            if rotate or not _same_object(data.get("/Parent"), tree_ref):
+                data[NameObject("/Parent")] = tree_ref
+                objects[ref.idnum] = (ref.generation, data)
+            kids.append(ref)
+
+        tree = DictionaryObject(tree_ref.getObject())
+        tree.pop("/Parent", None)
+        tree[NameObject("/Kids")] = kids
+        tree[NameObject("/Count")] = NumberObject(len(kids))
+        objects[tree_ref.idnum] = (tree_ref.generation, tree)
+
+        trailer = DictionaryObject(previous.trailer)
+        trailer[NameObject("/Prev")] = NumberObject(previous.startxref)
+    finally:
+        previous.stream.close()
+
+    stream = iohelper._open(filename, "ab")
+    try:
+        _append(stream, objects, trailer)
+    finally:
+        stream.close()
+    return True
+
+
+def _append(stream, objects, trailer):
+    """Write OBJECTS and an xref section and TRAILER for them to STREAM."""
+    stream.write(b"\n")
+    offsets = {}
+    for idnum in sorted(objects):
+        generation, obj = objects[idnum]
+        offsets[idnum] = stream.tell()
+        stream.write(("%d %d obj\n" % (idnum, generation)).encode("ascii"))
+        obj.writeToStream(stream, None)
+        stream.write(b"\nendobj\n")
+
+    xref_location = stream.tell()
+    # the head of the list of free objects comes first, as readers such as
+    # PyPDF2 take a first subsection not starting at 0 for a broken table
+    stream.write(b"xref\n0 1\n0000000000 65535 f \n")
+    # one subsection per run of consecutive object numbers
+    idnums = sorted(offsets)
+    start = 0
+    for end in range(1, len(idnums) + 1):
+        if end < len(idnums) and idnums[end] == idnums[end - 1] + 1:
+            continue
+        stream.write(("%d %d\n" % (idnums[start], end - start))
+                     .encode("ascii"))
+        for idnum in idnums[start:end]:
+            stream.write(("%010d %05d n \n" % (
+                offsets[idnum], objects[idnum][0])).encode("ascii"))
+        start = end
+
+    stream.write(b"trailer\n")
+    trailer.writeToStream(stream, None)
+    stream.write(("\nstartxref\n%d\n%%%%EOF\n" % xref_location)
+                 .encode("ascii"))
@@ -1,10 +1,18 @@
 """Helper functions for user-supplied arguments and file I/O."""
 
 from __future__ import print_function
+import binascii
 import getpass
+import glob
+from collections import OrderedDict
+import errno
+import mmap
 import os.path
 import re
+import shutil
 import sys
+import tempfile
+import weakref
 
 try:
     from PyPDF2 import PdfFileWriter, PdfFileReader
@@ -12,7 +20,10 @@ except ImportError:
     from pyPdf import PdfFileWriter, PdfFileReader
 
 
-from . import CommandError
+from . import CommandError, linearize, pageset, prefetch, stats
+from .pagelabels import PageLabels
+from .pdfwriter import StreamingPdfWriter
+from .trailer import TrailerReader, UnsupportedFile
 import staplelib
 
 
@@ -26,38 +37,429 @@ ROTATIONS = {'u': ROTATION_NONE,
              'l': ROTATION_LEFT}
 
 HANDLES = {}
+PASSWORDS = {}  # filename -> password that decrypted it
+READERS = OrderedDict()  # (path, size, mtime) -> reader, see read_pdf()
+OUTPUTS = []  # (writer, filename, temporary file), see create_pdf()
+LABELS = weakref.WeakKeyDictionary()  # reader -> PageLabels
+PREFETCHER = None  # prefetch.Prefetcher of the inputs, see parse_ranges()
+OPEN_INPUTS = OrderedDict()  # reader -> filename, see _track_open()
+STDIN = STDOUT = '-'  # file name of the standard input and output
+STANDARD_STREAMS = True  # whether they can be used, see batch.run_job()
+STDIN_SPOOL = None  # the standard input read so far, see _open_input()
 
 def read_pdf(filename):
-    """Open a PDF file with PyPDF2."""
-    if not os.path.exists(filename):
-        raise CommandError("{} does not exist".format(filename))
-    pdf = PdfFileReader(open(filename, "rb"))
-    if pdf.isEncrypted:
+    """
+    Open a PDF file with PyPDF2.
+
+    Readers are cached for the duration of a stapler invocation, so a file
+    that is referenced several times (e.g., through a handle) is only opened
+    and parsed once. close_pdfs() releases them again.
+    """
+    _existing(filename)
+
+    key = _reader_key(filename)
+    pdf = READERS.pop(key, None)
+    if pdf is None:
+        with stats.phase("read"):
+            if PREFETCHER is not None:
+                pdf = PREFETCHER.get(filename)
+            if pdf is None:
+                pdf = PdfFileReader(_open_input(filename))
+    # re-inserting keeps READERS ordered from least to most recently used
+    READERS[key] = pdf
+    if not isinstance(pdf.stream, _ClosedInput):
+        _track_open(pdf, filename)
+    # a cached reader that was decrypted before keeps its key
+    if pdf.isEncrypted and not hasattr(pdf, '_decryption_key'):
+        with stats.phase("decrypt"):
+            if filename in PASSWORDS and pdf.decrypt(PASSWORDS[filename]):
+                return pdf
         while True:
             pw = prompt_for_pw(filename)
-            matched = pdf.decrypt(pw)
+            with stats.phase("decrypt"):
+                matched = pdf.decrypt(pw)
             if matched:
+                PASSWORDS[filename] = pw
                 break
             else:
                 print("The password did not match.")
     return pdf
 
 
-def write_pdf(pdf, filename):
-    force = staplelib.OPTIONS.force
+def read_trailer(filename):
+    """
+    Open a PDF file for reading document-level information only.
+
+    Returns a TrailerReader, or None if the file needs a full reader (e.g.
+    because it is encrypted); use read_pdf() in that case.
+    """
+    _existing(filename)
+    with stats.phase("read"):
+        stream = _open_input(filename)
+        try:
+            return TrailerReader(stream)
+        except UnsupportedFile:
+            stream.close()
+            return None
+
+
+def _open(filename, mode):
+    """Open a file, counting the bytes going through it for --stats."""
+    if filename == STDOUT and 'w' in mode:
+        stream = _StandardOutput()
+    else:
+        stream = open(filename, mode)
+    return stats.CountingFile(stream) if stats.ENABLED else stream
+
+
+class _StandardOutput(object):
+    """
+    Write an output file to the standard output of the process, which (as
+    a pipe) cannot tell its position.
+    """
+
+    def __init__(self):
+        self._stream = getattr(sys.__stdout__, 'buffer', sys.__stdout__)
+        self._position = 0
+
+    def write(self, data):
+        self._stream.write(data)
+        self._position += len(data)
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        # the standard output stays open for the rest of the process
+        self._stream.flush()
+
+
+def _open_input(filename):
+    """
+    Open an input file for reading, memory-mapped if possible.
+
+    Readers seek and read a few bytes at a time a lot; on a mapped file,
+    that doesn't take a system call each time, and processes reading the
+    same file share its pages. Files that cannot be mapped (e.g., pipes or
+    empty files) are read through a regular file object.
+
+    The standard input is read once, into a buffer that is kept in memory
+    up to --spool-size and in a temporary file beyond that; each call
+    returns a view of it.
+    """
+    global STDIN_SPOOL
+    if filename == STDIN:
+        _check_standard_streams()
+        if STDIN_SPOOL is None:
+            STDIN_SPOOL = tempfile.SpooledTemporaryFile(
+                max_size=staplelib.OPTIONS.spool_size)
+            shutil.copyfileobj(getattr(sys.stdin, 'buffer', sys.stdin),
+                               STDIN_SPOOL)
+        stream = _SpooledInput(STDIN_SPOOL)
+        return stats.CountingFile(stream) if stats.ENABLED else stream
+
+    stream = open(filename, "rb")
+    try:
+        mapped = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        pass
+    else:
+        # the mapping stays valid after the file is closed
+        stream.close()
+        stream = mapped
+    return stats.CountingFile(stream) if stats.ENABLED else stream
+
+
+class _SpooledInput(object):
+    """A file object of its own reading the shared standard input spool."""
+
+    def __init__(self, spool):
+        self._spool = spool
+        self._position = 0
+
+    def read(self, size=-1):
+        self._spool.seek(self._position)
+        data = self._spool.read(size)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            self._spool.seek(0, 2)
+            offset += self._spool.tell()
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        # other readers may still use the spool
+        pass
+
+
+def page_count(pdf):
+    """Return the page count from the page tree root without flattening."""
+    try:
+        count = pdf.trailer["/Root"]["/Pages"]["/Count"]
+    except (KeyError, TypeError):
+        count = None
+    if isinstance(count, int):
+        return count
+    return pdf.getNumPages()
+
+
+def page_labels(pdf):
+    """Return the PageLabels index of a reader, built once per reader."""
+    if pdf not in LABELS:
+        try:
+            pagelabels = pdf.trailer["/Root"]["/PageLabels"]
+        except KeyError:
+            pagelabels = None
+        LABELS[pdf] = PageLabels(pagelabels, page_count(pdf))
+    return LABELS[pdf]
+
+
+def _reader_key(filename):
+    """Identify an input file by its real path, size and mtime."""
+    if filename == STDIN:
+        return (STDIN,)
+    path = os.path.realpath(filename)
+    stat = os.stat(path)
+    return (path, stat.st_size, stat.st_mtime)
+
+
+def close_pdfs(keep=0):
+    """
+    Close input files opened by read_pdf() and forget their readers.
+
+    The KEEP most recently used readers stay open.
+    """
+    global PREFETCHER
+    if PREFETCHER is not None:
+        PREFETCHER.close()
+        PREFETCHER = None
+    while len(READERS) > keep:
+        key = next(iter(READERS))
+        pdf = READERS.pop(key)
+        OPEN_INPUTS.pop(pdf, None)
+        pdf.stream.close()
+
+
+def _track_open(pdf, filename):
+    """
+    Note that the file of a reader is open and in use, and close the least
+    recently used ones beyond --max-open-files. Their readers open them
+    again when they need them, see _ClosedInput.
+    """
+    OPEN_INPUTS.pop(pdf, None)
+    OPEN_INPUTS[pdf] = filename
+    while len(OPEN_INPUTS) > max(1, staplelib.OPTIONS.max_open_files):
+        reader, name = OPEN_INPUTS.popitem(last=False)
+        stream = reader.stream
+        reader.stream = _ClosedInput(reader, name, stream.tell())
+        stream.close()
+
+
+class _ClosedInput(object):
+    """
+    Stands in for the file of a reader that _track_open() closed, and opens
+    it again, at the same position, as soon as the reader reads from it.
+
+    Code holding on to this object rather than the reader's current stream
+    (e.g., while parsing an object) is forwarded to the latter.
+    """
+
+    def __init__(self, pdf, filename, position):
+        self._pdf = pdf
+        self._filename = filename
+        self._position = position
+
+    def _stream(self):
+        stream = self._pdf.stream
+        if isinstance(stream, _ClosedInput):
+            # the reader's file is (still, or again) closed
+            stream._pdf.stream = _open_input(stream._filename)
+            stream._pdf.stream.seek(stream._position)
+            _track_open(stream._pdf, stream._filename)
+            return stream._pdf.stream
+        return stream
+
+    def read(self, *args):
+        return self._stream().read(*args)
+
+    def seek(self, *args):
+        return self._stream().seek(*args)
+
+    def tell(self):
+        if self._pdf.stream is self:
+            return self._position
+        return self._stream().tell()
+
+    def close(self):
+        # nothing is open
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._stream(), name)
 
+
+def write_pdf(pdf, filename):
     """Write the content of a PdfFileWriter object to a file."""
-    if os.path.exists(filename) and not force:
+    if isinstance(pdf, StreamingPdfWriter):
+        # pages have been written already, see create_pdf()
+        with stats.phase("write"):
+            pdf.close()
+            stats.count(objects=pdf.getObjectCount())
+        for output in OUTPUTS:
+            if output[0] is pdf:
+                OUTPUTS.remove(output)
+                _finish_output(output[2], filename)
+                break
+        _linearize(filename)
+        return
+
+    force = staplelib.OPTIONS.force
+    if filename != STDOUT and os.path.exists(filename) and not force:
         raise CommandError("File already exists: {}".format(filename))
 
     opt = staplelib.OPTIONS
     if opt:
+        _check_linearize(opt, filename)
         if opt.ownerpw or opt.userpw:
+            with stats.phase("encrypt"):
+                pdf.encrypt(opt.userpw or '', opt.ownerpw)
+
+    with stats.phase("write"):
+        outputStream, temporary = _open_output(filename)
+        try:
+            pdf.write(outputStream)
+        except BaseException:
+            outputStream.close()
+            if temporary is not None:
+                os.remove(temporary)
+            raise
+        outputStream.close()
+        _finish_output(temporary, filename)
+        stats.count(objects=len(pdf._objects))
+    _linearize(filename)
+
+
+def _open_output(filename):
+    """
+    Open an output file for writing. Returns the file object and the name
+    of the temporary file it writes to, or None for the standard output.
+
+    Outputs are written next to their final name and moved there by
+    _finish_output() once complete: an output may replace one of the
+    inputs (with -f), which may be memory-mapped (see _open_input()) and
+    must not be truncated while it is still being read.
+    """
+    if filename == STDOUT:
+        _check_standard_streams()
+        return _open(STDOUT, "wb"), None
+    directory, name = os.path.split(os.path.abspath(filename))
+    while True:
+        temporary = os.path.join(directory, ".{}.{}.tmp".format(
+            name, binascii.hexlify(os.urandom(4)).decode()))
+        try:
+            # created like open() would, with the permissions of the umask
+            handle = os.open(temporary, os.O_WRONLY | os.O_CREAT |
+                             os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            continue
+        break
+    if os.path.exists(filename):
+        # keep the permissions of the file being replaced
+        shutil.copymode(filename, temporary)
+    stream = os.fdopen(handle, "wb")
+    return (stats.CountingFile(stream) if stats.ENABLED else stream,
+            temporary)
+
+
+def _finish_output(temporary, filename):
+    """Move a complete output from _open_output() to its final name."""
+    if temporary is not None:
+        os.replace(temporary, filename)
+
+
+def _linearize(filename):
+    """Rewrite a finished output linearized, if requested."""
+    if staplelib.OPTIONS and staplelib.OPTIONS.linearize:
+        with stats.phase("linearize"):
+            linearize.linearize(filename)
+
+
+def _check_linearize(opt, filename):
+    if opt.linearize and filename == STDOUT:
+        raise CommandError("Cannot linearize the standard output")
+    if opt.linearize and (opt.ownerpw or opt.userpw):
+        raise CommandError("Encrypted output cannot be linearized")
+    if opt.linearize and opt.object_streams:
+        raise CommandError("--linearize cannot be combined with "
+                           "--object-streams")
+
+
+def create_pdf(filename):
+    """
+    Open a StreamingPdfWriter on a new file.
+
+    Pages added to the writer go to a temporary file right away;
+    write_pdf() finishes it and moves it to FILENAME. Files that are never
+    finished are removed again by discard_pdfs().
+    """
+    if (filename != STDOUT and os.path.exists(filename) and
+            not staplelib.OPTIONS.force):
+        raise CommandError("File already exists: {}".format(filename))
+
+    opt = staplelib.OPTIONS
+    _check_linearize(opt, filename)
+    if opt.object_streams is not None and opt.object_streams < 1:
+        raise CommandError("--object-streams needs at least 1 object per "
+                           "stream")
+    stream, temporary = _open_output(filename)
+    pdf = StreamingPdfWriter(stream, deduplicate=opt.dedup,
+                             recompress=opt.recompress, workers=opt.jobs,
+                             object_stream_size=opt.object_streams)
+    if opt.ownerpw or opt.userpw:
+        with stats.phase("encrypt"):
             pdf.encrypt(opt.userpw or '', opt.ownerpw)
+    OUTPUTS.append((pdf, filename, temporary))
+    return pdf
+
 
-    outputStream = open(filename, "wb")
-    pdf.write(outputStream)
-    outputStream.close()
+def discard_pdfs():
+    """Close and remove output files from create_pdf() not yet written."""
+    for pdf, filename, temporary in OUTPUTS:
+        # without a page tree, xref table or trailer, an output to stdout
+        # cannot be mistaken for a complete file
+        pdf.abort()
+        if temporary is not None:
+            os.remove(temporary)
+    del OUTPUTS[:]
+
+
+def peak_memory():
+    """Return the peak resident set size of this process in bytes."""
+    # Linux: unlike ru_maxrss, this is not inherited from the parent process
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None  # not available on Windows
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
 
 
 def prompt_for_pw(filename):
@@ -76,75 +478,286 @@ def check_input_files(files):
     """Make sure all input files exist."""
 
     for filename in files:
-        if not os.path.exists(filename):
-            raise CommandError("{} does not exist".format(filename))
+        _existing(filename)
 
 
 def check_output_file(filename):
     """Make sure the output file does not exist."""
 
-    if os.path.exists(filename):
+    if filename != STDOUT and os.path.exists(filename):
         raise CommandError("File already exists: {}".format(filename))
 
 
 def parse_ranges(handles_files_and_ranges):
-    """Parse a list of filenames followed by ranges."""
+    """
+    Parse a list of filenames followed by ranges.
+
+    Returns a list of inputs: dictionaries with the "name" of a file, its
+    reader as "pdf", and its selected "pages" (a pageset.Selection, empty
+    if all pages are used). Files are opened, and ranges resolved, when
+    they are first used; with --prefetch, the readers are loaded in the
+    background before that.
+    """
+    with stats.phase("ranges"):
+        operations = _parse_ranges(expand_arguments(handles_files_and_ranges))
+        depth = staplelib.OPTIONS.prefetch
+        if depth and depth > 0:
+            _start_prefetch(operations, depth)
+        return operations
+
+
+def expand_arguments(arguments):
+    """
+    Replace "@listfile" arguments with the lines of the file, directories
+    with the PDF files in them, and glob patterns with the PDF files they
+    match, both sorted by name.
+
+    A directory named like a page range (e.g. "2024") needs a trailing
+    slash to be taken as such.
+    """
+    expanded = []
+    for argument in arguments:
+        if argument.startswith('@') and len(argument) > 1:
+            if not os.path.exists(argument[1:]):
+                raise CommandError("{} does not exist".format(argument[1:]))
+            with open(argument[1:]) as listfile:
+                lines = [line.strip() for line in listfile]
+            # blank lines and comments are skipped
+            expanded.extend(expand_arguments(
+                [line for line in lines if line and not line.startswith('#')]))
+        elif re.search('[*?[]', argument) and not os.path.exists(argument):
+            matches = sorted(match for match in glob.glob(argument)
+                             if match.lower().endswith('.pdf'))
+            if not matches:
+                raise CommandError("No PDF files match {}".format(argument))
+            expanded.extend(matches)
+        elif os.path.isdir(argument) and (
+                argument.endswith(os.sep) or not (
+                    _fullmatch(RANGE_PATTERN, argument) or
+                    _fullmatch(LABEL_PATTERN, argument))):
+            expanded.extend(sorted(
+                os.path.join(argument, name) for name in os.listdir(argument)
+                if name.lower().endswith('.pdf')))
+        else:
+            expanded.append(argument)
+    return expanded
+
+
+def _fullmatch(pattern, text):
+    match = pattern.match(text)
+    return match is not None and match.end() == len(text)
+
+
+class _Input(dict):
+    """An input of parse_ranges(), loaded when "pdf" or "pages" is used."""
+
+    def __init__(self, name):
+        dict.__init__(self, name=name)
+        self.ranges = []  # (function, match) adding pages, in order
+
+    def __missing__(self, key):
+        if key == 'pdf':
+            self['pdf'] = read_pdf(self['name'])
+        elif key == 'pages':
+            pages = pageset.Selection()
+            for add, match in self.ranges:
+                add(self, pages, match)
+            self['pages'] = pages
+        else:
+            raise KeyError(key)
+        return self[key]
+
+
+def _start_prefetch(operations, depth):
+    global PREFETCHER
+    if PREFETCHER is not None:
+        PREFETCHER.close()
+    # the standard input is read by the main thread
+    names = [input['name'] for input in operations
+             if input['name'] != STDIN and
+             _reader_key_or_none(input['name']) not in READERS]
+    PREFETCHER = prefetch.Prefetcher(names, depth, _load_input)
+
 
+def _reader_key_or_none(filename):
+    return _reader_key(filename) if os.path.exists(filename) else None
+
+
+def _load_input(filename):
+    """Open and parse an input in a prefetch thread."""
+    if not os.path.exists(filename):
+        raise CommandError("{} does not exist".format(filename))
+    stream = open(filename, "rb")
+    try:
+        if hasattr(os, "posix_fadvise"):
+            # let the kernel read ahead while the xref is being parsed
+            os.posix_fadvise(stream.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        stream.close()
+    stream = _open_input(filename)
+    if stats.ENABLED:
+        # the phases are those of the main thread, which is busy with other
+        # inputs meanwhile
+        stream.phase = "prefetch"
+    try:
+        pdf = PdfFileReader(stream)
+        if pdf.isEncrypted:
+            # passwords are only prompted for in the main thread
+            if (filename not in PASSWORDS or
+                    not pdf.decrypt(PASSWORDS[filename])):
+                return pdf
+        # flatten the page tree
+        pdf.getNumPages()
+        return pdf
+    finally:
+        if stats.ENABLED:
+            # once handed out, the reader is used by the main thread
+            stream.phase = None
+
+
+def _existing(filename):
+    """Return FILENAME, which is checked to exist but opened later."""
+    if filename == STDIN:
+        _check_standard_streams()
+    elif not os.path.exists(filename):
+        raise CommandError("{} does not exist".format(filename))
+    return filename
+
+
+def _check_standard_streams():
+    if not STANDARD_STREAMS:
+        raise CommandError('The standard input and output ("-") cannot '
+                           'be used here.')
+
+
+def _label_range(labels, text):
+    """
+    Return the first and last page of a range of page labels, e.g.
+    "iii-x" or "C-12-C-40" (labels can contain dashes), or None.
+    """
+    pageno = labels.page(text)
+    if pageno is not None:
+        return pageno, pageno
+    for match in re.finditer('-', text):
+        begin = labels.page(text[:match.start()])
+        end = labels.page(text[match.end():])
+        if begin is not None and end is not None:
+            return begin, end
+    return None
+
+
+def _add_label_range(current, pages, match):
+    """Add the pages of a range like A:iii-x of CURRENT to PAGES."""
+    text = match.group(2)
+    labels = page_labels(current['pdf'])
+
+    rotate = ROTATION_NONE
+    found = _label_range(labels, text)
+    if found is None and text[-1] in 'LRD':
+        # a rotation, unless it's part of the labels
+        rotate = ROTATIONS[text[-1].lower()]
+        found = _label_range(labels, text[:-1])
+    if found is None:
+        raise CommandError("No pages labeled {} in {}".format(
+            text, current['name']))
+
+    begin, end = found
+    if begin <= end:
+        pagerange = range(begin, end + 1)
+    else:
+        pagerange = range(end, begin + 1)[::-1]
+    pages.add(pagerange, rotate)
+
+
+def _add_page_range(current, pages, match):
+    """Add the pages of a range like A2-4 or 1-end:2 of CURRENT to PAGES."""
+    inputname = match.string
+    max_page = current['pdf'].getNumPages()
+    # allow "end" as alias for the last page, and count negative
+    # numbers from the end, -1 being the last page
+    def replace_end(page):
+        if page.lower() == 'end':
+            return max_page
+        page = int(page)
+        if page >= 0:
+            return page
+        if -page > max_page:
+            raise CommandError(
+                "Range {} is before the first page of file "
+                "{}".format(inputname, current['name']))
+        return max_page + 1 + page
+
+    if match.group(2):
+        # odd or even pages of the whole file
+        begin, end, every = 1, max_page, match.group(2)
+    else:
+        begin = replace_end(match.group(3))
+        end = replace_end(match.group(4)) if match.group(4) else begin
+        every = match.group(5)
+
+    rotate = ROTATIONS.get((match.group(6) or 'u').lower())
+
+    if begin > max_page or end > max_page:
+        raise CommandError(
+            "Range {}-{} exceeds maximum page number "
+            "{} of file {}".format(
+                begin, end, max_page, current['name']))
+
+    # negative ranges sort pages backwards
+    if begin < end:
+        pagerange = range(begin, end + 1)
+    else:
+        pagerange = range(end, begin + 1)[::-1]
+
+    if every in ('odd', 'even'):
+        pagerange = pageset.stepped(pagerange, every)
+    elif every:
+        if int(every) == 0:
+            raise CommandError(
+                'Invalid step in range: {}'.format(inputname))
+        pagerange = pagerange[::int(every)]
+
+    pages.add(pagerange, rotate)
+
+
+HANDLE_PATTERN = re.compile('^[A-Z]=')
+LABEL_PATTERN = re.compile('^([A-Z])?:(.+)$')
+# e.g. 3, 2-end, -3--1, 1-end:2 (every other page), 5-1:odd, odd, evenL
+RANGE_PATTERN = re.compile('([A-Z])?(?:(odd|even)|(-?[0-9]+|end)'
+                           '(?:-(-?[0-9]+|end))?(?::([0-9]+|odd|even))?)'
+                           '([LRD]?)')
+
+
+def _parse_ranges(handles_files_and_ranges):
+    """
+    Parse the arguments into _Inputs. Their files are only opened, and
+    their ranges only resolved, when they are first used.
+    """
     operations = []
-    handle_pattern = re.compile('^[A-Z]=')
     for inputname in handles_files_and_ranges:
-        handle_key = None
-        handle_value = None
-        if handle_pattern.match(inputname):
-            handle_key,handle_value = inputname.split("=",2)
+        if HANDLE_PATTERN.match(inputname):
+            handle_key, handle_value = inputname.split("=", 2)
             HANDLES[handle_key] = handle_value
-        elif inputname.lower().endswith('.pdf'):
-            operations.append({"name": inputname,
-                               "pdf": read_pdf(inputname),
-                               "pages": []})
+            continue
+        elif inputname.lower().endswith('.pdf') or inputname == STDIN:
+            operations.append(_Input(_existing(inputname)))
+            continue
+        elif LABEL_PATTERN.match(inputname):
+            match, add = LABEL_PATTERN.match(inputname), _add_label_range
         else:
-            handle_key = None
-            handle_value = None
-            match = re.match('([A-Z])?([0-9]+|end)(?:-([0-9]+|end))?([LRD]?)',
-                                inputname)
+            match, add = RANGE_PATTERN.match(inputname), _add_page_range
             if not match:
                 raise CommandError('Invalid range: {}'.format(inputname))
 
-            if match.group(1):
-                handle_key = match.group(1)
-                if handle_key in HANDLES:
-                    handle_value = HANDLES[handle_key]
-                    operations.append({"name": handle_value,
-                                       "pdf": read_pdf(handle_value),
-                                       "pages": []})
-                else:
-                    raise CommandError(
-                        "Filehandle '{}' does not exist in "
-                        "page range '{}'".format(handle_key, inputname))
-
-            current = operations[-1]
-            max_page = current['pdf'].getNumPages()
-            # allow "end" as alias for the last page
-            replace_end = lambda page: (
-                max_page if page.lower() == 'end' else int(page))
-            begin = replace_end(match.group(2))
-            end = replace_end(match.group(3)) if match.group(3) else begin
-
-            rotate = ROTATIONS.get((match.group(4) or 'u').lower())
-
-            if begin > max_page or end > max_page:
+        handle_key = match.group(1)
+        if handle_key:
+            if handle_key not in HANDLES:
                 raise CommandError(
-                    "Range {}-{} exceeds maximum page number "
-                    "{} of file {}".format(
-                        begin, end, max_page, current['name']))
-
-            # negative ranges sort pages backwards
-            if begin < end:
-                pagerange = range(begin, end + 1)
-            else:
-                pagerange = range(end, begin + 1)[::-1]
-
-            for p in pagerange:
-                current['pages'].append((p, rotate))
+                    "Filehandle '{}' does not exist in "
+                    "page range '{}'".format(handle_key, inputname))
+            operations.append(_Input(_existing(HANDLES[handle_key])))
+        elif not operations:
+            raise CommandError('Invalid range: {}'.format(inputname))
+        operations[-1].ranges.append((add, match))
 
     return operations
@@ -0,0 +1,386 @@
+"""Rewrite finished output files linearized, see --linearize."""
+
+import io
+import os
+import shutil
+import tempfile
+
+try:
+    from PyPDF2 import PdfFileReader
+    from PyPDF2.generic import (ArrayObject, DecodedStreamObject,
+                                DictionaryObject, EncodedStreamObject,
+                                IndirectObject, NameObject, NullObject,
+                                NumberObject, StreamObject)
+except ImportError:
+    from pyPdf import PdfFileReader
+    from pyPdf.generic import (ArrayObject, DecodedStreamObject,
+                               DictionaryObject, EncodedStreamObject,
+                               IndirectObject, NameObject, NullObject,
+                               NumberObject, StreamObject)
+
+from . import CommandError
+
+# the parameters computed last are padded to a fixed width, so the length
+# of everything before the first page does not depend on them
+PARAMETERS = ("<< /Linearized 1 /L {L:010d} /H [ {H:010d} {H_length:010d} ] "
+              "/O {O} /E {E:010d} /N {N} /T {T:010d} >>")
+
+# bit widths of the header items of the hint tables, PDF 1.7 tables F.3/F.5
+PAGE_OFFSET_HEADER = (32, 32, 16, 32, 16, 32, 16, 32, 16, 16, 16, 16, 16)
+SHARED_OBJECT_HEADER = (32, 32, 32, 32, 16, 32, 16)
+
+
+class _BitWriter(object):
+    """Pack unsigned integers of given bit widths into bytes."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self._value = 0
+        self._bits = 0
+
+    def write(self, value, bits):
+        self._value = (self._value << bits) | value
+        self._bits += bits
+        while self._bits >= 8:
+            self._bits -= 8
+            self.data.append((self._value >> self._bits) & 0xff)
+        self._value &= (1 << self._bits) - 1
+
+    def write_all(self, values, bits):
+        """Write a sequence of items, padded to the next byte."""
+        for value in values:
+            self.write(value, bits)
+        if self._bits:
+            self.write(0, 8 - self._bits)
+
+
+def _bits(value):
+    return int(value).bit_length()
+
+
+def _key(ref):
+    return ref.idnum, ref.generation
+
+
+def _references(obj, parent=True):
+    """Return the indirect references directly in OBJ."""
+    found = []
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, IndirectObject):
+            found.append(value)
+        elif isinstance(value, DictionaryObject):
+            for name, item in value.items():
+                # stream lengths are written directly
+                if name == "/Length" and isinstance(value, StreamObject):
+                    continue
+                if name == "/Parent" and value is obj and not parent:
+                    continue
+                stack.append(item)
+        elif isinstance(value, ArrayObject):
+            stack.extend(value)
+    return found
+
+
+def _reachable(start, stop=()):
+    """
+    Return the keys of the objects reachable from the reference START, in
+    the order they are found, without entering the objects in STOP.
+    """
+    found = []
+    seen = set()
+    stack = [start]
+    while stack:
+        ref = stack.pop()
+        key = _key(ref)
+        if key in seen or (key in stop and ref is not start):
+            continue
+        seen.add(key)
+        found.append(key)
+        # a page's /Parent leads up the page tree to all other pages
+        children = _references(ref.getObject(), parent=ref is not start)
+        stack.extend(reversed(children))
+    return found
+
+
+def _renumbered(obj, numbers):
+    """Return a copy of OBJ with its references renumbered by NUMBERS."""
+    if isinstance(obj, IndirectObject):
+        number = numbers.get(_key(obj))
+        if number is None:
+            return NullObject()
+        return IndirectObject(number, 0, None)
+    if isinstance(obj, StreamObject):
+        # the data is copied as it is, still encoded
+        copy = (EncodedStreamObject() if "/Filter" in obj
+                else DecodedStreamObject())
+        copy._data = obj._data
+        for name, value in obj.items():
+            if name != "/Length":
+                copy[name] = _renumbered(value, numbers)
+        return copy
+    if isinstance(obj, DictionaryObject):
+        copy = DictionaryObject()
+        for name, value in obj.items():
+            copy[name] = _renumbered(value, numbers)
+        return copy
+    if isinstance(obj, ArrayObject):
+        return ArrayObject(_renumbered(value, numbers) for value in obj)
+    return obj
+
+
+def _serialized(obj):
+    stream = io.BytesIO()
+    obj.writeToStream(stream, None)
+    return stream.getvalue()
+
+
+class _Layout(object):
+    """
+    Sort the objects of a file into the sections of a linearized file, PDF
+    1.7 annex F.3: the catalog and the objects of the first page, each later
+    page with the objects only it uses, the objects several pages share and
+    everything else.
+    """
+
+    def __init__(self, reader):
+        root = reader.trailer.raw_get("/Root")
+        page_refs = [page.indirectRef for page in reader.pages]
+        # a page's objects do not include other pages, page tree nodes or
+        # the catalog
+        stop = set(_key(ref) for ref in page_refs)
+        stop.update(_key(ref) for ref in self._page_tree(reader))
+        stop.add(_key(root))
+        closures = [_reachable(ref, stop) for ref in page_refs]
+        users = {}
+        for closure in closures:
+            for key in closure:
+                users[key] = users.get(key, 0) + 1
+
+        self.catalog = _key(root)
+        self.first_page = closures[0]
+        assigned = set(self.first_page)
+        assigned.add(self.catalog)
+        self.pages = []
+        for closure in closures[1:]:
+            own = [key for key in closure
+                   if users[key] == 1 and key not in assigned]
+            assigned.update(own)
+            self.pages.append(own)
+        self.shared = []
+        for closure in closures[1:]:
+            for key in closure:
+                if key not in assigned:
+                    assigned.add(key)
+                    self.shared.append(key)
+        self.shared_by = [[key for key in closure if users[key] > 1]
+                          for closure in closures[1:]]
+        self.other = []
+        for name in ("/Root", "/Info"):
+            ref = reader.trailer.raw_get(name) \
+                if name in reader.trailer else None
+            if isinstance(ref, IndirectObject):
+                for key in _reachable(ref):
+                    if key not in assigned:
+                        assigned.add(key)
+                        self.other.append(key)
+
+    @staticmethod
+    def _page_tree(reader):
+        """Return the references of the intermediate page tree nodes."""
+        nodes = []
+        stack = [reader.trailer["/Root"].raw_get("/Pages")]
+        while stack:
+            ref = stack.pop()
+            nodes.append(ref)
+            for kid in ref.getObject().get("/Kids", ()):
+                if kid.getObject().get("/Type") == "/Pages":
+                    stack.append(kid)
+        return nodes
+
+
+def _hint_data(layout, numbers, spans):
+    """
+    Return the data of the primary hint stream and the offset of its shared
+    object hint table in it. SPANS maps object keys to their (start, end)
+    in the file as if there was no hint stream, as the hint tables have it.
+    """
+    def length(keys):
+        return spans[keys[-1]][1] - spans[keys[0]][0] if keys else 0
+
+    groups = layout.first_page + layout.shared
+    group_ids = dict((key, i) for i, key in enumerate(groups))
+    objects = [len(layout.first_page)] + [len(own) for own in layout.pages]
+    lengths = [length(layout.first_page)] + [
+        length(own) for own in layout.pages]
+    shared = [[]] + [[group_ids[key] for key in keys]
+                     for keys in layout.shared_by]
+
+    least_objects, least_length = min(objects), min(lengths)
+    object_bits = _bits(max(objects) - least_objects)
+    length_bits = _bits(max(lengths) - least_length)
+    shared_bits = _bits(max(len(ids) for ids in shared))
+    group_bits = _bits(len(groups) - 1)
+    pages = _BitWriter()
+    header = (least_objects, spans[layout.first_page[0]][0], object_bits,
+              least_length, length_bits,
+              0, 0,  # content streams are placed relative to their page
+              least_length, length_bits, shared_bits, group_bits,
+              0, 1)  # no fractional positions of shared objects
+    for value, bits in zip(header, PAGE_OFFSET_HEADER):
+        pages.write(value, bits)
+    pages.write_all([count - least_objects for count in objects], object_bits)
+    pages.write_all([count - least_length for count in lengths], length_bits)
+    pages.write_all([len(ids) for ids in shared], shared_bits)
+    pages.write_all([i for ids in shared for i in ids], group_bits)
+    # the numerators and the content stream offsets are written with zero
+    # bits; content streams may take the whole page
+    pages.write_all([count - least_length for count in lengths], length_bits)
+
+    group_lengths = [length([key]) for key in groups]
+    least_group = min(group_lengths)
+    group_length_bits = _bits(max(group_lengths) - least_group)
+    first_shared = layout.shared[0] if layout.shared else None
+    shared_table = _BitWriter()
+    header = (numbers[first_shared] if first_shared else 0,
+              spans[first_shared][0] if first_shared else 0,
+              len(layout.first_page), len(groups),
+              0,  # one object per group
+              least_group, group_length_bits)
+    for value, bits in zip(header, SHARED_OBJECT_HEADER):
+        shared_table.write(value, bits)
+    shared_table.write_all([count - least_group for count in group_lengths],
+                           group_length_bits)
+    shared_table.write_all([0] * len(groups), 1)  # no MD5 signatures
+    return bytes(pages.data + shared_table.data), len(pages.data)
+
+
+def linearize(filename):
+    """Rewrite the PDF file FILENAME linearized, in place."""
+    with open(filename, "rb") as stream:
+        version = stream.readline().rstrip()
+        stream.seek(0)
+        reader = PdfFileReader(stream)
+        if reader.isEncrypted:
+            raise CommandError("Cannot linearize encrypted output")
+        if reader.getNumPages() == 0:
+            raise CommandError("Cannot linearize output without pages")
+        layout = _Layout(reader)
+        handle, temporary = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(filename)))
+        try:
+            with os.fdopen(handle, "wb") as output:
+                _write(reader, layout, version, output)
+            # mkstemp() creates files only the owner can read
+            shutil.copymode(filename, temporary)
+            os.replace(temporary, filename)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+
+def _write_objects(keys, reader, numbers, output, base, spans):
+    for key in keys:
+        start = base + output.tell()
+        output.write(("%d 0 obj\n" % numbers[key]).encode("ascii"))
+        obj = reader.getObject(IndirectObject(key[0], key[1], reader))
+        output.write(_serialized(_renumbered(obj, numbers)))
+        output.write(b"\nendobj\n")
+        spans[key] = (start, base + output.tell())
+
+
+def _write(reader, layout, version, output):
+    """
+    Write the linearized file: the header, the linearization parameters,
+    the first page's cross-reference section, the catalog and the first
+    page, the hint stream, the other sections and the main cross-reference
+    section. The first page's section holds the highest object numbers.
+    """
+    rest = [key for own in layout.pages for key in own] + \
+        layout.shared + layout.other
+    first = [layout.catalog] + layout.first_page
+    numbers = dict((key, i + 1) for i, key in enumerate(rest))
+    parameters_number = len(rest) + 1
+    numbers.update((key, parameters_number + 1 + i)
+                   for i, key in enumerate(first))
+    hint_number = parameters_number + 1 + len(first)
+    size = hint_number + 1
+
+    trailer = DictionaryObject()
+    trailer[NameObject("/Size")] = NumberObject(size)
+    trailer[NameObject("/Root")] = _renumbered(
+        reader.trailer.raw_get("/Root"), numbers)
+    for name in ("/Info", "/ID"):
+        if name in reader.trailer:
+            trailer[NameObject(name)] = _renumbered(
+                reader.trailer.raw_get(name), numbers)
+
+    def front(parameters, offsets, main_xref):
+        """Return everything before the catalog and the first page."""
+        data = bytearray(version + b"\n%\xe2\xe3\xcf\xd3\n")
+        entries = [len(data)] + offsets
+        data += ("%d 0 obj\n" % parameters_number).encode("ascii")
+        data += PARAMETERS.format(**parameters).encode("ascii")
+        data += b"\nendobj\n"
+        xref = len(data)
+        data += ("xref\n%d %d\n" % (parameters_number, len(entries))
+                 ).encode("ascii")
+        for offset in entries:
+            data += ("%010d 00000 n \n" % offset).encode("ascii")
+        data += b"trailer\n" + _serialized(trailer)[:-2]
+        data += ("/Prev %010d >>\nstartxref\n0\n%%%%EOF\n" % main_xref
+                 ).encode("ascii")
+        return bytes(data), xref
+
+    parameters = dict.fromkeys(("L", "H", "H_length", "E", "T"), 0)
+    parameters["O"] = numbers[layout.first_page[0]]
+    parameters["N"] = len(layout.pages) + 1
+    data, first_xref = front(parameters, [0] * (len(first) + 1), 0)
+    base = len(data)
+
+    spans = {}
+    with tempfile.TemporaryFile() as first_part, \
+            tempfile.TemporaryFile() as rest_part:
+        _write_objects(first, reader, numbers, first_part, base, spans)
+        end = base + first_part.tell()
+        # the hint tables leave out the hint stream following the first page
+        _write_objects(rest, reader, numbers, rest_part, end, spans)
+        data, shared_offset = _hint_data(layout, numbers, spans)
+        hint = DecodedStreamObject()
+        hint._data = data
+        hint[NameObject("/S")] = NumberObject(shared_offset)
+        hint = ("%d 0 obj\n" % hint_number).encode("ascii") + \
+            _serialized(hint) + b"\nendobj\n"
+
+        main_xref = end + len(hint) + rest_part.tell()
+        xref = bytearray(("xref\n0 %d\n" % parameters_number).encode("ascii"))
+        first_entry = main_xref + len(xref)
+        xref += b"0000000000 65535 f \n"
+        for key in rest:
+            xref += ("%010d 00000 n \n" % (spans[key][0] + len(hint))
+                     ).encode("ascii")
+        xref += ("trailer\n<< /Size %d >>\nstartxref\n%d\n%%%%EOF\n" % (
+            parameters_number, first_xref)).encode("ascii")
+
+        parameters.update({
+            "L": main_xref + len(xref),
+            "H": end,
+            "H_length": len(hint),
+            "E": end,
+            # the white-space before the first entry of the main xref table
+            "T": first_entry - 1,
+        })
+        offsets = [spans[key][0] for key in first] + [end]
+        output.write(front(parameters, offsets, main_xref)[0])
+        first_part.seek(0)
+        _copy(first_part, output)
+        output.write(hint)
+        rest_part.seek(0)
+        _copy(rest_part, output)
+        output.write(bytes(xref))
+
+
+def _copy(source, destination):
+    for block in iter(lambda: source.read(1 << 20), b""):
+        destination.write(block)
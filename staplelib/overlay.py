@@ -0,0 +1,160 @@
+"""Draw pages on top of other pages as Form XObjects, see background."""
+
+try:
+    from PyPDF2.generic import (ArrayObject, DecodedStreamObject,
+                                DictionaryObject, EncodedStreamObject,
+                                NameObject, RectangleObject, StreamObject)
+except ImportError:
+    from pyPdf.generic import (ArrayObject, DecodedStreamObject,
+                               DictionaryObject, EncodedStreamObject,
+                               NameObject, RectangleObject, StreamObject)
+
+IDENTITY = (1, 0, 0, 1, 0, 0)
+
+
+def multiply(m, n):
+    """Return the transformation matrix applying M, then N."""
+    a, b, c, d, e, f = m
+    a2, b2, c2, d2, e2, f2 = n
+    return (a * a2 + b * c2, a * b2 + b * d2,
+            c * a2 + d * c2, c * b2 + d * d2,
+            e * a2 + f * c2 + e2, e * b2 + f * d2 + f2)
+
+
+def invert(m):
+    a, b, c, d, e, f = m
+    det = float(a * d - b * c)
+    return (d / det, -b / det, -c / det, a / det,
+            (c * f - d * e) / det, (b * e - a * f) / det)
+
+
+def display_matrix(page):
+    """
+    Return the matrix from the user space of PAGE to the page as it is
+    displayed, i.e. with the lower left corner of its media box at the
+    origin and its /Rotate applied.
+    """
+    box = page.mediaBox
+    x0, y0 = float(box.getLowerLeft_x()), float(box.getLowerLeft_y())
+    width = float(box.getUpperRight_x()) - x0
+    height = float(box.getUpperRight_y()) - y0
+    rotation = int(page.get("/Rotate", 0)) % 360
+
+    # clockwise rotation of a WIDTH x HEIGHT page
+    rotate = {0: IDENTITY,
+              90: (0, -1, 1, 0, 0, width),
+              180: (-1, 0, 0, -1, width, height),
+              270: (0, 1, -1, 0, height, 0)}[rotation]
+    return multiply((1, 0, 0, 1, -x0, -y0), rotate)
+
+
+def _format_number(value):
+    return ("%.4f" % value).rstrip("0").rstrip(".") or "0"
+
+
+class Stamper(object):
+    """
+    Stamp overlay pages onto the pages of an output.
+
+    Each overlay page is converted into a Form XObject when it is first
+    used and added to OUTPUT once. Stamping it onto a page only references
+    the form from the page's resources and adds a small content stream
+    drawing it, so the cost per page does not depend on the overlay, and
+    no content stream is decoded or re-encoded.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self._forms = {}  # (reader, generation, idnum) -> form reference
+        self._streams = {}  # content -> reference to a stream with it
+
+    def stamp(self, page, overlay):
+        """
+        Draw OVERLAY on top of PAGE, which must be a copy that can be
+        modified. Both are aligned as they are displayed, taking their
+        media boxes and rotations into account.
+        """
+        form = self._form(overlay)
+
+        resources = DictionaryObject()
+        if "/Resources" in page:
+            resources.update(page["/Resources"])
+        xobjects = DictionaryObject()
+        if "/XObject" in resources:
+            xobjects.update(resources["/XObject"])
+        number = len(xobjects)
+        while "/StaplerForm%d" % number in xobjects:
+            number += 1
+        name = NameObject("/StaplerForm%d" % number)
+        xobjects[name] = form
+        resources[NameObject("/XObject")] = xobjects
+        page[NameObject("/Resources")] = resources
+
+        matrix = multiply(display_matrix(overlay),
+                          invert(display_matrix(page)))
+        if matrix == IDENTITY:
+            draw = "Q q %s Do Q\n" % name
+        else:
+            draw = "Q q %s cm %s Do Q\n" % (
+                " ".join(_format_number(value) for value in matrix), name)
+
+        # the page's own content is wrapped in q/Q, so that its graphics
+        # state does not affect the overlay
+        contents = []
+        if "/Contents" in page:
+            if isinstance(page["/Contents"], ArrayObject):
+                contents.extend(page["/Contents"])
+            else:
+                contents.append(page.raw_get("/Contents"))
+        page[NameObject("/Contents")] = ArrayObject(
+            [self._stream(b"q\n")] + contents +
+            [self._stream(draw.encode("ascii"))])
+
+    def _stream(self, data):
+        """Return a reference to a content stream with DATA, shared."""
+        if data not in self._streams:
+            stream = DecodedStreamObject()
+            stream._data = data
+            self._streams[data] = self.output._addObject(stream)
+        return self._streams[data]
+
+    def _form(self, overlay):
+        """Return a reference to a Form XObject drawing OVERLAY."""
+        if overlay.indirectRef is not None:
+            key = (overlay.pdf, overlay.indirectRef.generation,
+                   overlay.indirectRef.idnum)
+        else:
+            key = id(overlay)
+        if key in self._forms:
+            return self._forms[key]
+
+        contents = overlay["/Contents"] if "/Contents" in overlay else None
+        if isinstance(contents, StreamObject):
+            # a single content stream is used as is, still encoded
+            if "/Filter" in contents:
+                form = EncodedStreamObject()
+                for name in ("/Filter", "/DecodeParms"):
+                    if name in contents:
+                        form[NameObject(name)] = contents.raw_get(name)
+            else:
+                form = DecodedStreamObject()
+            form._data = contents._data
+        else:
+            form = DecodedStreamObject()
+            form._data = b"\n".join(part.getObject().getData()
+                                    for part in contents or [])
+            form = form.flateEncode()
+
+        form.update({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Form"),
+            NameObject("/BBox"): RectangleObject(overlay.mediaBox),
+            NameObject("/Resources"): overlay.raw_get("/Resources")
+            if "/Resources" in overlay else DictionaryObject(),
+        })
+        if "/Group" in overlay:
+            # e.g. a transparency group of the page
+            form[NameObject("/Group")] = overlay.raw_get("/Group")
+
+        self._forms[key] = self.output._addObject(form)
+        return self._forms[key]
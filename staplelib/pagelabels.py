@@ -0,0 +1,228 @@
+"""Logical page numbers ("labels") of PDF files, see /PageLabels."""
+
+import bisect
+import re
+
+from . import CommandError
+
+
+def int_to_page_alpha(pageno, base):
+    """return uppercase alphabetic page numbers for PAGENO starting at BASE (a or A).
+Adobe defines them as A to Z, then AA to ZZ, and so on.
+Yes, that is somewhat wacky."""
+    (div, mod) = divmod( pageno-1, 26)
+    c = chr(mod + ord(base))
+    return c * (div+1)
+
+# next text is from Paul M. Winkler
+# via https://www.oreilly.com/library/view/python-cookbook/0596001673/ch03s24.html
+def int_to_roman(input):
+    """ Convert an integer to a Roman numeral. """
+
+    if not isinstance(input, type(1)):
+        raise TypeError("expected integer, got %s" % type(input))
+    if not 0 < input < 4000:
+        raise ValueError("Argument must be between 1 and 3999")
+    ints = (1000, 900,  500, 400, 100,  90, 50,  40, 10,  9,   5,  4,   1)
+    nums = ('M',  'CM', 'D', 'CD','C', 'XC','L','XL','X','IX','V','IV','I')
+    result = []
+    for i in range(len(ints)):
+        count = int(input / ints[i])
+        result.append(nums[i] * count)
+        input -= ints[i] * count
+    return ''.join(result)
+
+
+def roman_to_int(numeral):
+    """Convert an (upper-case) Roman numeral to an integer, or None."""
+    values = {'I': 1, 'V': 5, 'X': 10, 'L': 50, 'C': 100, 'D': 500,
+              'M': 1000}
+    total = 0
+    for i, c in enumerate(numeral):
+        value = values[c]
+        if i + 1 < len(numeral) and values[numeral[i + 1]] > value:
+            total -= value
+        else:
+            total += value
+    # only accept the canonical spelling, e.g. not IIII
+    if 0 < total < 4000 and int_to_roman(total) == numeral:
+        return total
+    return None
+
+
+def format_number(style, number):
+    """Return the numeric part of a label in STYLE (/D, /A, /R...)."""
+    if style == '/D':
+        return str(number)
+    elif style == '/A':
+        return int_to_page_alpha(number, 'A')
+    elif style == '/a':
+        return int_to_page_alpha(number, 'a')
+    elif style == '/R':
+        return int_to_roman(number)
+    elif style == '/r':
+        return int_to_roman(number).lower()
+    raise CommandError("Malformded PDF: unkown page numbering style " +
+                       style)
+
+
+# the numeric part at the end of a label, per style
+NUMBER_PATTERNS = {
+    '/D': re.compile(r'[0-9]+$'),
+    '/A': re.compile(r'([A-Z])\1*$'),
+    '/a': re.compile(r'([a-z])\1*$'),
+    '/R': re.compile(r'[IVXLCDM]+$'),
+    '/r': re.compile(r'[ivxlcdm]+$'),
+}
+
+
+def parse_number(style, text):
+    """Return the number TEXT stands for in STYLE, or None."""
+    if style == '/D':
+        return int(text)
+    elif style in ('/A', '/a'):
+        return (len(text) - 1) * 26 + ord(text[0].upper()) - ord('A') + 1
+    return roman_to_int(text.upper())
+
+
+#
+# PageLabels (formerly commands.pdf_page_enumeration) is
+# inspired by  https://stackoverflow.com/questions/12360999/retrieve-page-numbers-from-document-with-pypdf
+# (thanks vjayky!)
+# and informed by https://www.w3.org/TR/WCAG20-TECHS/PDF17.html
+# (thanks, w3c!)
+# which recaps the PDF-1.7 specification
+# https://www.adobe.com/content/dam/acom/en/devnet/pdf/pdfs/PDF32000_2008.pdf
+#
+class PageLabels(object):
+    """
+    An index of the logical page numbers of a document.
+
+    The /PageLabels number tree is read into a sorted list of label ranges
+    once. The label of a page is then found by bisecting the ranges, and
+    the page of a label by bisecting the numbers used with its prefix and
+    style, so neither needs to format the labels of all pages or scan all
+    ranges.
+
+    Pages are numbered from 1, as in stapler's page ranges.
+    """
+
+    def __init__(self, pagelabels, pages):
+        self.pages = pages
+        self._starts = []  # first page (0-based) of each range
+        self._ranges = []  # (style, prefix, first number) of each range
+        # (prefix, style) -> (first numbers, [(end number, range index)]),
+        # see _index_numbers()
+        self._numbers = {}
+
+        entries = []
+        if pagelabels is not None:
+            if "/Nums" not in pagelabels and "/Kids" not in pagelabels:
+                raise CommandError("Malformed PDF, /Root/PageLabels but no "
+                                   ".../Nums object")
+            self._read_tree(pagelabels, entries, set())
+        entries.sort(key=lambda entry: entry[0])
+        if not entries or entries[0][0] > 0:
+            # pages before the first range are numbered 1, 2, ...
+            entries.insert(0, (0, {}))
+
+        by_prefix = {}  # (prefix, style) -> [range index, ...]
+        for start, label in entries:
+            if self._starts and start == self._starts[-1]:
+                continue
+            style = label.get('/S', '/D')
+            prefix = label.get('/P', '')
+            self._starts.append(start)
+            self._ranges.append((style, prefix, int(label.get('/St', 1))))
+            by_prefix.setdefault((prefix, style), []).append(
+                len(self._ranges) - 1)
+        for key, ranges in by_prefix.items():
+            self._numbers[key] = self._index_numbers(ranges)
+
+    def _read_tree(self, node, entries, seen):
+        """Collect the (page index, label dictionary) pairs of a tree."""
+        node = node.getObject()
+        if id(node) in seen:
+            return
+        seen.add(id(node))
+        nums = node.get("/Nums")
+        if nums is not None:
+            nums = nums.getObject()
+            for i in range(0, len(nums) - 1, 2):
+                entries.append((int(nums[i]), nums[i + 1].getObject()))
+        for kid in node.get("/Kids", None) or []:
+            self._read_tree(kid, entries, seen)
+
+    def _end(self, i):
+        """Return the page (0-based) after the range I."""
+        end = self._starts[i + 1] if i + 1 < len(self._starts) else self.pages
+        return min(end, self.pages)
+
+    def _index_numbers(self, ranges):
+        """
+        Return the numbers of RANGES, which share a prefix and style, as
+        sorted, disjoint intervals: a list of their first numbers and one
+        of (end number, range index) pairs. Ranges may restart their
+        numbering, e.g. per chapter; a number then belongs to the first of
+        the ranges that use it.
+        """
+        firsts, spans = [], []
+        for i in ranges:
+            number = self._ranges[i][2]
+            end = number + self._end(i) - self._starts[i]
+            while number < end:
+                j = bisect.bisect_right(firsts, number)
+                if j and spans[j - 1][0] > number:
+                    # used by an earlier range
+                    number = spans[j - 1][0]
+                    continue
+                stop = min(end, firsts[j]) if j < len(firsts) else end
+                firsts.insert(j, number)
+                spans.insert(j, (stop, i))
+                number = stop
+        return firsts, spans
+
+    def __len__(self):
+        return self.pages
+
+    def __iter__(self):
+        """Generate the labels of all pages in order."""
+        for i, (style, prefix, first) in enumerate(self._ranges):
+            for offset in range(self._end(i) - self._starts[i]):
+                yield prefix + format_number(style, first + offset)
+
+    def label(self, pageno):
+        """Return the label of the page PAGENO."""
+        i = bisect.bisect_right(self._starts, pageno - 1) - 1
+        style, prefix, first = self._ranges[i]
+        return prefix + format_number(style,
+                                      first + pageno - 1 - self._starts[i])
+
+    def page(self, label):
+        """
+        Return the number of the (first) page with the label LABEL, or
+        None if there is none.
+        """
+        found = None
+        for style, pattern in NUMBER_PATTERNS.items():
+            match = pattern.search(label)
+            if not match:
+                continue
+            # the prefix may end with what looks like a number, too
+            for split in range(match.start(), match.end()):
+                prefix, text = label[:split], label[split:]
+                numbers = self._numbers.get((prefix, style))
+                if not numbers:
+                    continue
+                number = parse_number(style, text)
+                if number is None or format_number(style, number) != text:
+                    continue
+                firsts, spans = numbers
+                j = bisect.bisect_right(firsts, number) - 1
+                if j < 0 or number >= spans[j][0]:
+                    continue
+                i = spans[j][1]
+                pageno = self._starts[i] + number - self._ranges[i][2] + 1
+                if found is None or pageno < found:
+                    found = pageno
+        return found
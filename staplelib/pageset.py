@@ -0,0 +1,147 @@
+"""Compact representations of page selections, see parse_ranges()."""
+
+import bisect
+
+
+def stepped(pages, parity=None):
+    """
+    Restrict PAGES, a range of page numbers, to odd or even pages if
+    PARITY is "odd" or "even". Returns a range again.
+    """
+    if parity is None:
+        return pages
+    wanted = 1 if parity == "odd" else 0
+    start = next((p for p in pages[:2] if p % 2 == wanted), None)
+    if start is None:
+        return range(0)
+    if pages.step % 2 == 0:
+        # every page in PAGES has the same parity as the first one
+        return range(start, pages.stop, pages.step)
+    return range(start, pages.stop, pages.step * 2)
+
+
+class Selection(object):
+    """
+    The pages selected from an input: an ordered list of ranges of page
+    numbers, each with a rotation.
+
+    Pages are only enumerated when the selection is iterated, so e.g.
+    "1-100000" takes as little memory as "1".
+    """
+
+    def __init__(self):
+        self.ranges = []  # (range of page numbers, rotation)
+
+    def add(self, pages, rotate):
+        """Add a range of page numbers, rotated by ROTATE degrees."""
+        # even an empty range counts, as no range means all pages
+        self.ranges.append((pages, rotate))
+
+    def __iter__(self):
+        """Generate (page number, rotation) pairs in order."""
+        for pages, rotate in self.ranges:
+            for pageno in pages:
+                yield pageno, rotate
+
+    def __len__(self):
+        return sum(len(pages) for pages, rotate in self.ranges)
+
+    def __bool__(self):
+        return bool(self.ranges)
+
+    __nonzero__ = __bool__
+
+    def pages(self):
+        """Return the selected page numbers as a PageSet."""
+        intervals = []
+        for pages, rotate in self.ranges:
+            if not pages:
+                continue
+            if abs(pages.step) == 1:
+                intervals.append((min(pages), max(pages)))
+            else:
+                intervals.extend((pageno, pageno) for pageno in pages)
+        return PageSet(intervals)
+
+
+class PageSet(object):
+    """
+    A set of page numbers, stored as sorted, disjoint intervals.
+
+    Operations take time linear in the number of intervals, not in the
+    number of pages, and iterating generates the pages in ascending order.
+    """
+
+    def __init__(self, intervals=()):
+        # (first, last) pairs, merged when they overlap or touch
+        self.intervals = []
+        for first, last in sorted(intervals):
+            if self.intervals and first <= self.intervals[-1][1] + 1:
+                if last > self.intervals[-1][1]:
+                    self.intervals[-1] = (self.intervals[-1][0], last)
+            else:
+                self.intervals.append((first, last))
+
+    @classmethod
+    def all(cls, count):
+        """Return the set of pages 1 to COUNT."""
+        return cls([(1, count)] if count > 0 else [])
+
+    def __iter__(self):
+        for first, last in self.intervals:
+            for pageno in range(first, last + 1):
+                yield pageno
+
+    def __len__(self):
+        return sum(last - first + 1 for first, last in self.intervals)
+
+    def __contains__(self, pageno):
+        i = bisect.bisect_right(self.intervals, (pageno, float("inf"))) - 1
+        return i >= 0 and self.intervals[i][0] <= pageno <= \
+            self.intervals[i][1]
+
+    def __eq__(self, other):
+        return isinstance(other, PageSet) and \
+            self.intervals == other.intervals
+
+    def __repr__(self):
+        return "PageSet(%r)" % self.intervals
+
+    def union(self, other):
+        return PageSet(self.intervals + other.intervals)
+
+    def intersection(self, other):
+        result = []
+        i = j = 0
+        while i < len(self.intervals) and j < len(other.intervals):
+            first = max(self.intervals[i][0], other.intervals[j][0])
+            last = min(self.intervals[i][1], other.intervals[j][1])
+            if first <= last:
+                result.append((first, last))
+            # drop whichever interval ends first
+            if self.intervals[i][1] < other.intervals[j][1]:
+                i += 1
+            else:
+                j += 1
+        return PageSet(result)
+
+    def difference(self, other):
+        result = []
+        j = 0
+        for first, last in self.intervals:
+            # skip the intervals of OTHER that end before this one
+            while j < len(other.intervals) and other.intervals[j][1] < first:
+                j += 1
+            k = j
+            while k < len(other.intervals) and other.intervals[k][0] <= last:
+                if other.intervals[k][0] > first:
+                    result.append((first, other.intervals[k][0] - 1))
+                first = max(first, other.intervals[k][1] + 1)
+                k += 1
+            if first <= last:
+                result.append((first, last))
+        return PageSet(result)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
@@ -0,0 +1,615 @@
+"""A PDF writer that serializes pages as soon as they are added."""
+
+import codecs
+import collections
+import hashlib
+import io
+import struct
+import zlib
+
+try:
+    from PyPDF2 import PdfFileWriter
+    from PyPDF2.generic import (ArrayObject, DecodedStreamObject,
+                                DictionaryObject, EncodedStreamObject,
+                                IndirectObject, NameObject, NullObject,
+                                NumberObject, StreamObject,
+                                createStringObject, readNonWhitespace,
+                                readObject, skipOverComment)
+except ImportError:
+    from pyPdf import PdfFileWriter
+    from pyPdf.generic import (ArrayObject, DecodedStreamObject,
+                               DictionaryObject, EncodedStreamObject,
+                               IndirectObject, NameObject, NullObject,
+                               NumberObject, StreamObject,
+                               createStringObject, readNonWhitespace,
+                               readObject, skipOverComment)
+
+# bytes of stream data copied from an input file at once
+COPY_CHUNK_SIZE = 1 << 20
+
+# streams being compressed at once per worker thread, see recompress
+COMPRESS_QUEUE = 4
+
+# zlib level of object and cross-reference streams
+OBJECT_STREAM_LEVEL = 6
+
+
+def _deflate(data, inflate, level):
+    """Compress stream DATA, decompressing it first if INFLATE is set."""
+    if inflate:
+        try:
+            data = zlib.decompress(data)
+        except zlib.error:
+            return None
+    return zlib.compress(data, level)
+
+
+class _CountingStream(object):
+    """Wrap an output stream and keep track of the bytes written to it."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = 0
+
+    def write(self, data):
+        self.stream.write(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+
+class StreamingPdfWriter(object):
+    """
+    Write pages to a PDF file while they are being added.
+
+    PdfFileWriter keeps every page and everything it references in memory
+    until write() is called. This writer instead copies each added page and
+    the objects it references to the output right away, keeping only the
+    object numbers and offsets needed for the page tree and xref table,
+    which are written by close().
+
+    Objects already written are remembered by their number in the source
+    file, so shared resources (fonts, images) are only written once. Pages
+    referenced from other pages (e.g., by link annotations) are held back
+    until they are either added or the file is closed.
+
+    Streams of unencrypted input files are copied to an unencrypted output
+    as they are in the input file: only their dictionary is parsed, and
+    their (usually compressed) data is copied in chunks without ever being
+    loaded as a PDF object.
+
+    With DEDUPLICATE, streams (fonts, images, ICC profiles, form XObjects)
+    are also recognized by a hash of their content, so identical copies
+    from different input files are only written once as well.
+
+    With a RECOMPRESS level, uncompressed and Flate compressed streams are
+    (re-)compressed at that zlib level, in WORKERS threads. A stream keeps
+    its original encoding if that is smaller.
+
+    With an OBJECT_STREAM_SIZE, objects other than streams are packed that
+    many at a time into compressed object streams, and the xref table is
+    written as a cross-reference stream (PDF 1.5).
+    """
+
+    def __init__(self, stream, deduplicate=False, recompress=None,
+                 workers=1, object_stream_size=None):
+        self._stream = _CountingStream(stream)
+        self._deduplicate = deduplicate
+        self._recompress = recompress
+        self._compressing = collections.deque()  # (idnum, stream, future)
+        self._executor = None
+        if recompress is not None and workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            # zlib releases the GIL, so threads compress in parallel
+            self._executor = ThreadPoolExecutor(max_workers=workers)
+            self._queue_size = workers * COMPRESS_QUEUE
+        self.compressed = 0  # streams made smaller by recompressing them
+        self.compression_saved = 0
+        self._digests = {}  # content digest -> IndirectObject of a stream
+        self._object_digests = {}  # (reader, generation, idnum) -> digest
+        self.duplicates = 0  # streams not written thanks to deduplication
+        self.bytes_saved = 0
+        self.copied = 0  # streams copied from the input files as they are
+        self._offsets = {}  # idnum -> byte offset of the object
+        self._numbers = {}  # reader -> {(generation, idnum): IndirectObject}
+        self._pending = []  # (idnum, object or reference) still to write
+        self._deferred = {}  # idnum -> page only referenced so far
+        self._loaded = set()  # readers with stream data in their cache
+        self._kids = ArrayObject()
+        self._next_idnum = 1
+        self._object_stream_size = object_stream_size
+        self._packing = []  # (idnum, object) for the next object stream
+        self._packed = {}  # idnum -> (object stream idnum, index in it)
+        self.object_streams = 0  # object streams written
+        self.packed = 0  # objects written into them
+
+        self._pages = self._allocate()
+        self._info = self._allocate()
+        self._root = self._allocate()
+
+        if object_stream_size:
+            self._stream.write(b"%PDF-1.5\n")
+        else:
+            self._stream.write(b"%PDF-1.3\n")
+
+    def _allocate(self):
+        ref = IndirectObject(self._next_idnum, 0, self)
+        self._next_idnum += 1
+        return ref
+
+    def _addObject(self, obj):
+        """Write an object that is not a page, e.g. a Form XObject."""
+        # also used by PdfFileWriter.encrypt()
+        ref = self._allocate()
+        self._pending.append((ref.idnum, obj))
+        self._flush()
+        return ref
+
+    def encrypt(self, user_pwd, owner_pwd=None, use_128bit=True):
+        """Encrypt the output, see PdfFileWriter.encrypt()."""
+        if self._offsets:
+            raise ValueError("Encryption must be set up before adding pages")
+        # the encryption dictionary must not be in an object stream
+        object_stream_size = self._object_stream_size
+        self._object_stream_size = None
+        try:
+            PdfFileWriter.encrypt(self, user_pwd, owner_pwd, use_128bit)
+        finally:
+            self._object_stream_size = object_stream_size
+
+    def getNumPages(self):
+        return len(self._kids)
+
+    def tell(self):
+        """Return the number of bytes written to the output so far."""
+        return self._stream.tell()
+
+    def getObjectCount(self):
+        """Return the number of objects written or reserved so far."""
+        return self._next_idnum - 1
+
+    def addPage(self, page):
+        """Write PAGE and all objects it references to the output."""
+        assert page["/Type"] == "/Page"
+
+        if page.indirectRef is not None:
+            key = (page.indirectRef.generation, page.indirectRef.idnum)
+            numbers = self._numbers.setdefault(page.pdf, {})
+            ref = numbers.get(key)
+            if ref is None or ref.idnum not in self._deferred:
+                ref = self._allocate()
+            else:
+                del self._deferred[ref.idnum]
+            # references from the page to itself (e.g., in annotations)
+            # point to the new copy, see PdfFileWriter.write()
+            numbers[key] = ref
+        else:
+            ref = self._allocate()
+
+        data = DictionaryObject(page)
+        data[NameObject("/Parent")] = self._pages
+        self._kids.append(ref)
+        self._pending.append((ref.idnum, data))
+        self._flush()
+        self._write_compressed()
+        self._release_readers()
+
+    def _flush(self):
+        while self._pending:
+            idnum, obj = self._pending.pop()
+            if isinstance(obj, IndirectObject):
+                if self._copy_stream(idnum, obj):
+                    continue
+                try:
+                    reader, obj = obj.pdf, obj.getObject()
+                except ValueError:
+                    # unable to resolve the object, see PdfFileWriter
+                    obj = NullObject()
+                if isinstance(obj, StreamObject):
+                    self._loaded.add(reader)
+                if (isinstance(obj, DictionaryObject) and
+                        obj.get("/Type") == "/Page"):
+                    self._deferred[idnum] = obj
+                    continue
+            obj = self._sweep(obj)
+            if isinstance(obj, StreamObject) and self._recompressible(obj):
+                self._compress(idnum, obj)
+            else:
+                self._write_object(idnum, obj)
+
+    def _copy_stream(self, idnum, ido):
+        """
+        Write the referenced object as object IDNUM if it is a stream that
+        can be copied from its input file as is; return whether it was.
+        """
+        reader = ido.pdf
+        if (self._deduplicate or hasattr(self, "_encrypt") or
+                not hasattr(reader, "xref") or reader.isEncrypted or
+                reader.cacheGetIndirectObject(ido.generation,
+                                              ido.idnum) is not None):
+            return False
+        offset = reader.xref.get(ido.generation, {}).get(ido.idnum)
+        if offset is None:
+            return False
+
+        stream = reader.stream
+        stream.seek(offset)
+        if reader.readObjectHeader(stream) != (ido.idnum, ido.generation):
+            return False
+        if stream.read(2) != b"<<":
+            return False
+        data = self._read_dictionary(stream, reader)
+
+        if (readNonWhitespace(stream) != b"s" or
+                stream.read(5) != b"tream" or "/Length" not in data):
+            # a plain dictionary; keep it for getObject()
+            reader.cacheIndirectObject(ido.generation, ido.idnum, data)
+            return False
+        if self._recompressible(data):
+            return False
+        eol = stream.read(1)
+        while eol == b" ":
+            eol = stream.read(1)
+        if eol == b"\r" and stream.read(1) != b"\n":
+            stream.seek(-1, 1)
+        start = stream.tell()
+        length = data["/Length"]  # may seek to resolve a reference
+        stream.seek(start + length)
+        if readNonWhitespace(stream) + stream.read(8) != b"endstream":
+            # let PyPDF2 deal with the wrong length
+            return False
+
+        data[NameObject("/Length")] = NumberObject(length)
+        self._offsets[idnum] = self._stream.tell()
+        self._stream.write(("%d 0 obj\n" % idnum).encode("ascii"))
+        self._sweep(data).writeToStream(self._stream, None)
+        self._stream.write(b"\nstream\n")
+        stream.seek(start)
+        while length:
+            chunk = stream.read(min(length, COPY_CHUNK_SIZE))
+            if not chunk:
+                raise IOError("Unexpected end of stream data")
+            self._stream.write(chunk)
+            length -= len(chunk)
+        self._stream.write(b"\nendstream\nendobj\n")
+        self.copied += 1
+        return True
+
+    def _read_dictionary(self, stream, reader):
+        """
+        Read the entries of a dictionary after its "<<", like
+        DictionaryObject.readFromStream() but without any stream data.
+        """
+        data = DictionaryObject()
+        while True:
+            token = readNonWhitespace(stream)
+            if token == b"\x00":
+                continue
+            elif token == b"%":
+                stream.seek(-1, 1)
+                skipOverComment(stream)
+                continue
+            elif not token:
+                raise IOError("Stream has ended unexpectedly")
+            elif token == b">":
+                stream.read(1)
+                return data
+            stream.seek(-1, 1)
+            key = readObject(stream, reader)
+            readNonWhitespace(stream)
+            stream.seek(-1, 1)
+            value = readObject(stream, reader)
+            if key not in data:
+                data[key] = value
+
+    def _recompressible(self, obj):
+        """Return whether the stream OBJ is to be compressed."""
+        if self._recompress is None:
+            return False
+        # XMP metadata is left uncompressed to be readable by other tools
+        if obj.get("/Type") == "/Metadata" or "/DecodeParms" in obj:
+            return False
+        return obj.get("/Filter") in (None, "/FlateDecode",
+                                      ["/FlateDecode"])
+
+    def _compress(self, idnum, obj):
+        """Compress the stream OBJ, to be written by _write_compressed()."""
+        args = (obj._data, "/Filter" in obj, self._recompress)
+        if self._executor is None:
+            self._compressing.append((idnum, obj, _deflate(*args)))
+            self._write_compressed()
+        else:
+            self._compressing.append(
+                (idnum, obj, self._executor.submit(_deflate, *args)))
+
+    def _write_compressed(self, wait=False):
+        """Write the streams compressed so far, in order."""
+        while self._compressing:
+            idnum, obj, data = self._compressing[0]
+            if hasattr(data, "result"):
+                # limit the memory used by pending streams
+                if not (wait or data.done() or
+                        len(self._compressing) > self._queue_size):
+                    return
+                data = data.result()
+            self._compressing.popleft()
+
+            if data is not None and len(data) < len(obj._data):
+                self.compressed += 1
+                self.compression_saved += len(obj._data) - len(data)
+                stream = EncodedStreamObject()
+                stream.update(obj)
+                stream[NameObject("/Filter")] = NameObject("/FlateDecode")
+                stream._data = data
+                obj = stream
+            self._write_object(idnum, obj)
+
+    def _release_readers(self):
+        # everything needed from the input files has been written, so their
+        # object caches can be dropped to keep memory usage flat; caches
+        # without stream data are kept for later pages
+        for reader in self._loaded:
+            if reader is not None and hasattr(reader, "resolvedObjects"):
+                reader.resolvedObjects.clear()
+        self._loaded.clear()
+
+    def _reference(self, ido):
+        """Map a reference into a source file to an output object number."""
+        if ido.pdf is self:
+            return ido
+        numbers = self._numbers.setdefault(ido.pdf, {})
+        key = (ido.generation, ido.idnum)
+        ref = numbers.get(key)
+        if ref is None:
+            digest = self._stream_digest(ido) if self._deduplicate else None
+            ref = self._digests.get(digest)
+            if ref is None:
+                ref = self._allocate()
+                self._pending.append((ref.idnum, ido))
+                if digest:
+                    self._digests[digest] = ref
+            else:
+                self.duplicates += 1
+                self.bytes_saved += len(ido.getObject()._data)
+            numbers[key] = ref
+        return ref
+
+    def _stream_digest(self, ido):
+        """Return a content hash of the referenced object if it's a stream."""
+        try:
+            if not isinstance(ido.getObject(), StreamObject):
+                return None
+        except ValueError:
+            return None
+        self._loaded.add(ido.pdf)
+        return self._digest(ido, set())
+
+    def _digest(self, ido, active):
+        key = (ido.pdf, ido.generation, ido.idnum)
+        if key not in self._object_digests:
+            if key in active:
+                # a reference cycle; don't claim equality with anything else
+                return ("cycle %r" % (key[1:],)).encode("ascii")
+            active.add(key)
+            content = hashlib.sha1()
+            self._hash(content, ido.getObject(), active)
+            active.discard(key)
+            self._object_digests[key] = content.digest()
+        return self._object_digests[key]
+
+    def _hash(self, content, data, active):
+        """Feed DATA to CONTENT, with references replaced by their digest."""
+        if isinstance(data, IndirectObject):
+            content.update(b"R" + self._digest(data, active))
+        elif isinstance(data, DictionaryObject):
+            content.update(b"<<")
+            for key in sorted(data):
+                if key == "/Length" and isinstance(data, StreamObject):
+                    continue
+                content.update(key.encode("utf-8"))
+                self._hash(content, dict.__getitem__(data, key), active)
+            content.update(b">>")
+            if isinstance(data, StreamObject):
+                content.update(("stream %d " % len(data._data))
+                               .encode("ascii"))
+                content.update(data._data)
+        elif isinstance(data, ArrayObject):
+            content.update(b"[")
+            for value in data:
+                self._hash(content, value, active)
+            content.update(b"]")
+        else:
+            content.update(("%s %r " % (type(data).__name__, data))
+                           .encode("utf-8"))
+
+    def _sweep(self, data):
+        """Copy DATA with all indirect references mapped to the output."""
+        if isinstance(data, DictionaryObject):
+            if isinstance(data, StreamObject):
+                if "/Filter" in data:
+                    copy = EncodedStreamObject()
+                else:
+                    copy = DecodedStreamObject()
+                copy._data = data._data
+            else:
+                copy = DictionaryObject()
+            for key, value in data.items():
+                copy[key] = self._sweep_value(value)
+            return copy
+        elif isinstance(data, ArrayObject):
+            return ArrayObject(self._sweep_value(value) for value in data)
+        elif isinstance(data, IndirectObject):
+            return self._reference(data)
+        return data
+
+    def _sweep_value(self, value):
+        if isinstance(value, StreamObject):
+            # streams must be indirect objects
+            ref = self._allocate()
+            self._pending.append((ref.idnum, value))
+            return ref
+        return self._sweep(value)
+
+    def _object_key(self, idnum):
+        if not hasattr(self, "_encrypt") or idnum == self._encrypt.idnum:
+            return None
+        pack1 = struct.pack("<i", idnum)[:3]
+        pack2 = struct.pack("<i", 0)[:2]
+        key = self._encrypt_key + pack1 + pack2
+        return hashlib.md5(key).digest()[:min(16, len(self._encrypt_key) + 5)]
+
+    def _write_object(self, idnum, obj):
+        if self._object_stream_size and not isinstance(obj, StreamObject):
+            self._packing.append((idnum, obj))
+            if len(self._packing) >= self._object_stream_size:
+                self._write_object_stream()
+            return
+        self._offsets[idnum] = self._stream.tell()
+        self._stream.write(("%d 0 obj\n" % idnum).encode("ascii"))
+        obj.writeToStream(self._stream, self._object_key(idnum))
+        self._stream.write(b"\nendobj\n")
+
+    def _write_object_stream(self):
+        """Write the objects collected so far as one object stream."""
+        if not self._packing:
+            return
+        ref = self._allocate()
+        offsets = []
+        body = io.BytesIO()
+        for index, (idnum, obj) in enumerate(self._packing):
+            offsets.append("%d %d" % (idnum, body.tell()))
+            # the object stream as a whole is encrypted, not its objects
+            obj.writeToStream(body, None)
+            body.write(b"\n")
+            self._packed[idnum] = (ref.idnum, index)
+        header = (" ".join(offsets) + "\n").encode("ascii")
+        stream = EncodedStreamObject()
+        stream.update({
+            NameObject("/Type"): NameObject("/ObjStm"),
+            NameObject("/N"): NumberObject(len(self._packing)),
+            NameObject("/First"): NumberObject(len(header)),
+            NameObject("/Filter"): NameObject("/FlateDecode"),
+        })
+        stream._data = zlib.compress(header + body.getvalue(),
+                                     OBJECT_STREAM_LEVEL)
+        self.packed += len(self._packing)
+        del self._packing[:]
+        self.object_streams += 1
+        self._write_object(ref.idnum, stream)
+
+    def abort(self):
+        """Close the file without finishing it, leaving it incomplete."""
+        if self._executor is not None:
+            self._executor.shutdown()
+        self._stream.stream.close()
+
+    def close(self):
+        """Write the page tree, xref table and trailer and close the file."""
+        # pages that were referenced but never added are copied as-is,
+        # just like PdfFileWriter does
+        while self._deferred:
+            idnum = min(self._deferred)
+            page = self._deferred.pop(idnum)
+            self._write_object(idnum, self._sweep(page))
+            self._flush()
+        self._write_compressed(wait=True)
+        if self._executor is not None:
+            self._executor.shutdown()
+
+        pages = DictionaryObject()
+        pages.update({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Count"): NumberObject(len(self._kids)),
+            NameObject("/Kids"): self._kids,
+        })
+        self._write_object(self._pages.idnum, pages)
+
+        info = DictionaryObject()
+        info.update({
+            NameObject("/Producer"): createStringObject(
+                codecs.BOM_UTF16_BE + u"PyPDF2".encode("utf-16be"))
+        })
+        self._write_object(self._info.idnum, info)
+
+        root = DictionaryObject()
+        root.update({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): self._pages,
+        })
+        self._write_object(self._root.idnum, root)
+
+        trailer = DictionaryObject()
+        trailer.update({
+            NameObject("/Size"): NumberObject(self._next_idnum),
+            NameObject("/Root"): self._root,
+            NameObject("/Info"): self._info,
+        })
+        if hasattr(self, "_ID"):
+            trailer[NameObject("/ID")] = self._ID
+        if hasattr(self, "_encrypt"):
+            trailer[NameObject("/Encrypt")] = self._encrypt
+        if self._object_stream_size:
+            self._write_object_stream()
+            self._write_xref_stream(trailer)
+        else:
+            self._write_xref_table(trailer)
+        self._stream.stream.close()
+
+    def _write_xref_table(self, trailer):
+        xref_location = self._stream.tell()
+        self._stream.write(b"xref\n")
+        self._stream.write(("0 %d\n" % self._next_idnum).encode("ascii"))
+        self._stream.write(b"0000000000 65535 f \n")
+        for idnum in range(1, self._next_idnum):
+            self._stream.write(
+                ("%010d 00000 n \n" % self._offsets[idnum]).encode("ascii"))
+        self._stream.write(b"trailer\n")
+        trailer.writeToStream(self._stream, None)
+        self._stream.write(
+            ("\nstartxref\n%d\n%%%%EOF\n" % xref_location).encode("ascii"))
+
+    def _write_xref_stream(self, trailer):
+        """Write the xref table as a cross-reference stream, PDF 1.7 7.5.8."""
+        xref = self._allocate()
+        self._offsets[xref.idnum] = self._stream.tell()
+        # entries: type, offset or object stream, generation or index
+        offset_width = _byte_width(max(self._stream.tell(),
+                                       self._next_idnum))
+        index_width = _byte_width(max([65535] + [
+            index for idnum, index in self._packed.values()]))
+        entries = [b"\x00" + b"\x00" * offset_width +
+                   (65535).to_bytes(index_width, "big")]
+        for idnum in range(1, self._next_idnum):
+            if idnum in self._packed:
+                stream, index = self._packed[idnum]
+                entries.append(b"\x02" +
+                               stream.to_bytes(offset_width, "big") +
+                               index.to_bytes(index_width, "big"))
+            else:
+                entries.append(b"\x01" +
+                               self._offsets[idnum].to_bytes(offset_width,
+                                                             "big") +
+                               b"\x00" * index_width)
+
+        stream = EncodedStreamObject()
+        stream.update(trailer)
+        stream.update({
+            NameObject("/Type"): NameObject("/XRef"),
+            NameObject("/Size"): NumberObject(self._next_idnum),
+            NameObject("/W"): ArrayObject([NumberObject(1),
+                                           NumberObject(offset_width),
+                                           NumberObject(index_width)]),
+            NameObject("/Filter"): NameObject("/FlateDecode"),
+        })
+        stream._data = zlib.compress(b"".join(entries), OBJECT_STREAM_LEVEL)
+        self._stream.write(("%d 0 obj\n" % xref.idnum).encode("ascii"))
+        # cross-reference streams are never encrypted
+        stream.writeToStream(self._stream, None)
+        self._stream.write(("\nendobj\nstartxref\n%d\n%%%%EOF\n" %
+                            self._offsets[xref.idnum]).encode("ascii"))
+
+
+def _byte_width(value):
+    """Return the number of bytes needed to store VALUE."""
+    return max(1, (int(value).bit_length() + 7) // 8)
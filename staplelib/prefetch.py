@@ -0,0 +1,84 @@
+"""Open and parse upcoming input files in the background, see --prefetch."""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class Prefetcher(object):
+    """
+    Load input files in a pool of threads, up to DEPTH files ahead of the
+    one in use.
+
+    LOAD is called with each of FILENAMES in order and returns its reader.
+    While the main thread works on the pages of one input, the next ones
+    are read and parsed, so waiting for (e.g., network) storage overlaps
+    with assembling and writing the output.
+    """
+
+    def __init__(self, filenames, depth, load):
+        from concurrent.futures import ThreadPoolExecutor
+        # filename -> its position among the distinct inputs
+        self._positions = OrderedDict()
+        for filename in filenames:
+            self._positions.setdefault(filename, len(self._positions))
+        self._filenames = list(self._positions)
+        self._depth = depth
+        self._load = load
+        self._futures = {}  # filename -> future of its reader
+        self._scheduled = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=depth)
+        self.loaded = 0  # inputs handed out by get()
+        self.busy = 0.0  # seconds spent loading inputs in the background
+        self.waited = 0.0  # seconds get() had to wait for them
+        self._schedule(depth)
+
+    def _schedule(self, count):
+        """Start loading the first COUNT inputs, if not done yet."""
+        while self._scheduled < min(count, len(self._filenames)):
+            filename = self._filenames[self._scheduled]
+            self._futures[filename] = self._executor.submit(self._run,
+                                                            filename)
+            self._scheduled += 1
+
+    def _run(self, filename):
+        start = time.time()
+        try:
+            return self._load(filename)
+        finally:
+            with self._lock:
+                self.busy += time.time() - start
+
+    def get(self, filename):
+        """
+        Return the reader of FILENAME, waiting for it if necessary, or None
+        if it is not prefetched (any more). Errors loading it are raised.
+        """
+        future = self._futures.pop(filename, None)
+        if future is None:
+            return None
+        # keep DEPTH inputs loading beyond this one
+        self._schedule(self._positions[filename] + 1 + self._depth)
+        start = time.time()
+        try:
+            return future.result()
+        finally:
+            self.waited += time.time() - start
+            self.loaded += 1
+
+    def overlap(self):
+        """Return the share of the loading time hidden behind other work."""
+        if not self.busy:
+            return 0.0
+        return max(0.0, 1 - self.waited / self.busy)
+
+    def close(self):
+        """Stop loading and close the inputs that were never used."""
+        for future in self._futures.values():
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        for future in self._futures.values():
+            if not future.cancelled() and future.exception() is None:
+                future.result().stream.close()
+        self._futures.clear()
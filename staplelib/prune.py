@@ -0,0 +1,192 @@
+"""Leave out resources the selected pages do not use, see --prune."""
+
+import re
+
+try:
+    from PyPDF2.generic import (ArrayObject, DictionaryObject,
+                                IndirectObject, NameObject, StreamObject)
+except ImportError:
+    from pyPdf.generic import (ArrayObject, DictionaryObject,
+                               IndirectObject, NameObject, StreamObject)
+
+# resource categories whose entries are referenced by name from content
+# streams; /ProcSet is not
+CATEGORIES = ("/ExtGState", "/ColorSpace", "/Pattern", "/Shading",
+              "/XObject", "/Font", "/Properties")
+
+# a name token in a content stream, PDF 1.7 7.3.5
+NAME = re.compile(br"/[^\s/\[\]()<>{}%]*")
+
+
+class Pruner(object):
+    """
+    Remove the entries of page resource dictionaries that a page does not
+    use.
+
+    Pages from documents with one resource dictionary shared by all pages
+    reference every font and image of the document from each page, so
+    selecting a few pages would copy all of them. The names used by a page
+    are found by scanning its content streams, and those of the form
+    XObjects it paints that inherit its resources, for name tokens.
+    Anything that looks like a name is kept, so a name in a text string
+    may keep a resource that is not used, but never the other way round.
+
+    Resource dictionaries are shared between pages (and readers are shared
+    between outputs), so pages get a pruned copy; the originals are not
+    modified. Objects only referenced by the removed entries are never
+    reached by the PDF writers and so left out of the output.
+
+    With COUNT, the objects and stream bytes left out are counted, see
+    report().
+    """
+
+    def __init__(self, count=False):
+        self.pruned = 0  # resource entries removed from pages
+        self._count = count
+        self._dropped = set()  # objects reachable from removed entries
+        self._kept = set()  # objects reachable from the pages as written
+        self._sizes = {}  # object -> length of its stream data
+
+    def prune(self, page):
+        """Remove unused resources from the (copied) PAGE in place."""
+        if "/Resources" not in page:
+            return page
+        resources = page["/Resources"]
+        used = self._used_names(page, resources)
+        if used is None:
+            # the page's content could not be scanned completely
+            self._keep(page)
+            return page
+
+        pruned = DictionaryObject()
+        removed = []
+        for category, entries in resources.items():
+            entries_object = entries.getObject()
+            if (category not in CATEGORIES or
+                    not isinstance(entries_object, DictionaryObject)):
+                pruned[category] = entries
+                continue
+            kept = DictionaryObject()
+            for name, value in entries_object.items():
+                if name.encode("utf-8") in used:
+                    kept[name] = value
+                else:
+                    removed.append(value)
+            if kept:
+                pruned[category] = kept
+            if len(kept) == len(entries_object):
+                # nothing to remove; keep sharing the original
+                pruned[category] = entries
+        if removed:
+            page[NameObject("/Resources")] = pruned
+            self.pruned += len(removed)
+            if self._count:
+                for value in removed:
+                    self._walk(value, self._dropped)
+        self._keep(page)
+        return page
+
+    def _used_names(self, page, resources):
+        """
+        Return the set of names in the content of PAGE, or None if it
+        cannot be scanned.
+        """
+        used = set()
+        contents = page.get("/Contents")
+        if contents is None:
+            return used
+        contents = contents.getObject()
+        streams = contents if isinstance(contents, ArrayObject) else \
+            [contents]
+        pending = [stream.getObject() for stream in streams]
+        scanned = set(id(stream) for stream in pending)
+        while pending:
+            stream = pending.pop()
+            try:
+                data = stream.getData()
+            except Exception:
+                # e.g., a filter PyPDF2 cannot decode
+                return None
+            names = set(NAME.findall(data))
+            used.update(names)
+
+            # form XObjects, Type 3 fonts and tiling patterns without
+            # resources of their own use those of the page
+            for category in ("/XObject", "/Font", "/Pattern"):
+                entries = resources.get(category)
+                if entries is None:
+                    continue
+                entries = entries.getObject()
+                for name, value in entries.items():
+                    if name.encode("utf-8") not in names:
+                        continue
+                    inherits = self._inherits(value)
+                    if inherits is None:
+                        return None
+                    for content in inherits:
+                        if id(content) not in scanned:
+                            scanned.add(id(content))
+                            pending.append(content)
+        return used
+
+    @staticmethod
+    def _inherits(value):
+        """
+        Return the content streams of a resource that inherit the page's
+        resources, an empty list if it has none, or None if they cannot be
+        scanned.
+        """
+        obj = value.getObject()
+        if not isinstance(obj, DictionaryObject) or "/Resources" in obj:
+            return []
+        if isinstance(obj, StreamObject):
+            # form XObjects and tiling patterns
+            if obj.get("/Subtype") == "/Form" or \
+                    obj.get("/PatternType") == 1:
+                return [obj]
+            return []
+        if obj.get("/Subtype") == "/Type3":
+            procs = obj.get("/CharProcs")
+            if procs is None:
+                return None
+            return [proc.getObject() for proc in procs.getObject().values()]
+        return []
+
+    def _keep(self, page):
+        if not self._count:
+            return
+        for name, value in page.items():
+            if name != "/Parent":
+                self._walk(value, self._kept)
+
+    def _walk(self, value, found):
+        """Add the objects reachable from VALUE to FOUND."""
+        stack = [value]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, IndirectObject):
+                key = (id(value.pdf), value.generation, value.idnum)
+                if key in found:
+                    continue
+                found.add(key)
+                obj = value.getObject()
+                if isinstance(obj, StreamObject):
+                    self._sizes[key] = len(obj._data)
+                if (isinstance(obj, DictionaryObject) and
+                        obj.get("/Type") == "/Page"):
+                    # other pages are written only if they are selected
+                    continue
+                stack.append(obj)
+            elif isinstance(value, DictionaryObject):
+                stack.extend(value.values())
+            elif isinstance(value, ArrayObject):
+                stack.extend(value)
+
+    def report(self):
+        """
+        Return the numbers of resource entries removed, of objects no
+        longer written and of the stream bytes in them.
+        """
+        dropped = self._dropped - self._kept
+        return (self.pruned, len(dropped),
+                sum(self._sizes.get(key, 0) for key in dropped))
@@ -0,0 +1,191 @@
+"""A long-running stapler server and its client."""
+
+from __future__ import print_function
+import argparse
+import errno
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+import time
+
+from . import CommandError
+import staplelib
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+# options of the server that requests cannot override
+SERVER_OPTIONS = ("mode", "socket", "jobs")
+
+
+def default_socket():
+    """
+    Return the socket path used when --socket is not given: in
+    $XDG_RUNTIME_DIR, or else in a directory of the temp directory that
+    only the current user can use.
+    """
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime and os.path.isdir(runtime):
+        return os.path.join(runtime, "stapler.sock")
+    uid = os.getuid() if hasattr(os, "getuid") else 0
+    directory = os.path.join(tempfile.gettempdir(), "stapler-{}".format(uid))
+    try:
+        os.mkdir(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise CommandError("Cannot create {}: {}".format(directory, e))
+    # anybody can create it first in a shared temp directory
+    info = os.lstat(directory)
+    if (not stat.S_ISDIR(info.st_mode) or _foreign(info) or
+            info.st_mode & 0o077):
+        raise CommandError("{} is not a private directory of the current "
+                           "user".format(directory))
+    return os.path.join(directory, "stapler.sock")
+
+
+def _foreign(info):
+    """Return whether the file with the stat() result INFO is not ours."""
+    return hasattr(os, "getuid") and info.st_uid != os.getuid()
+
+
+def _serve_job(jobid, arguments, defaults, cwd):
+    """Run a request in a worker process, see batch.run_job()."""
+    from . import batch
+    os.chdir(cwd)
+    return batch.run_job(jobid, arguments, defaults)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Answer each line of JSON with the result of running it as a job."""
+
+    def handle(self):
+        for line in self.rfile:
+            start = time.time()
+            try:
+                result = self.server.run(json.loads(line.decode("utf-8")))
+            except Exception as e:
+                result = {"status": "error", "error": str(e)}
+            result["total_seconds"] = round(time.time() - start, 6)
+            self.wfile.write(json.dumps(result).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class StaplerServer(socketserver.ThreadingMixIn,
+                        socketserver.UnixStreamServer):
+        """
+        Serve stapler jobs on a Unix domain socket.
+
+        Requests are handed to a pool of worker processes, which keep the
+        PDF library imported and recently used inputs parsed in between.
+        """
+
+        daemon_threads = True
+
+        def __init__(self, path, defaults, executor):
+            self.defaults = defaults
+            self.executor = executor
+            socketserver.UnixStreamServer.__init__(self, path,
+                                                   _RequestHandler)
+
+        def run(self, request):
+            """Run a request ({"args": [...], ...}) and return its result."""
+            if not isinstance(request, dict) or \
+                    not isinstance(request.get("args"), list):
+                raise CommandError("Request has no list of arguments")
+
+            defaults = argparse.Namespace(**vars(self.defaults))
+            for name, value in request.get("options", {}).items():
+                if hasattr(defaults, name) and name not in SERVER_OPTIONS:
+                    setattr(defaults, name, value)
+            defaults.jobs = 1
+
+            future = self.executor.submit(
+                _serve_job, request.get("id"), request["args"], defaults,
+                request.get("cwd", os.getcwd()))
+            return future.result()
+else:
+    StaplerServer = None
+
+
+def make_server(path, workers):
+    """Create a StaplerServer listening on PATH, using the current OPTIONS."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    if StaplerServer is None:
+        raise CommandError("serve needs Unix domain sockets.")
+    if workers < 1:
+        raise CommandError("The number of jobs must be at least 1.")
+    if os.path.exists(path):
+        if not staplelib.OPTIONS.force:
+            raise CommandError("Socket already exists: {}".format(path))
+        os.remove(path)
+    # only the current user may connect
+    umask = os.umask(0o177)
+    try:
+        return StaplerServer(path, staplelib.OPTIONS,
+                             ProcessPoolExecutor(max_workers=workers))
+    finally:
+        os.umask(umask)
+
+
+def serve(args):
+    """Run jobs sent by stapler clients until interrupted."""
+    if args:
+        raise CommandError("serve does not take any arguments.")
+    path = staplelib.OPTIONS.socket or default_socket()
+
+    server = make_server(path, staplelib.OPTIONS.jobs)
+    if staplelib.OPTIONS.verbose:
+        print("Listening on {}".format(path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.executor.shutdown()
+        os.remove(path)
+
+
+def client(args):
+    """Send a stapler command line to a server and wait for the result."""
+    if not args:
+        raise CommandError("No command to send to the server.")
+    path = staplelib.OPTIONS.socket or default_socket()
+
+    # the client's own options are the defaults for the job
+    options = dict((name, value) for name, value in
+                   vars(staplelib.OPTIONS).items()
+                   if name not in SERVER_OPTIONS)
+    request = {"args": args, "options": options, "cwd": os.getcwd()}
+
+    # the command line and working directory go to whoever listens there
+    if os.path.exists(path) and _foreign(os.stat(path)):
+        raise CommandError("{} belongs to another user".format(path))
+    try:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(path)
+    except (AttributeError, socket.error) as e:
+        raise CommandError("Cannot connect to {}: {}".format(path, e))
+    try:
+        connection.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        response = connection.makefile("rb").readline()
+    finally:
+        connection.close()
+    if not response:
+        raise CommandError("No response from {}".format(path))
+    result = json.loads(response.decode("utf-8"))
+
+    if result.get("output"):
+        sys.stdout.write(result["output"])
+    if staplelib.OPTIONS.verbose:
+        print("Job took {:.3f}s, {:.3f}s including queueing.".format(
+            result.get("seconds", 0), result["total_seconds"]))
+    if result["status"] != "ok":
+        raise CommandError(result.get("error"))
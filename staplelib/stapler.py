@@ -4,12 +4,14 @@
 
 from __future__ import print_function
 
+import copy
+import importlib
 import os
 import sys
 from argparse import ArgumentParser
 
 import staplelib
-from . import commands, CommandError
+from . import CommandError, stats
 
 USAGE = """
 usage: %(prog)s [options] mode (input.pdf|input handle) ... [output.pdf]
@@ -20,8 +22,12 @@ cat/sel: <inputfile>|<input handle> [<pagerange>[<rotation>]] ... (output needed
     No range means all pages.
 del: <inputfile> [<pagerange>[<rotation>]] ... (output needed)
     Select all but the given pages/ranges from input files.
+compress: <inputfile>|<input handle> [<pagerange>[<rotation>]] ... (output needed)
+    Like cat, but compress uncompressed and re-compress Flate streams
+    (at --recompress LEVEL, by default 9).
 burst/split: <inputfile> ... (no output needed)
-    Create one file per page in input pdf files (no output needed)
+    Create one file per page in input pdf files (no output needed), or
+    per chunk with --chunk-pages, --chunk-size or --chunk-bookmarks
 zip: <inputfile>|<input handle> [<pagerange>[<rotation>]] ... (output needed)
     Merge/Collate the given input files interleaved.
 background: <inputfile> [<pagerange>[<rotation>]] ... (output needed)
@@ -30,6 +36,22 @@ info: <inputfile> ... (no output needed)
     Display PDF metadata
 list-log(ical): <inputfile>
     Display the logical names of each page.
+batch: <manifest> (no output needed)
+    Run the jobs of a manifest, one JSON list of arguments per line
+    (e.g., ["cat", "a.pdf", "b.pdf", "out.pdf"]), "-" reads from stdin.
+serve: (no input or output needed)
+    Run jobs sent by stapler clients on a local socket until interrupted.
+client: <mode> <arguments> ...
+    Run a stapler command line on a running server.
+
+Input files:
+    A directory or a glob pattern (e.g., 'scans/*.pdf') stands for the PDF
+    files in it or matching it, sorted by name; @<listfile> for the
+    arguments in a file, one per line. "-" reads a file from stdin.
+
+Output file:
+    "-" writes to stdout (cat/sel/del/compress/zip/background); messages
+    then go to stderr.
 
 Input handle:
     A single, upper-case letter as an alias to a file
@@ -39,14 +61,29 @@ Page ranges:
     n - single numbers mean single pages (e.g., 15)
     n-m - page ranges include the entire specified range (e.g. 1-6)
     m-n - negative ranges sort pages backwards (e.g., 6-3)
+    -n - negative numbers count from the end (e.g., -2--1, the last 2 pages)
 
 Extended page range options:
     ...-end will be replaced with the last page in the file
+    odd, even select the odd or even pages of the file
+    <range>:n, <range>:odd, <range>:even keep every n-th, the odd or the
+        even pages of a range (e.g., 1-end:2)
     R, L, or D will rotate the respective range +90, -90, or 180 degrees,
         respectively. (e.g., 1-15R)
+    A:<label>[-<label>] selects pages by their logical page numbers
+        (e.g., A:iii-x, or :C-12-C-40 for the preceding input file)
 """.strip()
 
 # command line option parser
+def byte_size(text):
+    """Parse a number of bytes with an optional k, M or G suffix."""
+    factors = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+    factor = factors.get(text[-1:].lower())
+    if factor:
+        text = text[:-1]
+    return int(text) * (factor or 1)
+
+
 argparser = ArgumentParser(usage=USAGE)
 argparser.add_argument('-o', '--ownerpw',
                        action='store',
@@ -71,11 +108,192 @@ argparser.add_argument('-d', '--destdir',
                        dest="destdir",
                        default="." + os.sep,
                        help="directory where to store output file", )
+argparser.add_argument('-j', '--jobs',
+                       dest='jobs',
+                       type=int,
+                       default=1,
+                       help='Number of worker processes for burst/split '
+                            'and info, or threads for --recompress', )
+argparser.add_argument('--prefetch',
+                       dest='prefetch',
+                       type=int,
+                       default=0,
+                       metavar='DEPTH',
+                       help='Open and parse up to DEPTH input files ahead '
+                            'in threads while pages are being written', )
+argparser.add_argument('--cache',
+                       dest='cache',
+                       default=None,
+                       metavar='DIR',
+                       help='Reuse the output of an earlier sel/del/zip/'
+                            'background run with the same inputs, caching '
+                            'outputs in DIR', )
+argparser.add_argument('--cache-size',
+                       dest='cache_size',
+                       type=byte_size,
+                       default=1 << 30,
+                       metavar='BYTES',
+                       help='Evict the least recently used outputs when '
+                            'the --cache exceeds BYTES (default: 1G)', )
+argparser.add_argument('--cache-stats',
+                       action='store_true',
+                       dest='cache_stats',
+                       help='Report cache hits, misses and evictions on '
+                            'stderr',
+                       default=False)
+argparser.add_argument('--max-open-files',
+                       dest='max_open_files',
+                       type=int,
+                       default=256,
+                       metavar='N',
+                       help='Keep at most N input files open at a time, '
+                            'reopening others when they are used again', )
+argparser.add_argument('--spool-size',
+                       dest='spool_size',
+                       type=byte_size,
+                       default=64 << 20,
+                       metavar='BYTES',
+                       help='Keep an input read from stdin in memory up to '
+                            'BYTES (64M by default), in a temporary file '
+                            'beyond that', )
+argparser.add_argument('--chunk-pages',
+                       dest='chunk_pages',
+                       type=int,
+                       default=None,
+                       metavar='N',
+                       help='Let burst/split write N pages per file', )
+argparser.add_argument('--chunk-size',
+                       dest='chunk_size',
+                       type=byte_size,
+                       default=None,
+                       metavar='BYTES',
+                       help='Let burst/split start a new file once one has '
+                            'BYTES (e.g. 500k, 10M) or more', )
+argparser.add_argument('--chunk-bookmarks',
+                       action='store_true',
+                       dest='chunk_bookmarks',
+                       help='Let burst/split start a new file at each '
+                            'top-level bookmark',
+                       default=False)
+argparser.add_argument('--format',
+                       dest='format',
+                       choices=('text', 'jsonl'),
+                       default='text',
+                       help='Output format of info: text or one JSON '
+                            'object per line', )
+argparser.add_argument('-s', '--streaming',
+                       action='store_true',
+                       dest='streaming',
+                       help='Write pages to the output file as they are added '
+                            'to keep memory usage flat for large jobs',
+                       default=False)
+argparser.add_argument('--socket',
+                       dest='socket',
+                       default=None,
+                       help='Unix socket of the stapler server for serve and '
+                            'client', )
+argparser.add_argument('--dedup',
+                       action='store_true',
+                       dest='dedup',
+                       help='Write identical fonts, images and other streams '
+                            'from different inputs only once',
+                       default=False)
+argparser.add_argument('--recompress',
+                       dest='recompress',
+                       type=int,
+                       choices=range(10),
+                       default=None,
+                       metavar='LEVEL',
+                       help='Compress uncompressed and re-compress Flate '
+                            'streams at zlib LEVEL (0-9)', )
+argparser.add_argument('--prune',
+                       action='store_true',
+                       dest='prune',
+                       help='For sel/del, leave out fonts, images and other '
+                            'resources the selected pages do not use',
+                       default=False)
+argparser.add_argument('--object-streams',
+                       dest='object_streams',
+                       type=int,
+                       default=None,
+                       metavar='N',
+                       help='Pack up to N objects at a time into compressed '
+                            'object streams, with a cross-reference stream '
+                            '(PDF 1.5)', )
+argparser.add_argument('--linearize',
+                       action='store_true',
+                       dest='linearize',
+                       help='Write linearized output files ("fast web '
+                            'view"), whose first page displays before the '
+                            'rest is downloaded',
+                       default=False)
+argparser.add_argument('--incremental',
+                       action='store_true',
+                       dest='incremental',
+                       help='For sel/del with the input file as output, '
+                            'append the changes to it instead of rewriting '
+                            'it',
+                       default=False)
+argparser.add_argument('--stats',
+                       dest='stats',
+                       nargs='?',
+                       const='text',
+                       choices=('text', 'json'),
+                       default=None,
+                       help='Print time, bytes read/written, pages and '
+                            'objects per phase to stderr, as a table or JSON')
+argparser.add_argument('--profile',
+                       dest='profile',
+                       default=None,
+                       metavar='FILE',
+                       help='Write cProfile statistics of the run to FILE '
+                            '(see the pstats module)')
 argparser.add_argument('mode',
                        action='store',
                        help="requested stapler mode")
 
 
+# Modes whose last argument is the output file, which may be stdout
+OUTPUT_MODES = ("cat", "sel", "del", "compress", "zip", "background")
+
+# Modes and the functions implementing them, as "<module>.<function>" in
+# staplelib. Modules are only imported when their mode is dispatched, so
+# e.g. --help or client do not pay for importing the PDF library.
+MODES = {
+    "cat": "commands.select",
+    "sel": "commands.select",
+    "split": "commands.split",
+    "burst": "commands.split",
+    "del": "commands.delete",
+    "compress": "commands.compress",
+    "info": "commands.info",
+    "zip": "commands.zip",
+    "background": "commands.background",
+    "list-log": "commands.list_logical_pages",
+    "list-logical": "commands.list_logical_pages",
+    "batch": "batch.batch",
+    "serve": "server.serve",
+    "client": "server.client",
+}
+
+
+def load_mode(mode):
+    """Import the implementation of MODE and return it."""
+    module, function = MODES[mode].rsplit(".", 1)
+    return getattr(importlib.import_module("staplelib." + module), function)
+
+
+def parse_arguments(arguments, defaults=None):
+    """
+    Parse a command line into the options and the arguments for the mode.
+
+    Options that are not given on the command line are taken from DEFAULTS,
+    the options of another command line, if given.
+    """
+    namespace = copy.copy(defaults) if defaults else None
+    return argparser.parse_known_args(args=arguments, namespace=namespace)
+
+
 def main(arguments=None):
     """
     Handle all command line arguments and pass them on to the respective
@@ -85,7 +303,7 @@ def main(arguments=None):
     if not arguments:
         arguments = sys.argv[1:]
 
-    (staplelib.OPTIONS, args) = argparser.parse_known_args(args=arguments)
+    (staplelib.OPTIONS, args) = parse_arguments(arguments)
 
     if not os.path.exists(staplelib.OPTIONS.destdir):
         print_error_and_exit("cannot find output directory named {}".format(
@@ -94,32 +312,48 @@ def main(arguments=None):
     if (len(args) < 1):
         print_error_and_exit("Not enough arguments", show_usage=True)
 
-    modes = {
-        "cat": commands.select,
-        "sel": commands.select,
-        "split": commands.split,
-        "burst": commands.split,
-        "del": commands.delete,
-        "info": commands.info,
-        "zip": commands.zip,
-        "background": commands.background,
-        "list-log": commands.list_logical_pages,
-        "list-logical": commands.list_logical_pages,
-    }
-
     mode = staplelib.OPTIONS.mode
 
-    if mode not in modes:
+    if mode not in MODES:
         print_error_and_exit('Please enter a valid mode', show_usage=True)
 
+    stdout = sys.stdout
+    if mode in OUTPUT_MODES and args[-1] == "-":
+        # the output file goes to stdout, so messages go to stderr
+        sys.stdout = sys.stderr
+
     if staplelib.OPTIONS.verbose:
         print("Mode: %s" % mode)
 
+    stats.reset()
+    stats.ENABLED = bool(staplelib.OPTIONS.stats)
+    profile = None
+    if staplelib.OPTIONS.profile:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+
     # dispatch call to known subcommand
     try:
-        modes[mode](args)
+        load_mode(mode)(args)
     except CommandError as e:
         print_error_and_exit(e)
+    finally:
+        # only modes that work with PDF files have loaded iohelper
+        iohelper = sys.modules.get("staplelib.iohelper")
+        if iohelper:
+            iohelper.discard_pdfs()
+            iohelper.close_pdfs()
+
+        if profile:
+            profile.disable()
+            profile.dump_stats(staplelib.OPTIONS.profile)
+        if stats.ENABLED:
+            stats.report(staplelib.OPTIONS.stats)
+        if staplelib.OPTIONS.cache and staplelib.OPTIONS.cache_stats:
+            from . import cache
+            cache.report()
+        sys.stdout = stdout
 
 
 def print_error_and_exit(msg, code=1, show_usage=False):
@@ -0,0 +1,156 @@
+"""Per-phase statistics about a stapler run, see --stats."""
+
+from __future__ import print_function
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+ENABLED = False
+
+COUNTERS = ("seconds", "calls", "pages", "objects", "bytes_read",
+            "bytes_written")
+
+PHASES = OrderedDict()  # phase name -> {counter: value}
+_stack = []  # [phase name, time it was entered or resumed]
+_lock = threading.Lock()  # for add() from other threads
+
+
+def _counters(name):
+    if name not in PHASES:
+        PHASES[name] = dict((counter, 0) for counter in COUNTERS)
+    return PHASES[name]
+
+
+class phase(object):
+    """
+    Attribute the time spent in a block, and what is counted in it, to a
+    phase.
+
+    Phases can be nested; time spent in an inner phase is not counted for
+    the outer one.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if not ENABLED:
+            return
+        now = time.time()
+        if _stack:
+            _counters(_stack[-1][0])["seconds"] += now - _stack[-1][1]
+        _counters(self.name)["calls"] += 1
+        _stack.append([self.name, now])
+
+    def __exit__(self, *exc_info):
+        if not ENABLED:
+            return
+        now = time.time()
+        name, resumed = _stack.pop()
+        _counters(name)["seconds"] += now - resumed
+        if _stack:
+            _stack[-1][1] = now
+
+
+def count(**counters):
+    """Add to the counters of the current phase."""
+    if not ENABLED:
+        return
+    current = _counters(_stack[-1][0] if _stack else "other")
+    for counter, value in counters.items():
+        current[counter] += value
+
+
+def add(name, **counters):
+    """
+    Add to the counters of the phase NAME, from any thread.
+
+    The phases entered with phase() are those of the main thread; work done
+    in other threads meanwhile is counted under a phase of its own.
+    """
+    if not ENABLED:
+        return
+    with _lock:
+        current = _counters(name)
+        for counter, value in counters.items():
+            current[counter] += value
+
+
+def snapshot():
+    """Return the counters so far, e.g. to pass them from a worker."""
+    return dict((name, dict(counters)) for name, counters in PHASES.items())
+
+
+def merge(phases):
+    """Add counters from snapshot() of another process."""
+    for name, counters in (phases or {}).items():
+        current = _counters(name)
+        for counter, value in counters.items():
+            current[counter] += value
+
+
+def collect(function, *args):
+    """
+    Call FUNCTION in a worker process; return its result and a snapshot()
+    of the statistics gathered meanwhile, for merge() in the parent.
+    """
+    reset()
+    result = function(*args)
+    return result, snapshot() if ENABLED else None
+
+
+def reset():
+    PHASES.clear()
+    del _stack[:]
+
+
+class CountingFile(object):
+    """
+    A file wrapper that counts the bytes read and written through it, for
+    the current phase or, while set, for the phase named by its phase
+    attribute, see add().
+    """
+
+    def __init__(self, stream, phase=None):
+        self._stream = stream
+        self.phase = phase
+
+    def read(self, *args):
+        data = self._stream.read(*args)
+        self._count(bytes_read=len(data))
+        return data
+
+    def write(self, data):
+        self._count(bytes_written=len(data))
+        return self._stream.write(data)
+
+    def _count(self, **counters):
+        if self.phase is None:
+            count(**counters)
+        else:
+            add(self.phase, **counters)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def report(format='text', stream=None):
+    """Print the counters of all phases, as a table or as JSON."""
+    stream = stream or sys.stderr
+    total = dict((counter, sum(counters[counter] for counters in
+                               PHASES.values()))
+                 for counter in COUNTERS)
+
+    if format == 'json':
+        import json
+        print(json.dumps({"phases": PHASES, "total": total}), file=stream)
+        return
+
+    row = "{:<12} {:>9} {:>7} {:>7} {:>8} {:>12} {:>13}"
+    print(row.format("phase", "seconds", "calls", "pages", "objects",
+                     "bytes read", "bytes written"), file=stream)
+    for name, counters in list(PHASES.items()) + [("total", total)]:
+        print(row.format(name, "{:.3f}".format(counters["seconds"]),
+                         *[counters[counter] for counter in COUNTERS[1:]]),
+              file=stream)
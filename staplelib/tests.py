@@ -1,13 +1,27 @@
 #!/usr/bin/env python
 
+import contextlib
+import io
+import json
+import mmap
 import os
+import pstats
+import re
 import shutil
+import subprocess
+import sys
 import tempfile
+import threading
 import unittest
 
-from PyPDF2.pdf import PdfFileReader
+from PyPDF2.generic import (ArrayObject, DecodedStreamObject,
+                            DictionaryObject, NameObject, NumberObject,
+                            createStringObject)
+from PyPDF2.pdf import PdfFileReader, PdfFileWriter
 
-from staplelib import main, CommandError
+import staplelib
+from staplelib import (main, iohelper, pagelabels, pageset, pdfwriter,
+                       server, stapler, CommandError)
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 TESTFILE_DIR = os.path.join(HERE, 'testfiles')
@@ -41,6 +55,406 @@ class TestStapler(unittest.TestCase):
             pdf = PdfFileReader(outputfile)
             self.assertEqual(pdf.getNumPages(), 6)
 
+    def test_cat_streaming(self):
+        """Streamed output has the same pages as the in-memory writer."""
+        run_stapler(['--streaming', 'cat', ONEPAGE_PDF, FIVEPAGE_PDF,
+                     FIVEPAGE_PDF, self.outputfile])
+        with open(self.outputfile, 'rb') as outputfile, \
+                open(FIVEPAGE_PDF, 'rb') as inputfile:
+            pdf = PdfFileReader(outputfile)
+            source = PdfFileReader(inputfile)
+            self.assertEqual(pdf.getNumPages(), 11)
+            self.assertEqual(pdf.getPage(3).extractText(),
+                             source.getPage(2).extractText())
+
+    def test_zip_streaming_encrypted(self):
+        """Streamed output can be encrypted."""
+        run_stapler(['--streaming', '-u', 'secret', 'zip', ONEPAGE_PDF,
+                     FIVEPAGE_PDF, self.outputfile])
+        with open(self.outputfile, 'rb') as outputfile:
+            pdf = PdfFileReader(outputfile)
+            self.assertTrue(pdf.isEncrypted)
+            self.assertTrue(pdf.decrypt('secret'))
+            self.assertEqual(pdf.getNumPages(), 6)
+
+    def test_streaming_failure_removes_output(self):
+        """A failing streamed job does not leave a partial file behind."""
+        with self.assertRaises(SystemExit):
+            run_stapler(['--streaming', 'cat', FIVEPAGE_PDF, '1', '3',
+                         ONEPAGE_PDF, '2', self.outputfile])
+        self.assertFalse(os.path.exists(self.outputfile))
+
+    def test_stats_and_profile(self):
+        """--stats reports per-phase counters, --profile writes pstats."""
+        profile = os.path.join(self.tmpdir, 'stapler.prof')
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            run_stapler(['--stats=json', '--profile', profile, 'cat',
+                         ONEPAGE_PDF, FIVEPAGE_PDF, self.outputfile])
+        report = json.loads(errors.getvalue())
+        self.assertEqual(report['phases']['pages']['pages'], 6)
+        self.assertEqual(report['phases']['write']['bytes_written'],
+                         os.path.getsize(self.outputfile))
+        self.assertGreater(report['total']['bytes_read'], 0)
+        self.assertTrue(pstats.Stats(profile).total_calls > 0)
+
+        # inputs parsed in the background are not charged to the main
+        # thread's phases
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            run_stapler(['-f', '--stats=json', '--prefetch', '2', 'cat',
+                         ONEPAGE_PDF, FIVEPAGE_PDF, self.outputfile])
+        report = json.loads(errors.getvalue())
+        self.assertGreater(report['phases']['prefetch']['bytes_read'], 0)
+
+    def test_cat_dedup(self):
+        """Identical streams from different inputs are written once."""
+        copy = os.path.join(self.tmpdir, 'copy.pdf')
+        shutil.copy(FIVEPAGE_PDF, copy)
+        run_stapler(['cat', FIVEPAGE_PDF, copy, 'plain.pdf'])
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            run_stapler(['-v', '--dedup', 'cat', FIVEPAGE_PDF, copy,
+                         self.outputfile])
+
+        self.assertIn('Deduplicated', output.getvalue())
+        self.assertLess(os.path.getsize(self.outputfile),
+                        0.6 * os.path.getsize('plain.pdf'))
+        with open(self.outputfile, 'rb') as outputfile:
+            pdf = PdfFileReader(outputfile)
+            self.assertEqual(pdf.getNumPages(), 10)
+            self.assertEqual(pdf.getPage(7).extractText(),
+                             pdf.getPage(2).extractText())
+
+    def test_streams_copied_as_is(self):
+        """Streamed and split outputs have the input's stream bytes."""
+        run_stapler(['--streaming', 'sel', FIVEPAGE_PDF, '4', '2',
+                     self.outputfile])
+        run_stapler(['split', FIVEPAGE_PDF])
+        with open(self.outputfile, 'rb') as outputfile, \
+                open('5page_2.pdf', 'rb') as splitfile, \
+                open(FIVEPAGE_PDF, 'rb') as inputfile:
+            source = PdfFileReader(inputfile)
+            for pdf, pagenos in [(PdfFileReader(outputfile), (3, 1)),
+                                 (PdfFileReader(splitfile), (1,))]:
+                for page, pageno in zip(pdf.pages, pagenos):
+                    original = source.getPage(pageno)
+                    self.assertEqual(page['/Contents']._data,
+                                     original['/Contents']._data)
+                    self.assertEqual(page['/Contents']['/Filter'],
+                                     '/FlateDecode')
+
+        with open(FIVEPAGE_PDF, 'rb') as inputfile, \
+                open('copy.pdf', 'wb') as outputfile:
+            writer = pdfwriter.StreamingPdfWriter(outputfile)
+            writer.addPage(PdfFileReader(inputfile).getPage(0))
+            writer.close()
+        self.assertTrue(writer.copied)
+
+    def test_compress(self):
+        """compress deflates uncompressed content streams."""
+        with open(FIVEPAGE_PDF, 'rb') as inputfile:
+            source = PdfFileReader(inputfile)
+            writer = PdfFileWriter()
+            for page in source.pages:
+                contents = DecodedStreamObject()
+                contents._data = page['/Contents'].getData() * 50
+                page[NameObject('/Contents')] = writer._addObject(contents)
+                writer.addPage(page)
+            with open('plain.pdf', 'wb') as outputfile:
+                writer.write(outputfile)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            run_stapler(['-v', '--jobs', '2', 'compress', 'plain.pdf',
+                         self.outputfile])
+        self.assertIn('Recompressed', output.getvalue())
+        self.assertLess(os.path.getsize(self.outputfile),
+                        os.path.getsize('plain.pdf') / 2)
+        with open(self.outputfile, 'rb') as outputfile, \
+                open('plain.pdf', 'rb') as inputfile:
+            pdf = PdfFileReader(outputfile)
+            source = PdfFileReader(inputfile)
+            for page, original in zip(pdf.pages, source.pages):
+                self.assertEqual(page['/Contents']['/Filter'],
+                                 '/FlateDecode')
+                self.assertEqual(page['/Contents'].getData(),
+                                 original['/Contents'].getData())
+
+    def test_cat_prefetch(self):
+        """--prefetch loads the inputs in the background as they are used."""
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            run_stapler(['-v', '--streaming', '--prefetch', '2', 'cat',
+                         ONEPAGE_PDF, FIVEPAGE_PDF, '5-4', ONEPAGE_PDF,
+                         FIVEPAGE_PDF, 'odd', self.outputfile])
+        self.assertIn('Prefetched 2 input(s)', output.getvalue())
+        self.assertIsNone(iohelper.PREFETCHER)
+        with open(self.outputfile, 'rb') as outputfile:
+            self.assertEqual(PdfFileReader(outputfile).getNumPages(), 7)
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertRaises(SystemExit, run_stapler,
+                              ['--prefetch', '2', 'cat', ONEPAGE_PDF,
+                               'missing.pdf', 'missing.pdf'])
+
+    def test_inputs_from_directory_and_listfile(self):
+        """Directories, globs and @listfiles expand to their PDF files."""
+        os.mkdir('in')
+        for i in range(6):
+            shutil.copy(FIVEPAGE_PDF, os.path.join('in', '{}.pdf'.format(i)))
+        with open('inputs.txt', 'w') as listfile:
+            listfile.write('# month end\n{}\n1\n\nin/\n'.format(ONEPAGE_PDF))
+
+        opened = []
+        original = iohelper._open_input
+        def open_input(filename):
+            opened.append(filename)
+            return original(filename)
+        iohelper._open_input = open_input
+        try:
+            # the readers' files are closed and reopened as needed
+            run_stapler(['--max-open-files', '2', 'cat', '@inputs.txt',
+                         'in/[0-2].pdf', '5-4', self.outputfile])
+        finally:
+            iohelper._open_input = original
+        self.assertGreater(len(opened), 10)
+
+        with open(self.outputfile, 'rb') as outputfile, \
+                open(FIVEPAGE_PDF, 'rb') as inputfile:
+            pdf = PdfFileReader(outputfile)
+            self.assertEqual(pdf.getNumPages(), 1 + 6 * 5 + 2 * 5 + 2)
+            self.assertEqual(pdf.getPage(40).extractText(),
+                             PdfFileReader(inputfile).getPage(4).extractText())
+
+    def test_output_cache(self):
+        """--cache reuses outputs of unchanged operations."""
+        shutil.copy(FIVEPAGE_PDF, 'a.pdf')
+
+        def cat(*arguments):
+            errors = io.StringIO()
+            with contextlib.redirect_stderr(errors):
+                run_stapler(['-f', '--cache', 'cache', '--cache-stats'] +
+                            list(arguments) + ['cat', 'A=a.pdf', 'A5-4',
+                                               ONEPAGE_PDF, self.outputfile])
+            with open(self.outputfile, 'rb') as outputfile:
+                return outputfile.read(), errors.getvalue()
+
+        first, report = cat()
+        self.assertIn('0 hit(s), 1 miss(es), 1 stored', report)
+        os.remove(self.outputfile)
+        # the same selection without the handle, and a touched input
+        os.utime('a.pdf', (0, 0))
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            run_stapler(['--cache', 'cache', '--cache-stats', 'cat', 'a.pdf',
+                         '5-4', ONEPAGE_PDF, 'other.pdf'])
+        self.assertIn('1 hit(s), 0 miss(es)', errors.getvalue())
+        second, report = cat()
+        self.assertEqual(first, second)
+        self.assertIn('1 hit(s), 0 miss(es), 0 stored, 0 evicted, 0 input(s) '
+                      'hashed', report)
+
+        shutil.copy(ONEPAGE_PDF, 'a.pdf')
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertRaises(SystemExit, cat)
+        shutil.copy(FIVEPAGE_PDF, 'a.pdf')
+        third, report = cat('--cache-size', '1', '--dedup')
+        self.assertIn('1 miss(es), 1 stored', report)
+        self.assertIn('2 evicted', report)
+        self.assertIn('0 output(s)', report)
+
+    def test_standard_streams(self):
+        """"-" reads an input from stdin and writes the output to stdout."""
+        def stapler(arguments, data):
+            env = dict(os.environ, PYTHONPATH=os.path.dirname(HERE))
+            return subprocess.run(
+                [sys.executable, '-c', 'import sys\n'
+                 'from staplelib import main\n'
+                 'main(sys.argv[1:])'] + arguments,
+                input=data, env=env, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, check=True)
+
+        with open(FIVEPAGE_PDF, 'rb') as inputfile:
+            data = inputfile.read()
+        # spilled to a temporary file beyond --spool-size
+        for spool_size in ('64M', '1k'):
+            result = stapler(['-v', '--spool-size', spool_size, 'sel', '-',
+                              '2-4', ONEPAGE_PDF, '-'], data)
+            self.assertIn(b'Using page: 4', result.stderr)
+            pdf = PdfFileReader(io.BytesIO(result.stdout))
+            self.assertEqual(pdf.getNumPages(), 4)
+        result = stapler(['-s', 'zip', '-', FIVEPAGE_PDF, '-'],
+                         result.stdout)
+        result = stapler(['--format', 'jsonl', 'info', '-'], result.stdout)
+        self.assertEqual(json.loads(result.stdout.decode('utf-8'))['pages'],
+                         9)
+
+        # a failed job does not finish its output
+        with self.assertRaises(subprocess.CalledProcessError) as e:
+            stapler(['--streaming', 'cat', FIVEPAGE_PDF, '1-2',
+                     ONEPAGE_PDF, '3', '-'], b'')
+        self.assertNotIn(b'%%EOF', e.exception.stdout)
+
+        # the standard input is never the output file
+        shutil.copy(ONEPAGE_PDF, self.outputfile)
+        stapler(['-f', '--incremental', 'sel', '-', '1-2', self.outputfile],
+                data)
+        with open(self.outputfile, 'rb') as outputfile:
+            self.assertEqual(PdfFileReader(outputfile).getNumPages(), 2)
+
+    def test_prune(self):
+        """--prune leaves out the resources selected pages do not use."""
+        writer = PdfFileWriter()
+
+        def stream(data, **entries):
+            obj = DecodedStreamObject()
+            obj._data = data
+            obj.update(dict((NameObject(name), value)
+                            for name, value in entries.items()))
+            return writer._addObject(obj)
+
+        def font(name):
+            return writer._addObject(DictionaryObject({
+                NameObject('/Type'): NameObject('/Font'),
+                NameObject('/Subtype'): NameObject('/Type1'),
+                NameObject('/BaseFont'): NameObject(name)}))
+
+        # one resource dictionary shared by all pages, as in catalogues
+        resources = writer._addObject(DictionaryObject({
+            NameObject('/Font'): DictionaryObject({
+                NameObject('/F1'): font('/Helvetica'),
+                NameObject('/F2'): font('/Courier')}),
+            NameObject('/XObject'): DictionaryObject({
+                NameObject('/Im1'): stream(
+                    b'\xff' * 30000, **{'/Subtype': NameObject('/Image')}),
+                # a form without resources uses those of the page
+                NameObject('/Fm1'): stream(
+                    b'BT /F2 9 Tf (form) Tj ET',
+                    **{'/Subtype': NameObject('/Form')})})}))
+        for content in (b'BT /F1 12 Tf (text) Tj ET', b'/Im1 Do',
+                        b'/Fm1 Do'):
+            page = writer.addBlankPage(100, 100)
+            page[NameObject('/Resources')] = resources
+            page[NameObject('/Contents')] = stream(content)
+        with open('catalogue.pdf', 'wb') as outputfile:
+            writer.write(outputfile)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            run_stapler(['-v', '--prune', 'sel', 'catalogue.pdf', '1',
+                         self.outputfile])
+        self.assertIn('Pruned 3 unused resource(s), leaving out 3 '
+                      'object(s) with 30024 bytes', output.getvalue())
+        self.assertLess(os.path.getsize(self.outputfile), 2000)
+
+        for options in ([], ['--streaming']):
+            run_stapler(options + ['--prune', '--force', 'del',
+                                   'catalogue.pdf', '1-2', self.outputfile])
+            with open(self.outputfile, 'rb') as outputfile:
+                resources = PdfFileReader(outputfile).getPage(0)[
+                    '/Resources']
+                self.assertEqual(sorted(resources['/Font']), ['/F2'])
+                self.assertEqual(sorted(resources['/XObject']), ['/Fm1'])
+
+        # the input's own resources are unchanged
+        run_stapler(['--force', 'sel', 'catalogue.pdf', '1',
+                     self.outputfile])
+        with open(self.outputfile, 'rb') as outputfile:
+            self.assertEqual(sorted(PdfFileReader(outputfile).getPage(0)[
+                '/Resources']['/Font']), ['/F1', '/F2'])
+
+    def test_object_streams(self):
+        """--object-streams packs objects with a cross-reference stream."""
+        for options in ([], ['--ownerpw', 'secret']):
+            run_stapler(options + ['--object-streams', '2', '--force', 'cat',
+                                   FIVEPAGE_PDF, ONEPAGE_PDF,
+                                   self.outputfile])
+            with open(self.outputfile, 'rb') as outputfile, \
+                    open(FIVEPAGE_PDF, 'rb') as inputfile:
+                data = outputfile.read()
+                self.assertTrue(data.startswith(b'%PDF-1.5\n'))
+                self.assertNotIn(b'\nxref\n', data)
+                pdf = PdfFileReader(outputfile)
+                if options:
+                    self.assertTrue(pdf.decrypt(''))
+                source = PdfFileReader(inputfile)
+                self.assertTrue(pdf.xref_objStm)
+                self.assertEqual(pdf.getNumPages(), 6)
+                self.assertEqual(pdf.getPage(4).extractText(),
+                                 source.getPage(4).extractText())
+
+        with self.assertRaises(SystemExit), \
+                contextlib.redirect_stderr(io.StringIO()):
+            run_stapler(['--object-streams', '0', '--force', 'cat',
+                         ONEPAGE_PDF, self.outputfile])
+
+    def test_linearize(self):
+        """--linearize writes files a viewer can show page by page."""
+        def bits(data, position, widths):
+            values = []
+            for width in widths:
+                value = 0
+                for i in range(position, position + width):
+                    value = value << 1 | (data[i // 8] >> (7 - i % 8)) & 1
+                values.append(value)
+                position += width
+            return values, position
+
+        umask = os.umask(0o022)
+        try:
+            run_stapler(['--linearize', 'cat', ONEPAGE_PDF, self.outputfile])
+        finally:
+            os.umask(umask)
+        # readable by a web server, like any other output
+        self.assertEqual(os.stat(self.outputfile).st_mode & 0o777, 0o644)
+
+        for options in ([], ['--streaming']):
+            run_stapler(options + ['--linearize', '--force', 'cat',
+                                   FIVEPAGE_PDF, ONEPAGE_PDF, FIVEPAGE_PDF,
+                                   self.outputfile])
+            with open(self.outputfile, 'rb') as outputfile:
+                data = outputfile.read()
+                pdf = PdfFileReader(outputfile)
+                self.assertEqual(pdf.getNumPages(), 11)
+                offsets = [pdf.xref[0][pdf.getPage(i).indirectRef.idnum]
+                           for i in range(11)]
+                first = pdf.getPage(0).indirectRef.idnum
+
+            # the linearization parameters come first, PDF 1.7 annex F
+            parameters = re.search(
+                br'^%PDF-1\.\d\n%[^\n]*\n\d+ 0 obj\n<< /Linearized 1 '
+                br'/L (\d+) /H \[ (\d+) (\d+) \] /O (\d+) /E (\d+) '
+                br'/N (\d+) /T (\d+) >>', data)
+            length, hint, hint_length, page, end, pages, xref = map(
+                int, parameters.groups())
+            self.assertEqual(length, len(data))
+            self.assertEqual((page, pages), (first, 11))
+            self.assertLess(offsets[0], end)
+            self.assertEqual(data[xref + 1:xref + 21],
+                             b'0000000000 65535 f \n')
+
+            # the page offset hint table locates every page
+            hint_data = data[hint:hint + hint_length]
+            stream = hint_data.index(b'stream\n') + len(b'stream\n')
+            header, position = bits(hint_data[stream:], 0, (
+                32, 32, 16, 32, 16, 32, 16, 32, 16, 16, 16, 16, 16))
+            self.assertEqual(header[1], offsets[0])
+            position += 11 * header[2] + -(11 * header[2]) % 8
+            lengths, position = bits(hint_data[stream:], position,
+                                     [header[4]] * 11)
+            location = header[1]
+            for offset, delta in zip(offsets, lengths):
+                # the hint tables leave out the hint stream itself
+                self.assertEqual(offset, location + (
+                    hint_length if location >= hint else 0))
+                location += header[3] + delta
+
+        with self.assertRaises(SystemExit), \
+                contextlib.redirect_stderr(io.StringIO()):
+            run_stapler(['--linearize', '--force', '--ownerpw', 'secret',
+                         'cat', ONEPAGE_PDF, self.outputfile])
+
     def test_sel_one_page(self):
         """Test select of a one page from a PDF file."""
         run_stapler(['sel', 'A=' + FIVEPAGE_PDF, 'A2', self.outputfile])
@@ -57,6 +471,123 @@ class TestStapler(unittest.TestCase):
             pdf = PdfFileReader(outputfile)
             self.assertEqual(pdf.getNumPages(), 3)
 
+    def test_sel_handle_parsed_once(self):
+        """Repeated handle references share one reader per input."""
+        run_stapler(['sel', 'A=' + FIVEPAGE_PDF, 'A1', 'A3R', 'A1D',
+                     self.outputfile])
+        with open(self.outputfile, 'rb') as outputfile:
+            pdf = PdfFileReader(outputfile)
+            self.assertEqual(pdf.getNumPages(), 3)
+            self.assertEqual(pdf.getPage(0).get('/Rotate', 0), 0)
+            self.assertEqual(pdf.getPage(1).get('/Rotate', 0), 90)
+            self.assertEqual(pdf.getPage(2).get('/Rotate', 0), 180)
+
+    def test_read_pdf_cache(self):
+        """read_pdf returns the same reader until close_pdfs is called."""
+        pdf = iohelper.read_pdf(FIVEPAGE_PDF)
+        self.assertIs(iohelper.read_pdf(FIVEPAGE_PDF), pdf)
+        iohelper.close_pdfs()
+        self.assertTrue(pdf.stream.closed)
+        self.assertIsNot(iohelper.read_pdf(FIVEPAGE_PDF), pdf)
+        iohelper.close_pdfs()
+
+    def test_inputs_memory_mapped(self):
+        """Inputs are mapped into memory, unless that is impossible."""
+        pdf = iohelper.read_pdf(FIVEPAGE_PDF)
+        self.assertIsInstance(pdf.stream, mmap.mmap)
+        self.assertEqual(pdf.getNumPages(), 5)
+        iohelper.close_pdfs()
+
+        open('empty.pdf', 'wb').close()
+        stream = iohelper._open_input('empty.pdf')
+        self.assertEqual(stream.read(), b'')
+        stream.close()
+
+    def test_del_incremental(self):
+        """--incremental appends the edit to the input file."""
+        shutil.copy(FIVEPAGE_PDF, self.outputfile)
+        run_stapler(['--incremental', 'sel', self.outputfile, '5', '2-4R',
+                     self.outputfile])
+        run_stapler(['--incremental', 'del', self.outputfile, '3',
+                     self.outputfile])
+        with open(FIVEPAGE_PDF, 'rb') as inputfile:
+            original = inputfile.read()
+        with open(self.outputfile, 'rb') as outputfile:
+            self.assertEqual(outputfile.read(len(original)), original)
+            pdf = PdfFileReader(outputfile)
+            self.assertEqual(pdf.getNumPages(), 3)
+            self.assertEqual([page.get('/Rotate') for page in pdf.pages],
+                             [None, 90, 90])
+
+        # pages used twice, object streams and output passwords fall back to
+        # rewriting the file, which is replaced only once the new version is complete
+        run_stapler(['-f', '--incremental', 'sel', self.outputfile, '1',
+                     '1-3', self.outputfile])
+        run_stapler(['-f', '--incremental', '--object-streams', '10', 'sel',
+                     self.outputfile, '1-4', self.outputfile])
+        with open(self.outputfile, 'rb') as outputfile:
+            self.assertIn(b'/ObjStm', outputfile.read())
+        run_stapler(['-f', '--incremental', '-u', 'pw', 'del',
+                     self.outputfile, '1', self.outputfile])
+        with open(self.outputfile, 'rb') as outputfile:
+            pdf = PdfFileReader(outputfile)
+            self.assertTrue(pdf.decrypt('pw'))
+            self.assertEqual(pdf.getNumPages(), 3)
+
+    def test_page_labels(self):
+        """Pages can be listed and selected by their labels."""
+        with open(FIVEPAGE_PDF, 'rb') as inputfile:
+            writer = PdfFileWriter()
+            writer.appendPagesFromReader(PdfFileReader(inputfile))
+            # roman front matter, then A-1, A-2, ... in a child node
+            nums = ArrayObject([
+                NumberObject(2), DictionaryObject({
+                    NameObject('/S'): NameObject('/D'),
+                    NameObject('/P'): createStringObject('A-')})])
+            writer._root_object[NameObject('/PageLabels')] = \
+                DictionaryObject({NameObject('/Kids'): ArrayObject([
+                    writer._addObject(DictionaryObject({
+                        NameObject('/Nums'): ArrayObject([
+                            NumberObject(0), DictionaryObject({
+                                NameObject('/S'): NameObject('/r')})])})),
+                    writer._addObject(DictionaryObject({
+                        NameObject('/Nums'): nums}))])})
+            with open('labeled.pdf', 'wb') as outputfile:
+                writer.write(outputfile)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            run_stapler(['list-log', 'labeled.pdf'])
+        self.assertEqual(output.getvalue().splitlines(),
+                         ['i\t1', 'ii\t2', 'A-1\t3', 'A-2\t4', 'A-3\t5'])
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            run_stapler(['-v', 'sel', 'L=labeled.pdf', 'L:A-3-A-2',
+                         'L:iiR', self.outputfile])
+        self.assertEqual(
+            [line for line in output.getvalue().splitlines()
+             if line.startswith('Using page')],
+            ['Using page: 5 (rotation: 0 deg.)',
+             'Using page: 4 (rotation: 0 deg.)',
+             'Using page: 2 (rotation: 90 deg.)'])
+        with self.assertRaises(SystemExit), \
+                contextlib.redirect_stderr(io.StringIO()):
+            run_stapler(['sel', 'labeled.pdf', ':A-9', 'other.pdf'])
+
+    def test_page_labels_restarted(self):
+        """A label used by several ranges is that of the first page."""
+        def numbering(start):
+            return DictionaryObject({NameObject('/S'): NameObject('/D'),
+                                     NameObject('/St'): NumberObject(start)})
+        labels = pagelabels.PageLabels(DictionaryObject({
+            NameObject('/Nums'): ArrayObject([
+                NumberObject(0), numbering(1), NumberObject(2), numbering(1),
+                NumberObject(4), numbering(2)])}), 7)
+        self.assertEqual(list(labels), ['1', '2', '1', '2', '2', '3', '4'])
+        self.assertEqual([labels.page(label) for label in '12345'],
+                         [1, 2, 6, 7, None])
+
     def test_del_one_page(self):
         """Test del command for inverse select of one page."""
         run_stapler(['del', 'A=' + FIVEPAGE_PDF, 'A1', self.outputfile])
@@ -73,6 +604,35 @@ class TestStapler(unittest.TestCase):
             pdf = PdfFileReader(outputfile)
             self.assertEqual(pdf.getNumPages(), 2)
 
+    def test_page_selection_syntax(self):
+        """odd, even, steps and negative numbers select pages lazily."""
+        def pages(*ranges):
+            operations = iohelper.parse_ranges([FIVEPAGE_PDF] + list(ranges))
+            return [p for p, r in operations[0]['pages']]
+
+        self.assertEqual(pages('odd'), [1, 3, 5])
+        self.assertEqual(pages('evenR'), [2, 4])
+        self.assertEqual(pages('1-end:2'), [1, 3, 5])
+        self.assertEqual(pages('end-1:3'), [5, 2])
+        self.assertEqual(pages('4-1:odd'), [3, 1])
+        self.assertEqual(pages('-1', '-3--2'), [5, 3, 4])
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertRaises(SystemExit, run_stapler,
+                              ['sel', FIVEPAGE_PDF, '-6', self.outputfile])
+
+        full = pageset.PageSet.all(100000)
+        scattered = pageset.PageSet((p, p) for p in range(1, 100001, 5))
+        remaining = full - scattered
+        self.assertEqual(len(remaining), 80000)
+        self.assertNotIn(6, remaining)
+        self.assertIn(7, remaining)
+        self.assertEqual(remaining & scattered, pageset.PageSet())
+        self.assertEqual(remaining | scattered, full)
+
+        run_stapler(['del', FIVEPAGE_PDF, 'even', '-1', self.outputfile])
+        with open(self.outputfile, 'rb') as outputfile:
+            self.assertEqual(PdfFileReader(outputfile).getNumPages(), 2)
+
     def test_split(self):
         """Make sure a file is properly split into pages."""
         run_stapler(['split', FIVEPAGE_PDF])
@@ -84,6 +644,61 @@ class TestStapler(unittest.TestCase):
                 pdf = PdfFileReader(pdf_file)
                 self.assertEqual(pdf.getNumPages(), 1)
 
+    def test_split_jobs(self):
+        """Make sure a parallel split writes the same files as a serial one."""
+        run_stapler(['--jobs', '3', 'split', FIVEPAGE_PDF, ONEPAGE_PDF])
+
+        filelist = sorted(os.listdir(self.tmpdir))
+        self.assertEqual(filelist, ['1page_1.pdf', '5page_1.pdf',
+                                    '5page_2.pdf', '5page_3.pdf',
+                                    '5page_4.pdf', '5page_5.pdf'])
+        for f in filelist:
+            with open(os.path.join(self.tmpdir, f), 'rb') as pdf_file:
+                pdf = PdfFileReader(pdf_file)
+                self.assertEqual(pdf.getNumPages(), 1)
+
+    def test_split_chunks(self):
+        """split writes chunks of pages by count, size or bookmarks."""
+        os.mkdir('chunks')
+
+        def split(*arguments):
+            run_stapler(['-d', 'chunks'] + list(arguments))
+            counts = {}
+            for f in os.listdir('chunks'):
+                path = os.path.join('chunks', f)
+                with open(path, 'rb') as pdf_file:
+                    counts[f] = (PdfFileReader(pdf_file).getNumPages(),
+                                 os.path.getsize(path))
+                os.remove(path)
+            return counts
+
+        burst = split('split', FIVEPAGE_PDF)
+        chunked = split('--chunk-pages', '2', 'split', FIVEPAGE_PDF)
+        self.assertEqual(sorted((f, n) for f, (n, size) in chunked.items()),
+                         [('5page_1.pdf', 2), ('5page_3.pdf', 2),
+                          ('5page_5.pdf', 1)])
+        # shared resources are written once per file
+        self.assertLess(sum(size for n, size in chunked.values()),
+                        sum(size for n, size in burst.values()))
+
+        self.assertEqual(len(split('--chunk-size', '1', 'split',
+                                   FIVEPAGE_PDF)), 5)
+        self.assertEqual(list(split('--jobs', '2', '--chunk-size', '1G',
+                                    'split', FIVEPAGE_PDF)), ['5page_1.pdf'])
+
+        with open(FIVEPAGE_PDF, 'rb') as inputfile:
+            writer = PdfFileWriter()
+            writer.appendPagesFromReader(PdfFileReader(inputfile))
+            chapter = writer.addBookmark('Chapter 1', 1)
+            writer.addBookmark('Section 1.1', 2, chapter)
+            writer.addBookmark('Chapter 2', 3)
+            with open('book.pdf', 'wb') as outputfile:
+                writer.write(outputfile)
+        chunked = split('--chunk-bookmarks', 'split', 'book.pdf')
+        self.assertEqual(sorted((f, n) for f, (n, size) in chunked.items()),
+                         [('book_1.pdf', 1), ('book_2.pdf', 2),
+                          ('book_4.pdf', 2)])
+
     def test_background(self):
         """Test background."""
         run_stapler(['background', ONEPAGE_PDF, FIVEPAGE_PDF, self.outputfile])
@@ -92,6 +707,28 @@ class TestStapler(unittest.TestCase):
             pdf = PdfFileReader(outputfile)
             self.assertEqual(pdf.getNumPages(), 5)
 
+    def test_background_form_xobject(self):
+        """An overlay page is stored once and drawn as a Form XObject."""
+        run_stapler(['background', FIVEPAGE_PDF, ONEPAGE_PDF,
+                     '1', '1', '1', '1', '1R', self.outputfile])
+        with open(self.outputfile, 'rb') as outputfile:
+            pdf = PdfFileReader(outputfile)
+            forms = set()
+            for page in pdf.pages:
+                xobjects = page['/Resources']['/XObject']
+                self.assertEqual(list(xobjects), ['/StaplerForm0'])
+                forms.add(xobjects.raw_get('/StaplerForm0').idnum)
+            self.assertEqual(len(forms), 1)
+            form = pdf.getPage(0)['/Resources']['/XObject']['/StaplerForm0']
+            self.assertEqual(form['/Subtype'], '/Form')
+
+            # the rotated overlay is turned to match the unrotated page
+            draw = [pdf.getPage(pageno)['/Contents'][-1].getObject().getData()
+                    for pageno in (0, 4)]
+            self.assertEqual(draw, [b'Q q /StaplerForm0 Do Q\n',
+                                    b'Q q 0 -1 1 0 0 595 cm /StaplerForm0 '
+                                    b'Do Q\n'])
+
     def test_zip(self):
         """Test zip."""
         run_stapler(['zip', ONEPAGE_PDF, FIVEPAGE_PDF, self.outputfile])
@@ -100,12 +737,206 @@ class TestStapler(unittest.TestCase):
             pdf = PdfFileReader(outputfile)
             self.assertEqual(pdf.getNumPages(), 6)
 
+    def test_info_jsonl(self):
+        """info reports page counts and metadata as JSON lines."""
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            run_stapler(['--jobs', '2', '--format', 'jsonl', 'info',
+                         FIVEPAGE_PDF, ONEPAGE_PDF])
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([(l['file'], l['pages']) for l in lines],
+                         [(FIVEPAGE_PDF, 5), (ONEPAGE_PDF, 1)])
+        self.assertEqual(lines[0]['metadata']['/Producer'],
+                         'OpenOffice.org 3.1')
+
+    def test_trailer_reader(self):
+        """The trailer-only reader agrees with PdfFileReader."""
+        run_stapler(['cat', FIVEPAGE_PDF, FIVEPAGE_PDF, self.outputfile])
+        for filename in (FIVEPAGE_PDF, self.outputfile):
+            pdf = iohelper.read_trailer(filename)
+            with open(filename, 'rb') as f:
+                full = PdfFileReader(f)
+                self.assertEqual(pdf.getNumPages(), full.getNumPages())
+                self.assertEqual(dict(pdf.documentInfo),
+                                 dict(full.documentInfo))
+            pdf.stream.close()
+
+    def test_batch(self):
+        """A failing job in a batch does not stop the others."""
+        manifest = os.path.join(self.tmpdir, 'manifest.jsonl')
+        with open(manifest, 'w') as f:
+            f.write(json.dumps(['cat', FIVEPAGE_PDF, 'one.pdf']) + '\n')
+            f.write(json.dumps(['sel', ONEPAGE_PDF, '3', 'two.pdf']) + '\n')
+            f.write(json.dumps(['cat', ONEPAGE_PDF, '-']) + '\n')
+            f.write(json.dumps(['cat', '-', 'four.pdf']) + '\n')
+            f.write('\n')
+            f.write(json.dumps({'id': 'last',
+                                'args': ['zip', ONEPAGE_PDF, FIVEPAGE_PDF,
+                                         'three.pdf']}) + '\n')
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), \
+                self.assertRaises(SystemExit) as e:
+            run_stapler(['--jobs', '2', 'batch', manifest])
+        self.assertEqual(e.exception.code, 1)
+
+        results = [json.loads(l) for l in output.getvalue().splitlines()]
+        self.assertEqual([(r['id'], r['status']) for r in results],
+                         [(1, 'ok'), (2, 'error'), (3, 'error'), (4, 'error'),
+                          ('last', 'ok')])
+        self.assertIn('standard input and output', results[2]['error'])
+        self.assertTrue(iohelper.STANDARD_STREAMS)
+        self.assertTrue(os.path.isfile('one.pdf'))
+        self.assertFalse(os.path.exists('two.pdf'))
+        self.assertFalse(os.path.exists('four.pdf'))
+        with open('three.pdf', 'rb') as outputfile:
+            self.assertEqual(PdfFileReader(outputfile).getNumPages(), 6)
+
+    def test_batch_warm_readers(self):
+        """Only the most recently used inputs stay open between jobs."""
+        from staplelib import batch
+        defaults, _ = stapler.parse_arguments(['batch'])
+        inputs = []
+        for i in range(3):
+            inputs.append('input{}.pdf'.format(i))
+            shutil.copy(FIVEPAGE_PDF, inputs[-1])
+        warm_readers = batch.WARM_READERS
+        batch.WARM_READERS = 2
+        try:
+            for i, name in enumerate(inputs):
+                result = batch.run_job(i, ['cat', name, 'out' + name], defaults)
+                self.assertEqual(result['status'], 'ok')
+            self.assertEqual(len(iohelper.READERS), 2)
+            self.assertIs(staplelib.OPTIONS, defaults)
+        finally:
+            batch.WARM_READERS = warm_readers
+            iohelper.close_pdfs()
+
+    def test_serve_and_client(self):
+        """A client runs its job on the server, with the client's options."""
+        socket_path = os.path.join(self.tmpdir, 'stapler.sock')
+        (staplelib.OPTIONS, args) = stapler.parse_arguments(
+            ['--jobs', '1', 'serve'])
+        stapler_server = server.make_server(socket_path, 1)
+        self.assertEqual(os.stat(socket_path).st_mode & 0o777, 0o600)
+        thread = threading.Thread(target=stapler_server.serve_forever)
+        thread.start()
+        try:
+            run_stapler(['--socket', socket_path, 'client', 'cat',
+                         FIVEPAGE_PDF, '2-3', 'served.pdf'])
+            with open('served.pdf', 'rb') as outputfile:
+                self.assertEqual(PdfFileReader(outputfile).getNumPages(), 2)
+
+            # the output exists now, so only --force makes this work
+            with self.assertRaises(SystemExit):
+                run_stapler(['--socket', socket_path, 'client', 'cat',
+                             ONEPAGE_PDF, 'served.pdf'])
+            run_stapler(['--socket', socket_path, '--force', 'client', 'cat',
+                         ONEPAGE_PDF, 'served.pdf'])
+            with open('served.pdf', 'rb') as outputfile:
+                self.assertEqual(PdfFileReader(outputfile).getNumPages(), 1)
+
+            # as if the socket had been created by another user
+            getuid = os.getuid
+            os.getuid = lambda: getuid() + 1
+            try:
+                with self.assertRaises(SystemExit), \
+                        contextlib.redirect_stderr(io.StringIO()):
+                    run_stapler(['--socket', socket_path, '--force',
+                                 'client', 'cat', ONEPAGE_PDF, 'served.pdf'])
+            finally:
+                os.getuid = getuid
+        finally:
+            stapler_server.shutdown()
+            stapler_server.server_close()
+            stapler_server.executor.shutdown()
+            thread.join()
+
+    def test_default_socket(self):
+        """The default socket is in a directory only the user can use."""
+        environ = dict(os.environ)
+        os.environ.pop('XDG_RUNTIME_DIR', None)
+        tempdir = tempfile.tempdir
+        tempfile.tempdir = self.tmpdir
+        try:
+            path = server.default_socket()
+            directory = os.path.dirname(path)
+            self.assertEqual(os.path.dirname(directory), self.tmpdir)
+            self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+            self.assertEqual(server.default_socket(), path)
+
+            # e.g., created by another user first
+            os.chmod(directory, 0o755)
+            self.assertRaises(CommandError, server.default_socket)
+
+            os.environ['XDG_RUNTIME_DIR'] = self.tmpdir
+            self.assertEqual(server.default_socket(),
+                             os.path.join(self.tmpdir, 'stapler.sock'))
+        finally:
+            tempfile.tempdir = tempdir
+            os.environ.clear()
+            os.environ.update(environ)
+
     def test_output_file_already_exists(self):
         """Test zip."""
         with self.assertRaises(SystemExit) as e:
             run_stapler(['zip', ONEPAGE_PDF, FIVEPAGE_PDF])
         self.assertEqual(e.exception.code, 1)
 
+    def test_output_replaces_input(self):
+        """With -f, the output can replace a (memory-mapped) input."""
+        shutil.copy(FIVEPAGE_PDF, 'input.pdf')
+        os.chmod('input.pdf', 0o640)
+        for options, pages in (([], 4), (['--streaming'], 3)):
+            run_stapler(options + ['-f', 'del', 'input.pdf', '1',
+                                   'input.pdf'])
+            with open('input.pdf', 'rb') as inputfile:
+                self.assertEqual(PdfFileReader(inputfile).getNumPages(),
+                                 pages)
+        self.assertEqual(os.stat('input.pdf').st_mode & 0o777, 0o640)
+        # no temporary files are left behind
+        self.assertEqual(os.listdir('.'), ['input.pdf'])
+
+
+class TestStartup(unittest.TestCase):
+    """Startup cost of the stapler command line."""
+
+    # cumulative import time of staplelib.stapler, in microseconds
+    IMPORT_BUDGET = 100000
+
+    def run_python(self, code, *options):
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(HERE))
+        return subprocess.run([sys.executable] + list(options) + ['-c', code],
+                              env=env, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, universal_newlines=True)
+
+    def test_pdf_library_not_imported(self):
+        """--help and invalid modes do not import the PDF library."""
+        for arguments in (['--help'], ['no-such-mode']):
+            result = self.run_python(
+                'import sys\n'
+                'from staplelib import main\n'
+                'try:\n'
+                '    main({!r})\n'
+                'except SystemExit:\n'
+                '    pass\n'
+                'print(sorted(m for m in sys.modules if "PyPDF2" in m or\n'
+                '             m in ("staplelib.commands",\n'
+                '                   "staplelib.iohelper")))'.format(arguments))
+            self.assertEqual(result.stdout.splitlines()[-1], "[]")
+
+    @unittest.skipIf(sys.version_info < (3, 7), '-X importtime is new in 3.7')
+    def test_import_time_budget(self):
+        """Importing the command line stays within the time budget."""
+        result = self.run_python('import staplelib.stapler', '-X',
+                                 'importtime')
+        # "import time: self [us] | cumulative | imported package"
+        cumulative = [int(line.split('|')[1])
+                      for line in result.stderr.splitlines()
+                      if line.split('|')[-1].strip() == 'staplelib.stapler']
+        self.assertEqual(len(cumulative), 1)
+        self.assertLess(cumulative[0], self.IMPORT_BUDGET)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,148 @@
+"""Read the document-level objects of a PDF without parsing all of it."""
+
+import re
+
+try:
+    from PyPDF2 import PdfFileReader
+    from PyPDF2.generic import DictionaryObject, NullObject, readObject
+    from PyPDF2.utils import readNonWhitespace
+except ImportError:
+    from pyPdf import PdfFileReader
+    from pyPdf.generic import DictionaryObject, NullObject, readObject
+    from pyPdf.utils import readNonWhitespace
+
+
+XREF_ENTRY = re.compile(br'(\d{10}) (\d{5}) ([nf])')
+XREF_SUBSECTION = re.compile(br'\s*(\d+) +(\d+) *(?:\r\n|\r|\n)')
+
+
+class UnsupportedFile(Exception):
+    """The file needs a full PdfFileReader (encryption, xref streams...)."""
+    pass
+
+
+class TrailerReader(object):
+    """
+    A minimal reader for the trailer, /Info and /Root of a PDF file.
+
+    PdfFileReader parses the whole cross-reference table up front. Classic
+    xref tables consist of fixed-size 20 byte entries, so this reader only
+    records where each subsection starts and seeks straight to the entry of
+    an object when it is needed. Only the handful of objects that are
+    actually looked up are ever read.
+
+    Files it cannot handle raise UnsupportedFile, in which case callers
+    should fall back to PdfFileReader.
+    """
+
+    strict = False
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.resolvedObjects = {}
+        self._subsections = []  # (first idnum, count, offset), newest first
+        self.trailer = DictionaryObject()
+
+        try:
+            self.startxref = self._find_startxref()
+            self._read_xref_sections(self.startxref)
+        except UnsupportedFile:
+            raise
+        except Exception as e:
+            raise UnsupportedFile(e)
+        if "/Encrypt" in self.trailer:
+            raise UnsupportedFile("File is encrypted")
+
+    def _find_startxref(self):
+        self.stream.seek(0, 2)
+        size = self.stream.tell()
+        self.stream.seek(max(0, size - 1024))
+        tail = self.stream.read()
+        match = re.match(br'startxref\s+(\d+)',
+                         tail[tail.rfind(b'startxref'):])
+        if not match:
+            raise UnsupportedFile("startxref not found")
+        return int(match.group(1))
+
+    def _read_xref_sections(self, offset):
+        seen = set()
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            self.stream.seek(offset)
+            chunk = self.stream.read(4)
+            if chunk != b'xref':
+                raise UnsupportedFile("Cross-reference streams")
+
+            position = offset + 4
+            while True:
+                self.stream.seek(position)
+                chunk = self.stream.read(64)
+                stripped = chunk.lstrip()
+                if stripped.startswith(b'trailer'):
+                    self.stream.seek(position + len(chunk) - len(stripped) +
+                                     len(b'trailer'))
+                    readNonWhitespace(self.stream)
+                    self.stream.seek(-1, 1)
+                    trailer = readObject(self.stream, self)
+                    break
+                match = XREF_SUBSECTION.match(chunk)
+                if not match:
+                    raise UnsupportedFile("Malformed xref table")
+                first, count = int(match.group(1)), int(match.group(2))
+                self._subsections.append((first, count,
+                                          position + match.end()))
+                position += match.end() + 20 * count
+
+            for key, value in trailer.items():
+                # newer sections take precedence
+                if key not in self.trailer:
+                    self.trailer[key] = value
+            if "/XRefStm" in trailer:
+                raise UnsupportedFile("Hybrid cross-reference file")
+            offset = trailer.get("/Prev")
+
+    def _object_offset(self, idnum, generation):
+        for first, count, position in self._subsections:
+            if first <= idnum < first + count:
+                self.stream.seek(position + 20 * (idnum - first))
+                match = XREF_ENTRY.match(self.stream.read(20))
+                if not match:
+                    raise UnsupportedFile("Malformed xref entry")
+                if match.group(3) == b'f':
+                    return None
+                if int(match.group(2)) != generation:
+                    return None
+                return int(match.group(1))
+        return None
+
+    def getObject(self, indirectReference):
+        key = (indirectReference.generation, indirectReference.idnum)
+        if key in self.resolvedObjects:
+            return self.resolvedObjects[key]
+
+        offset = self._object_offset(indirectReference.idnum,
+                                     indirectReference.generation)
+        if offset is None:
+            # references to undefined objects are null objects
+            obj = NullObject()
+        else:
+            self.stream.seek(offset)
+            self.readObjectHeader(self.stream)
+            obj = readObject(self.stream, self)
+        self.resolvedObjects[key] = obj
+        return obj
+
+    # these only need getObject() and trailer
+    readObjectHeader = PdfFileReader.readObjectHeader
+    getDocumentInfo = PdfFileReader.getDocumentInfo
+    documentInfo = property(lambda self: self.getDocumentInfo())
+
+    def getNumPages(self):
+        """Return the page count of the page tree root."""
+        try:
+            count = self.trailer["/Root"]["/Pages"]["/Count"]
+        except (KeyError, TypeError):
+            count = None
+        if not isinstance(count, int):
+            raise UnsupportedFile("Page tree has no /Count")
+        return count